@@ -27,6 +27,9 @@ __version__=json.loads(open('synapseclient/synapsePythonClient').read())['latest
 
 #make sure not to overwrite existing .synapseConfig with our example one
 data_files = [(expanduser('~'), ['synapseclient/.synapseConfig'])] if not exists(expanduser('~/.synapseConfig')) else []
+
+#the asyncio client uses syntax that older versions of Python can't parse
+exclude_packages = ['synapseclient.aio'] if sys.version_info < (3, 5) else []
 setup(name='synapseclient',
     version=__version__,
     description=description,
@@ -36,7 +39,7 @@ setup(name='synapseclient',
     author='Synapse Team',
     author_email='platform@sagebase.org',
     license='Apache',
-    packages=find_packages(),
+    packages=find_packages(exclude=exclude_packages),
     install_requires=[
         'requests>=1.2',
         'six',
@@ -48,6 +51,7 @@ setup(name='synapseclient',
         'pandas':  ["pandas"],
         'pysftp': ["pysftp>=0.2.8"],
         'boto3' : ["boto3"],
+        'aio': ["aiohttp"],
         ':sys_platform=="linux2" or sys_platform=="linux"': ['keyrings.alt'],
     },
     test_suite='nose.collector',
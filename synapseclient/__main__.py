@@ -67,6 +67,7 @@ import six
 
 import argparse
 import os
+import io
 import collections
 import sys
 import synapseclient
@@ -76,6 +77,10 @@ import signal
 import json
 from .exceptions import *
 from .wiki import Wiki
+from .constants import concrete_types
+from .multipart_upload import multipart_upload_stream
+from .multipart_download import RangeNotSupportedError
+from .remote_file import RemoteReadNotSupportedError
 import getpass
 import csv
 import re
@@ -189,13 +194,21 @@ def store(args, syn):
         entity = syn.get(args.id, downloadFile=False)
     else:
         entity = {'concreteType': 'org.sagebionetworks.repo.model.%s' % args.type,
-                  'name': utils.guess_file_name(args.file) if args.file and not args.name else None,
+                  'name': utils.guess_file_name(args.file) if args.file and args.file != '-' and not args.name else None,
                   'parentId' : None}
     #Overide setting for parameters included in args
     entity['name'] =  args.name if args.name is not None else entity['name']
     entity['parentId'] = args.parentid if args.parentid is not None else entity['parentId']
-    entity['path'] = args.file if args.file is not None else None
     entity['synapseStore'] = not utils.is_url(args.file)
+    if args.file == '-':
+        if args.type != 'FileEntity':
+            raise ValueError('Only a File can be stored from standard input.')
+        if not entity['name']:
+            raise ValueError('A --name is required to store a file from standard input.')
+        entity['path'] = None
+        entity['dataFileHandleId'] = _upload_stdin(syn, entity['parentId'], entity['name'])
+    else:
+        entity['path'] = args.file if args.file is not None else None
 
     used = syn._convertProvenanceList(args.used, args.limitSearch)
     executed = syn._convertProvenanceList(args.executed, args.limitSearch)
@@ -213,6 +226,18 @@ def store(args, syn):
         setAnnotations(args, syn)
 
 
+def _upload_stdin(syn, parent_id, filename):
+    """
+    Uploads standard input to the default storage location of the parent, returning the file handle ID
+    """
+    location = syn._getDefaultUploadDestination(parent_id)
+    if location['concreteType'] not in (concrete_types.SYNAPSE_S3_UPLOAD_DESTINATION,
+                                        concrete_types.EXTERNAL_S3_UPLOAD_DESTINATION):
+        raise ValueError('Standard input can only be stored in an S3 storage location.')
+    stdin = sys.stdin.buffer if six.PY3 else sys.stdin
+    return multipart_upload_stream(syn, stdin, filename, storageLocationId=location['storageLocationId'])
+
+
 def _create_wiki_description_if_necessary(args, entity, syn):
     """
     store the description in a Wiki
@@ -273,11 +298,24 @@ def cat(args, syn):
         ## SIGILL, SIGINT, SIGSEGV, or SIGTERM. A ValueError will be raised
         ## in any other case."
         pass
-    entity = syn.get(args.id, version=args.version)
-    if 'path' in entity:
-        with open(entity.path) as inputfile:
-            for line in inputfile:
-                sys.stdout.write(line)
+    ## stream the content rather than downloading it into the cache
+    output = getattr(sys.stdout, 'buffer', sys.stdout)
+    written = 0
+    try:
+        with syn.open(args.id, version=args.version) as inputfile:
+            for chunk in iter(lambda: inputfile.read(io.DEFAULT_BUFFER_SIZE), b''):
+                output.write(chunk)
+                written += len(chunk)
+    except (RemoteReadNotSupportedError, RangeNotSupportedError):
+        ## files that can't be read remotely are downloaded instead, unless part of the file was already written
+        if written:
+            raise
+        entity = syn.get(args.id, version=args.version)
+        if 'path' in entity and entity.path is not None:
+            with io.open(entity.path, 'rb') as inputfile:
+                for chunk in iter(lambda: inputfile.read(io.DEFAULT_BUFFER_SIZE), b''):
+                    output.write(chunk)
+    output.flush()
 
 
 def ls(args, syn):
@@ -455,6 +493,28 @@ def login(args, syn):
     print("Logged in as: {userName} ({ownerId})".format(**profile))
 
 
+def cache(args, syn):
+    """Report the size and hit rate of the local file cache."""
+    if args.evict:
+        if syn.cache.max_size is None:
+            raise ValueError("Set max_size in the [cache] section of the configuration file to evict files")
+        evicted = syn.cache.evict()
+        print("Evicted the files of %d file handles" % len(evicted))
+    stats = syn.cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    if syn.cache.max_size is None:
+        limit = "unbounded"
+    else:
+        limit = "of %s, %s eviction" % (utils.humanizeBytes(syn.cache.max_size), syn.cache.eviction_policy)
+    print("Cache location: %s" % syn.cache.cache_root_dir)
+    print("Size:           %s (%s)" % (utils.humanizeBytes(stats['size']), limit))
+    print("File handles:   %d" % stats['file_handles'])
+    print("Files:          %d" % stats['files'])
+    print("Hits:           %d" % stats['hits'])
+    print("Misses:         %d" % stats['misses'])
+    print("Hit rate:       %s" % ("%.1f%%" % (100.0 * stats['hits'] / lookups) if lookups else "n/a"))
+
+
 def test_encoding(args, syn):
     import locale
     import platform
@@ -556,7 +616,7 @@ def build_parser():
 
     parser_store.add_argument('--file', type=str, help=argparse.SUPPRESS)
     parser_store.add_argument('FILE', nargs='?', type=str,
-            help='file to be added to synapse.')
+            help='file to be added to synapse, or - to read it from standard input (requires --name).')
     parser_store.set_defaults(func=store)
 
     parser_add = subparsers.add_parser('add', #Python 3.2+ would support alias=['store']
@@ -590,7 +650,7 @@ def build_parser():
             help='Replace all existing annotations with the given annotations')
     parser_add.add_argument('--file', type=str, help=argparse.SUPPRESS)
     parser_add.add_argument('FILE', nargs='?', type=str,
-            help='file to be added to synapse.')
+            help='file to be added to synapse, or - to read it from standard input (requires --name).')
     parser_add.set_defaults(func=store)
 
     parser_mv = subparsers.add_parser('mv',
@@ -800,6 +860,12 @@ def build_parser():
             help='Cache credentials for automatic authentication on future interactions with Synapse')
     parser_login.set_defaults(func=login)
 
+    parser_cache = subparsers.add_parser('cache',
+            help='Report the size and hit rate of the local file cache')
+    parser_cache.add_argument('--evict', action='store_true', default=False,
+            help='Evict files until the cache fits in the max_size set in the configuration file')
+    parser_cache.set_defaults(func=cache)
+
     ## test character encoding
     parser_test_encoding = subparsers.add_parser('test-encoding',
             help='test character encoding to help diagnose problems')
@@ -836,8 +902,8 @@ def main():
     args = build_parser().parse_args()
     synapseclient.USER_AGENT['User-Agent'] = "synapsecommandlineclient " + synapseclient.USER_AGENT['User-Agent']
     syn = synapseclient.Synapse(debug=args.debug, skip_checks=args.skip_checks, configPath=args.configPath)
-    if not ('func' in args and args.func == login):
-        # if we're not executing the "login" operation, automatically authenticate before running operation
+    if not ('func' in args and args.func in (login, cache)):
+        # if we're not executing the "login" or local "cache" operation, automatically authenticate before running operation
         login_with_prompt(syn, args.synapseUser, args.synapsePassword, silent=True)
     perform_main(args, syn)
 
@@ -0,0 +1,12 @@
+"""
+**************
+asyncio client
+**************
+
+:py:class:`AsyncSynapse` makes the requests of a :py:class:`synapseclient.Synapse`
+object as coroutines, so that an asyncio application can keep many of them in
+flight from a single thread. It requires Python 3.5 or newer and the `aiohttp
+<https://aiohttp.readthedocs.io/>`_ package.
+
+"""
+from .client import AsyncSynapse
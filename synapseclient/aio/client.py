@@ -0,0 +1,510 @@
+"""
+******************
+AsyncSynapse class
+******************
+
+.. autoclass:: synapseclient.aio.AsyncSynapse
+  :members:
+
+"""
+import asyncio
+import collections.abc
+import json
+import os
+
+from requests.structures import CaseInsensitiveDict
+
+from synapseclient import exceptions, utils
+from synapseclient.activity import Activity
+from synapseclient.annotations import from_synapse_annotations
+from synapseclient.client import STANDARD_RETRY_PARAMS
+from synapseclient.constants import concrete_types
+from synapseclient.entity import Entity, File, split_entity_namespaces
+from synapseclient.exceptions import SynapseError, SynapseHTTPError, SynapseTimeoutError
+from synapseclient.table import RowSet, CsvFileTable
+from synapseclient.upload_functions import upload_file_handle
+from synapseclient.utils import id_of, get_properties, _extract_synapse_id_from_query
+from synapseclient.multipart_upload import _parts_in_flight
+from .multipart_upload import multipart_upload
+from .retry import _with_retry
+
+## names of the aiohttp exceptions that are retried, in addition to those of the synchronous client
+AIOHTTP_RETRY_EXCEPTIONS = ["ClientConnectionError", "ClientConnectorError", "ClientOSError", "ClientPayloadError",
+                            "ServerDisconnectedError", "ServerTimeoutError", "TimeoutError"]
+DEFAULT_MAX_CONNECTIONS = 100
+
+
+class _Response(object):
+    """
+    The body and metadata of an aiohttp response, read in full, with the attributes of a
+    :py:class:`requests.Response` that the retry and error handling code of the client use.
+    """
+
+    def __init__(self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def __iter__(self):
+        return iter([self.content])
+
+
+class AsyncSynapse(object):
+    """
+    Makes the REST calls of a :py:class:`synapseclient.Synapse` object as coroutines on an
+    asyncio event loop, so that a single thread can keep many requests in flight.
+
+    Endpoints, credentials, request signing, retry policy, rate limits and the file cache
+    are those of the wrapped Synapse object. Requests are sent with `aiohttp`_, which
+    must be installed::
+
+        pip install synapseclient[aio]
+
+    :param synapse:         A logged in :py:class:`synapseclient.Synapse` object
+    :param session:         (optional) An ``aiohttp.ClientSession`` to send requests with.
+                            By default one is created on first use and closed by :py:meth:`close`.
+    :param max_connections: The number of connections to Synapse kept open at once by the
+                            default session. Requests beyond this wait for a free connection.
+
+    Example::
+
+        import asyncio
+        import synapseclient
+        from synapseclient.aio import AsyncSynapse
+
+        async def names(ids):
+            async with AsyncSynapse(synapseclient.login()) as asyn:
+                entities = await asyncio.gather(*[asyn.get(id, downloadFile=False) for id in ids])
+                return [entity.name for entity in entities]
+
+    Downloads of file contents use the threaded transfer code of the Synapse client,
+    which is run in the event loop's default executor.
+
+    .. _aiohttp: https://aiohttp.readthedocs.io/
+    """
+
+    def __init__(self, synapse, session=None, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.syn = synapse
+        self.max_connections = max_connections
+        self._session = session
+        self._owns_session = session is None
+        self._part_upload_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Closes the HTTP session, if it was created by this object."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._part_upload_session is not None:
+            await self._part_upload_session.close()
+            self._part_upload_session = None
+
+    @staticmethod
+    def _client_session(limit):
+        aiohttp = utils.attempt_import("aiohttp", "\n\nThe asyncio Synapse client requires the aiohttp package.\n\n")
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit))
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = self._client_session(self.max_connections)
+        return self._session
+
+    def _get_part_upload_session(self):
+        """
+        Returns the keep-alive session that parts of multipart uploads are PUT with, kept apart from the
+        session of the REST calls and holding a connection for each of the parts sent at once, as
+        :py:func:`synapseclient.multipart_upload._get_part_upload_session` does for the threaded client.
+        """
+        session = self._part_upload_session
+        if session is None or session.connector.limit != _parts_in_flight(self.syn):
+            if session is not None:
+                asyncio.ensure_future(session.close())
+            session = self._part_upload_session = self._client_session(_parts_in_flight(self.syn))
+        return session
+
+    @staticmethod
+    def _run_in_executor(function):
+        return asyncio.get_event_loop().run_in_executor(None, function)
+
+    @staticmethod
+    async def _wait(seconds):
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def _build_retry_policy(self, retryPolicy={}):
+        policy = dict(STANDARD_RETRY_PARAMS)
+        policy['retry_exceptions'] = policy['retry_exceptions'] + AIOHTTP_RETRY_EXCEPTIONS
+        policy.update(retryPolicy)
+        return policy
+
+    ############################################################
+    ##                 HTTP requests                          ##
+    ############################################################
+
+    async def _send(self, method, url, headers=None, data=None, session=None):
+        async with (session or self._get_session()).request(method, url, headers=headers, data=data) as response:
+            content = await response.read()
+            return _Response(response.status, response.reason, response.headers, content)
+
+    async def _rest_call(self, method, uri, body, endpoint, headers, retryPolicy):
+        uri, headers = self.syn._build_uri_and_headers(uri, endpoint, headers)
+        retryPolicy = self._build_retry_policy(retryPolicy)
+
+        await self._wait(self.syn._rate_limiter.reserve_request())
+        response = await _with_retry(lambda: self._send(method, uri, headers=headers, data=body),
+                                     verbose=self.syn.debug, **retryPolicy)
+        exceptions._raise_for_status(response, verbose=self.syn.debug)
+        return response
+
+    async def restGET(self, uri, endpoint=None, headers=None, retryPolicy={}):
+        """
+        Sends an HTTP GET request to the Synapse server.
+
+        :param uri:      URI on which get is performed
+        :param endpoint: Server endpoint, defaults to the repoEndpoint of the Synapse object
+        :param headers:  Dictionary of headers to use rather than the API-key-signed default set of headers
+
+        :returns: JSON encoding of response
+        """
+        response = await self._rest_call('GET', uri, None, endpoint, headers, retryPolicy)
+        return self.syn._return_rest_body(response)
+
+    async def restPOST(self, uri, body, endpoint=None, headers=None, retryPolicy={}):
+        """
+        Sends an HTTP POST request to the Synapse server.
+
+        :param uri:      URI on which get is performed
+        :param endpoint: Server endpoint, defaults to the repoEndpoint of the Synapse object
+        :param body:     The payload to be delivered
+        :param headers:  Dictionary of headers to use rather than the API-key-signed default set of headers
+
+        :returns: JSON encoding of response
+        """
+        response = await self._rest_call('POST', uri, body, endpoint, headers, retryPolicy)
+        return self.syn._return_rest_body(response)
+
+    async def restPUT(self, uri, body=None, endpoint=None, headers=None, retryPolicy={}):
+        """
+        Sends an HTTP PUT request to the Synapse server.
+
+        :param uri:      URI on which get is performed
+        :param endpoint: Server endpoint, defaults to the repoEndpoint of the Synapse object
+        :param body:     The payload to be delivered
+        :param headers:  Dictionary of headers to use rather than the API-key-signed default set of headers
+
+        :returns: JSON encoding of response
+        """
+        response = await self._rest_call('PUT', uri, body, endpoint, headers, retryPolicy)
+        return self.syn._return_rest_body(response)
+
+    async def restDELETE(self, uri, endpoint=None, headers=None, retryPolicy={}):
+        """
+        Sends an HTTP DELETE request to the Synapse server.
+
+        :param uri:      URI of resource to be deleted
+        :param endpoint: Server endpoint, defaults to the repoEndpoint of the Synapse object
+        :param headers:  Dictionary of headers to use rather than the API-key-signed default set of headers
+        """
+        await self._rest_call('DELETE', uri, None, endpoint, headers, retryPolicy)
+
+    async def _put_part(self, url, chunk):
+        """PUTs a part of a multipart upload to its pre-signed URL."""
+        limiter = self.syn._rate_limiter
+        await self._wait(max(limiter.reserve_request(), limiter.reserve_upload(len(chunk))))
+        response = await self._send('PUT', url, data=chunk, session=self._get_part_upload_session())
+        exceptions._raise_for_status(response, verbose=self.syn.debug)
+
+    async def _waitForAsync(self, uri, request, endpoint=None):
+        if endpoint is None:
+            endpoint = self.syn.repoEndpoint
+
+        async_job_id = await self.restPOST(uri+'/start', body=json.dumps(request), endpoint=endpoint)
+
+        # http://docs.synapse.org/rest/org/sagebionetworks/repo/model/asynch/AsynchronousJobStatus.html
+        loop = asyncio.get_event_loop()
+        sleep = self.syn.table_query_sleep
+        start_time = loop.time()
+        lastMessage, lastProgress = '', 0
+        while loop.time()-start_time < self.syn.table_query_timeout:
+            result = await self.restGET(uri+'/get/%s' % async_job_id['token'], endpoint=endpoint)
+            if result.get('jobState', None) != 'PROCESSING':
+                break
+            message = result.get('progressMessage', lastMessage)
+            progress = result.get('progressCurrent', lastProgress)
+            # Reset the time if we made progress
+            if message != lastMessage or progress != lastProgress:
+                start_time = loop.time()
+                lastMessage, lastProgress = message, progress
+            sleep = min(self.syn.table_query_max_sleep, sleep * self.syn.table_query_backoff)
+            await asyncio.sleep(sleep)
+        else:
+            raise SynapseTimeoutError('Timeout waiting for query results: %0.1f seconds ' % (loop.time()-start_time))
+        if result.get('jobState', None) == 'FAILED':
+            raise SynapseError(result.get('errorMessage', None) + '\n' + result.get('errorDetails', None), asynchronousJobStatus=result)
+        return result
+
+    ############################################################
+    ##                 Get / Store Entities                   ##
+    ############################################################
+
+    async def _getEntityBundle(self, entity, version=None, bitFlags=0x800 | 0x40000 | 0x2 | 0x1):
+        """See :py:meth:`synapseclient.Synapse._getEntityBundle`."""
+        if isinstance(entity, collections.abc.Mapping) and 'id' not in entity and 'name' in entity:
+            entity = await self.findEntityId(entity['name'], entity.get('parentId', None))
+
+        try:
+            id_of(entity)
+        except ValueError:
+            return None
+
+        return await self.restGET(self.syn._entity_bundle_uri(entity, version, bitFlags))
+
+    async def _getEntity(self, entity, version=None):
+        uri = '/entity/'+id_of(entity)
+        if version:
+            uri += '/version/%d' % version
+        return await self.restGET(uri)
+
+    async def _createEntity(self, entity):
+        return await self.restPOST(uri='/entity', body=json.dumps(get_properties(entity)))
+
+    async def _updateEntity(self, entity, incrementVersion=True, versionLabel=None):
+        uri = self.syn._update_entity_uri(entity, incrementVersion, versionLabel)
+        return await self.restPUT(uri, body=json.dumps(get_properties(entity)))
+
+    async def _getFileHandle(self, fileHandle):
+        return await self.restGET('/fileHandle/%s' % id_of(fileHandle), endpoint=self.syn.fileHandleEndpoint)
+
+    async def _getDefaultUploadDestination(self, parent_entity):
+        return await self.restGET('/entity/%s/uploadDestination' % id_of(parent_entity),
+                                  endpoint=self.syn.fileHandleEndpoint)
+
+    async def findEntityId(self, name, parent=None):
+        """See :py:meth:`synapseclient.Synapse.findEntityId`."""
+        entity_lookup_request = self.syn._entity_lookup_request(name, parent)
+        try:
+            return (await self.restPOST("/entity/child", body=json.dumps(entity_lookup_request))).get("id")
+        except SynapseHTTPError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+
+    async def get(self, entity, **kwargs):
+        """
+        Gets a Synapse entity from the repository service.
+        Takes the same arguments as :py:meth:`synapseclient.Synapse.get`.
+
+        :returns: A new Synapse Entity object of the appropriate type
+        """
+        ## finding an entity by the MD5 of a local file is left to the synchronous client
+        if isinstance(entity, str) and os.path.isfile(entity):
+            return await self._run_in_executor(lambda: self.syn.get(entity, **kwargs))
+        if isinstance(entity, str) and not utils.is_synapse_id(entity):
+            raise exceptions.SynapseFileNotFoundError(('The parameter %s is neither a local file path '
+                                                       ' or a valid entity id' % entity))
+
+        bundle = await self._getEntityBundle(entity, kwargs.get('version', None))
+        self.syn._check_entity_restrictions(bundle['restrictionInformation'], entity, kwargs.get('downloadFile', True))
+
+        if bundle['entity']['concreteType'] == 'org.sagebionetworks.repo.model.Link' and kwargs.pop('followLink', False):
+            linksTo = bundle['entity']['linksTo']
+            bundle = await self._getEntityBundle(linksTo['targetId'], linksTo.get('targetVersionNumber'))
+        kwargs.pop('followLink', None)
+
+        if kwargs.get('downloadFile', True) and bundle['entity']['concreteType'] == File._synapse_entity_type:
+            return await self._run_in_executor(
+                lambda: self.syn._getWithEntityBundle(entityBundle=bundle, entity=entity, **kwargs))
+        return self.syn._getWithEntityBundle(entityBundle=bundle, entity=entity, **kwargs)
+
+    async def _upload_file_handle(self, parent_entity, path, synapseStore=True, md5=None, file_size=None, mimetype=None,
+                                  dedupe=False):
+        """
+        Uploads to Synapse storage natively and to other upload destinations with
+        :py:func:`synapseclient.upload_functions.upload_file_handle` in the default executor.
+        """
+        if synapseStore and not dedupe:
+            expanded_upload_path = os.path.expandvars(os.path.expanduser(path))
+            location = await self._getDefaultUploadDestination(parent_entity)
+            if location['concreteType'] == concrete_types.SYNAPSE_S3_UPLOAD_DESTINATION:
+                file_handle_id = await multipart_upload(self, expanded_upload_path, contentType=mimetype,
+                                                        storageLocationId=location['storageLocationId'])
+                self.syn.cache.add(file_handle_id, expanded_upload_path)
+                return await self._getFileHandle(file_handle_id)
+        return await self._run_in_executor(
+            lambda: upload_file_handle(self.syn, parent_entity, path, synapseStore=synapseStore, md5=md5,
+                                       file_size=file_size, mimetype=mimetype, dedupe=dedupe))
+
+    async def store(self, obj, **kwargs):
+        """
+        Creates a new Entity or updates an existing Entity, uploading any files in the process.
+        Takes the same arguments as :py:meth:`synapseclient.Synapse.store`.
+
+        Objects other than Entities, and tables, which store themselves, are stored by the
+        synchronous client in the default executor.
+
+        :returns: A Synapse Entity
+        """
+        if hasattr(obj, '_before_synapse_store') or hasattr(obj, '_synapse_store') or \
+                not (isinstance(obj, Entity) or type(obj) == dict):
+            return await self._run_in_executor(lambda: self.syn.store(obj, **kwargs))
+
+        createOrUpdate = kwargs.get('createOrUpdate', True)
+        forceVersion = kwargs.get('forceVersion', True)
+        versionLabel = kwargs.get('versionLabel', None)
+        isRestricted = kwargs.get('isRestricted', False)
+        dedupe = kwargs.get('dedupe', False)
+
+        entity = obj
+        properties, annotations, local_state = split_entity_namespaces(entity)
+        bundle = None
+        # Anything with a path is treated as a cache-able item
+        if entity.get('path', False):
+            if 'concreteType' not in properties:
+                properties['concreteType'] = File._synapse_entity_type
+            entity['path'] = os.path.expanduser(entity['path'])
+
+            # Check if the File already exists in Synapse by fetching metadata on it
+            bundle = await self._getEntityBundle(entity)
+
+            if self.syn._needs_upload(entity, bundle):
+                path, upload_kwargs = self.syn._upload_file_handle_args(local_state)
+                fileHandle = await self._upload_file_handle(entity['parentId'], path, dedupe=dedupe, **upload_kwargs)
+                properties['dataFileHandleId'] = fileHandle['id']
+                local_state['_file_handle'] = fileHandle
+
+            elif 'dataFileHandleId' not in properties:
+                properties['dataFileHandleId'] = bundle['entity']['dataFileHandleId']
+
+            # update the file_handle metadata if the FileEntity's FileHandle id has changed
+            if '_file_handle' in local_state and properties['dataFileHandleId'] != local_state['_file_handle'].get('id', None):
+                self.syn._set_local_file_handle(local_state, properties['dataFileHandleId'],
+                                                await self._getFileHandle(properties['dataFileHandleId']))
+
+        # Create or update Entity in Synapse
+        if 'id' in properties:
+            properties = await self._updateEntity(properties, forceVersion, versionLabel)
+        else:
+            if properties['concreteType'] == "org.sagebionetworks.repo.model.Link":
+                target_properties = await self._getEntity(properties['linksTo']['targetId'], version=properties['linksTo'].get('targetVersionNumber'))
+                self.syn._set_link_target(properties, target_properties)
+            try:
+                properties = await self._createEntity(properties)
+            except SynapseHTTPError as ex:
+                if createOrUpdate and ex.response.status_code == 409:
+                    existing_entity_id = await self.findEntityId(properties['name'], properties.get('parentId', None))
+                    if existing_entity_id is None:
+                        raise
+
+                    if not bundle:
+                        bundle = await self._getEntityBundle(existing_entity_id, bitFlags=0x1 | 0x2)
+
+                    existing_entity, annotations = self.syn._merge_existing_entity(bundle, properties, annotations)
+                    properties = await self._updateEntity(existing_entity, forceVersion, versionLabel)
+                else:
+                    raise
+
+        if isRestricted:
+            await self._createAccessRequirementIfNone(properties)
+
+        annotations['etag'] = properties['etag']
+        annotations = await self.setAnnotations(properties, annotations)
+        properties['etag'] = annotations.etag
+
+        activity = self.syn._activity_to_store(kwargs)
+        if activity:
+            await self.setProvenance(properties, activity)
+            # 'etag' has changed, so get the new Entity
+            properties = await self._getEntity(properties)
+
+        return Entity.create(properties, annotations, local_state)
+
+    async def _createAccessRequirementIfNone(self, entity):
+        existingRestrictions = await self.restGET('/entity/%s/accessRequirement?offset=0&limit=1' % id_of(entity))
+        if len(existingRestrictions['results']) <= 0:
+            await self.restPOST('/entity/%s/lockAccessRequirement' % id_of(entity), body="")
+
+    async def setAnnotations(self, entity, annotations={}, **kwargs):
+        """See :py:meth:`synapseclient.Synapse.setAnnotations`."""
+        uri, synapseAnnos = self.syn._annotations_request(entity, annotations, kwargs)
+        if 'etag' not in synapseAnnos:
+            old_annos = await self.restGET(uri)
+            synapseAnnos['etag'] = old_annos['etag']
+
+        return from_synapse_annotations(await self.restPUT(uri, body=json.dumps(synapseAnnos)))
+
+    async def setProvenance(self, entity, activity):
+        """See :py:meth:`synapseclient.Synapse.setProvenance`."""
+        if 'id' in activity:
+            activity = Activity(data=await self.restPUT('/activity/%s' % activity['id'], json.dumps(activity)))
+        else:
+            activity = await self.restPOST('/activity', body=json.dumps(activity))
+
+        uri = '/entity/%s/generatedBy?generatedBy=%s' % (id_of(entity), activity['id'])
+        return Activity(data=await self.restPUT(uri))
+
+    async def getChildren(self, parent, includeTypes=["folder", "file", "table", "link", "entityview", "dockerrepo"],
+                          sortBy="NAME", sortDirection="ASC"):
+        """
+        Retrieves all of the entities stored within a parent such as folder or project.
+        Takes the same arguments as :py:meth:`synapseclient.Synapse.getChildren`.
+
+        :returns: A list of the children of the container
+        """
+        entityChildrenRequest = self.syn._entity_children_request(parent, includeTypes, sortBy, sortDirection)
+        children = []
+        while True:
+            entityChildrenResponse = await self.restPOST('/entity/children', body=json.dumps(entityChildrenRequest))
+            children.extend(entityChildrenResponse['page'])
+            if entityChildrenResponse.get('nextPageToken') is None:
+                return children
+            entityChildrenRequest['nextPageToken'] = entityChildrenResponse['nextPageToken']
+
+    ############################################################
+    ##                     Tables                             ##
+    ############################################################
+
+    async def _queryTable(self, query, limit=None, offset=None, isConsistent=True, partMask=None):
+        query_bundle_request = self.syn._query_bundle_request(query, limit, offset, isConsistent, partMask)
+        uri = '/entity/{id}/table/query/async'.format(id=_extract_synapse_id_from_query(query))
+        return await self._waitForAsync(uri=uri, request=query_bundle_request)
+
+    async def _queryTableNext(self, nextPageToken, tableId):
+        uri = '/entity/{id}/table/query/nextPage/async'.format(id=tableId)
+        return await self._waitForAsync(uri=uri, request=nextPageToken)
+
+    async def tableQuery(self, query, resultsAs="csv", **kwargs):
+        """
+        Queries a Synapse Table. Takes the same arguments as :py:meth:`synapseclient.Synapse.tableQuery`.
+
+        :returns: For resultsAs="rowset", a :py:class:`synapseclient.table.RowSet` holding every page of
+                  the results. For resultsAs="csv", a Table object that wraps a CSV file, which is
+                  downloaded by the synchronous client in the default executor.
+        """
+        if resultsAs.lower() == "rowset":
+            result = await self._queryTable(query, limit=kwargs.get('limit', None), offset=kwargs.get('offset', None),
+                                            isConsistent=kwargs.get('isConsistent', True))
+            rowset = RowSet.from_json(result['queryResult']['queryResults'])
+            nextPageToken = result['queryResult'].get('nextPageToken', None)
+            while nextPageToken:
+                result = await self._queryTableNext(nextPageToken, rowset.tableId)
+                rowset.rows.extend(RowSet.from_json(result['queryResults']).rows)
+                nextPageToken = result.get('nextPageToken', None)
+            return rowset
+        elif resultsAs.lower() == "csv":
+            return await self._run_in_executor(lambda: CsvFileTable.from_table_query(self.syn, query, **kwargs))
+        else:
+            raise ValueError("Unknown return type requested from tableQuery: " + str(resultsAs))
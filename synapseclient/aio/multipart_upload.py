@@ -0,0 +1,197 @@
+"""
+The client side of `Synapse multipart upload`_ as coroutines, see
+:py:mod:`synapseclient.multipart_upload` for the threaded implementation.
+Parts are read from disk in the event loop's default executor while many of
+them are PUT concurrently.
+
+.. _Synapse multipart upload: http://docs.synapse.org/rest/index.html#org.sagebionetworks.file.controller.UploadController
+
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import time
+
+from synapseclient.dict_object import DictObject
+from synapseclient.exceptions import SynapseHTTPError
+from synapseclient.multipart_upload import PRESIGNED_URL_BATCH_SIZE, MIN_PART_SIZE, MAX_NUMBER_OF_PARTS, \
+    calculate_part_size, md5s_for_file_parts, MemoryMappedFile, _UploadState, _choose_part_size, \
+    _multipart_upload_request, _start_multipart_upload_uri, _presigned_url_batch_request, _add_part_uri, \
+    _complete_multipart_upload_uri, _is_expired, _part_md5, _parts_in_flight
+
+
+async def _start_multipart_upload(asyn, filename, md5, fileSize, partSize, contentType, preview=True,
+                                  storageLocationId=None, forceRestart=False):
+    upload_request = _multipart_upload_request(filename, md5, fileSize, partSize, contentType,
+                                               preview=preview, storageLocationId=storageLocationId)
+    return DictObject(**await asyn.restPOST(uri=_start_multipart_upload_uri(forceRestart),
+                                            body=json.dumps(upload_request),
+                                            endpoint=asyn.syn.fileHandleEndpoint))
+
+
+async def _get_presigned_url_batch(asyn, uploadId, partNumbers):
+    uri, body = _presigned_url_batch_request(uploadId, partNumbers)
+    presigned_url_batch = await asyn.restPOST(uri, body=body, endpoint=asyn.syn.fileHandleEndpoint)
+    return presigned_url_batch['partPresignedUrls']
+
+
+class _PresignedUrls(object):
+    """
+    Hands out the parts to upload with their presigned URLs, fetching the URLs a batch at a time
+    as the parts are started so that none of them expire while waiting for earlier parts.
+    """
+
+    def __init__(self, asyn, uploadId, parts_to_upload, batch_size=PRESIGNED_URL_BATCH_SIZE):
+        self.asyn = asyn
+        self.uploadId = uploadId
+        self.parts_to_upload = list(parts_to_upload)
+        self.batch_size = batch_size
+        self.parts = []
+        self.lock = asyncio.Lock()
+
+    async def next_part(self):
+        async with self.lock:
+            if not self.parts and self.parts_to_upload:
+                batch = self.parts_to_upload[:self.batch_size]
+                del self.parts_to_upload[:self.batch_size]
+                self.parts = await _get_presigned_url_batch(self.asyn, self.uploadId, batch)
+            return self.parts.pop(0) if self.parts else None
+
+
+async def _add_part(asyn, uploadId, partNumber, partMD5Hex):
+    return DictObject(**await asyn.restPUT(_add_part_uri(uploadId, partNumber, partMD5Hex),
+                                           endpoint=asyn.syn.fileHandleEndpoint))
+
+
+async def _complete_multipart_upload(asyn, uploadId):
+    return DictObject(**await asyn.restPUT(_complete_multipart_upload_uri(uploadId),
+                                           endpoint=asyn.syn.fileHandleEndpoint))
+
+
+def _read_part(get_chunk_function, partNumber, partSize, part_md5s):
+    chunk = get_chunk_function(partNumber, partSize)
+    return chunk, _part_md5(chunk, partNumber, part_md5s)
+
+
+async def _upload_part(asyn, part, state, get_chunk_function, partSize, part_md5s):
+    """The coroutine counterpart of :py:func:`synapseclient.multipart_upload._upload_chunk`."""
+    syn = asyn.syn
+    partNumber = part['partNumber']
+    url = part['uploadPresignedUrl']
+    try:
+        loop = asyncio.get_event_loop()
+        chunk, md5 = await loop.run_in_executor(None, _read_part, get_chunk_function, partNumber,
+                                                partSize, part_md5s)
+        if _is_expired(url):
+            url = (await _get_presigned_url_batch(asyn, state.uploadId, [partNumber]))[0]['uploadPresignedUrl']
+        put_started = time.time()
+        try:
+            await asyn._put_part(url, chunk)
+        except SynapseHTTPError as ex:
+            if ex.response.status_code != 403:
+                raise
+            ## only the URL of this part has expired, get a new one and try again
+            syn.logger.debug("The presigned upload URL for part %s has expired." % partNumber)
+            url = (await _get_presigned_url_batch(asyn, state.uploadId, [partNumber]))[0]['uploadPresignedUrl']
+            put_started = time.time()
+            await asyn._put_part(url, chunk)
+        syn._throughput_monitor.record_transfer(len(chunk), time.time() - put_started)
+        add_part_started = time.time()
+        add_part_response = await _add_part(asyn, uploadId=state.uploadId, partNumber=partNumber, partMD5Hex=md5)
+        syn._throughput_monitor.record_request(time.time() - add_part_started)
+        state.part_added(partNumber, add_part_response, len(chunk))
+    except Exception:
+        syn._throughput_monitor.record_failure()
+        syn.logger.debug("Uploading part %s failed. Retrying...\n" % partNumber, exc_info=True)
+
+
+async def _upload_parts(asyn, presigned_urls, state, get_chunk_function, partSize, part_md5s):
+    while True:
+        part = await presigned_urls.next_part()
+        if part is None:
+            return
+        await _upload_part(asyn, part, state, get_chunk_function, partSize, part_md5s)
+
+
+async def _multipart_upload(asyn, filename, contentType, get_chunk_function, md5, fileSize, partSize=None,
+                            storageLocationId=None, part_md5s=None, max_workers=None, **kwargs):
+    """
+    Multipart upload as a coroutine, see :py:func:`synapseclient.multipart_upload._multipart_upload`.
+    The rounds of the upload are those of :py:class:`synapseclient.multipart_upload._UploadState`,
+    with as many parts in flight at once as the threaded upload would have.
+
+    :returns: a MultipartUploadStatus_ object
+
+    .. MultipartUploadStatus: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadStatus.html
+    """
+    if partSize is None:
+        partSize, max_workers = _choose_part_size(asyn.syn, fileSize)
+    partSize = calculate_part_size(fileSize, partSize, MIN_PART_SIZE, MAX_NUMBER_OF_PARTS)
+    status = await _start_multipart_upload(asyn, filename, md5, fileSize, partSize, contentType,
+                                           storageLocationId=storageLocationId, **kwargs)
+
+    ## only force restart once
+    kwargs['forceRestart'] = False
+
+    state = _UploadState(asyn.syn, filename, fileSize, partSize, status)
+    while state.retrying():
+        presigned_urls = _PresignedUrls(asyn, state.uploadId, state.start_round())
+        await asyncio.gather(*[_upload_parts(asyn, presigned_urls, state, get_chunk_function, partSize, part_md5s)
+                               for i in range(_parts_in_flight(asyn.syn, max_workers))])
+
+        status = await _start_multipart_upload(asyn, filename, md5, fileSize, partSize, contentType,
+                                               storageLocationId=storageLocationId, **kwargs)
+        if state.end_round(status):
+            try:
+                if state.completed_with(await _complete_multipart_upload(asyn, state.uploadId)):
+                    break
+            except Exception as ex1:
+                state.completion_failed(ex1)
+    return state.result()
+
+
+async def multipart_upload(asyn, filepath, filename=None, contentType=None, storageLocationId=None, **kwargs):
+    """
+    Uploads a file to a Synapse upload destination in parts.
+
+    :param asyn:              an :py:class:`synapseclient.aio.AsyncSynapse`
+    :param filepath:          the file to upload
+    :param filename:          upload as a different filename
+    :param contentType:       `contentType`_
+    :param storageLocationId: a id indicating where the file should be stored. retrieved from Synapse's UploadDestination
+
+    :returns: a File Handle ID
+
+    Keyword arguments are passed down to :py:func:`_multipart_upload`.
+
+    .. _contentType: https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.17
+    """
+    if not os.path.exists(filepath):
+        raise IOError('File "%s" not found.' % filepath)
+    if os.path.isdir(filepath):
+        raise IOError('File "%s" is a directory.' % filepath)
+
+    fileSize = os.path.getsize(filepath)
+    if not filename:
+        filename = os.path.basename(filepath)
+    partSize, max_workers = _choose_part_size(asyn.syn, fileSize, kwargs.pop('partSize', None))
+    loop = asyncio.get_event_loop()
+    md5, part_md5s = await loop.run_in_executor(None, asyn.syn._md5_cache.md5s_for_file_parts, filepath, partSize,
+                                                md5s_for_file_parts)
+
+    if contentType is None:
+        (mimetype, enc) = mimetypes.guess_type(filepath, strict=False)
+        contentType = mimetype or "application/octet-stream"
+
+    with MemoryMappedFile(filepath) as mapped_file:
+        status = await _multipart_upload(asyn, filename, contentType,
+                                         get_chunk_function=mapped_file.get_chunk,
+                                         md5=md5,
+                                         fileSize=fileSize,
+                                         partSize=partSize,
+                                         part_md5s=part_md5s,
+                                         storageLocationId=storageLocationId,
+                                         max_workers=max_workers,
+                                         **kwargs)
+    return status["resultFileHandleId"]
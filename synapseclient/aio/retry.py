@@ -0,0 +1,65 @@
+"""
+asyncio counterpart of :py:func:`synapseclient.retry._with_retry`.
+"""
+import asyncio
+import logging
+import random
+import sys
+
+from synapseclient.logging_setup import DEBUG_LOGGER_NAME, DEFAULT_LOGGER_NAME
+from synapseclient.retry import _is_retryable
+
+
+async def _with_retry(function, verbose=False,
+                      retry_status_codes=[429, 500, 502, 503, 504], retry_errors=[], retry_exceptions=[],
+                      retries=3, wait=1, back_off=2, max_wait=30):
+    """
+    Retries the coroutine returned by the given function under the same conditions as
+    :py:func:`synapseclient.retry._with_retry`, waiting with :py:func:`asyncio.sleep`
+    so that other requests can proceed in the meantime.
+
+    :param function: A function with no arguments that returns a new coroutine each time it is called.
+
+    :returns: the result of awaiting function()
+
+    Example::
+
+        response = await _with_retry(lambda: session.get(url), **STANDARD_RETRY_PARAMS)
+    """
+
+    if verbose:
+        logger = logging.getLogger(DEBUG_LOGGER_NAME)
+    else:
+        logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+
+    total_wait = 0
+    while True:
+        exc_info = None
+        response = None
+
+        try:
+            response = await function()
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            exc_info = sys.exc_info()
+            logger.debug("calling %s resulted in an Exception" % function)
+            if hasattr(ex, 'response'):
+                response = ex.response
+
+        retry, wait = _is_retryable(response, exc_info, retry_status_codes, retry_errors, retry_exceptions, wait, logger)
+
+        retries -= 1
+        if retries >= 0 and retry:
+            randomized_wait = wait*random.uniform(0.5, 1.5)
+            logger.debug(('total wait time {total_wait:5.0f} seconds\n'
+                          '... Retrying in {wait:5.1f} seconds...'.format(total_wait=total_wait, wait=randomized_wait)))
+            total_wait += randomized_wait
+            await asyncio.sleep(randomized_wait)
+            wait = min(max_wait, wait*back_off)
+            continue
+
+        if exc_info is not None:
+            logger.debug("retries have run out. reraising the exception", exc_info=True)
+            raise exc_info[1].with_traceback(exc_info[2])
+        return response
@@ -17,6 +17,7 @@ from __future__ import unicode_literals
 from builtins import str
 
 import collections
+import contextlib
 import datetime
 import json
 import operator
@@ -24,13 +25,44 @@ import os
 import re
 import shutil
 import six
+import threading
 from math import floor
 import synapseclient.utils as utils
 from synapseclient.lock import Lock
+from synapseclient.pool_provider import TransferPool, DEFAULT_MAX_THREADS
+from synapseclient.cache_index import CacheIndex, INDEX_FILENAME, EVICTION_ORDER
 from synapseclient.exceptions import *
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+try:
+    from os import scandir
+except ImportError:
+    ## Python 2
+    scandir = None
+
 
 CACHE_ROOT_DIR = os.path.join('~', '.synapseCache')
+EVICTION_POLICIES = sorted(EVICTION_ORDER)
+## a shared lock of this name in the cache directory of a file handle keeps its files from being evicted
+PIN_LOCK_NAME = '.pin'
+## the number of times the cache directories of file handles are pinned by this process
+_pins = collections.Counter()
+_pins_lock = threading.Lock()
+_SIZE_UNITS = {'': 1, 'B': 1, 'KB': 2**10, 'MB': 2**20, 'GB': 2**30, 'TB': 2**40, 'PB': 2**50}
+
+
+def parse_size(size):
+    """
+    Parses a size in bytes, optionally followed by a unit such as MB, GB or TB (powers of 1024).
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$', str(size))
+    if not match or match.group(2).upper() not in _SIZE_UNITS:
+        raise ValueError('Invalid size: "%s"' % size)
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
 
 
 def epoch_time_to_iso(epoch_time):
@@ -67,15 +99,245 @@ def compare_timestamps(modified_time, cached_time):
         return cached_time == epoch_time_to_iso(modified_time)
 
 
+def _numbered_subdirectories(path):
+    """Yields the names and paths of the subdirectories of a directory that are named by a number"""
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.name.isdigit() and entry.is_dir(follow_symlinks=False):
+                yield entry.name, entry.path
+    else:
+        for name in os.listdir(path):
+            subdirectory = os.path.join(path, name)
+            if name.isdigit() and os.path.isdir(subdirectory) and not os.path.islink(subdirectory):
+                yield name, subdirectory
+
+
+def _directory_size(path):
+    """The total size of the files in a directory and its subdirectories"""
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class PurgeResult(int):
+    """
+    The number of file handles a purge deleted, or would delete in a dry run, as :py:meth:`Cache.purge` has always
+    returned. Its `bytes` are what their cache directories took up and `skipped` the number of file handles that were
+    left alone because they were pinned.
+    """
+
+    def __new__(cls, file_handles, bytes=0, skipped=0):
+        result = super(PurgeResult, cls).__new__(cls, file_handles)
+        result.bytes = bytes
+        result.skipped = skipped
+        return result
+
+    @property
+    def file_handles(self):
+        return int(self)
+
+    def __repr__(self):
+        return 'PurgeResult(file_handles=%d, bytes=%d, skipped=%d)' % (self, self.bytes, self.skipped)
+
+
+def _total(results):
+    return PurgeResult(sum(int(result) for result in results), sum(result.bytes for result in results),
+                       sum(result.skipped for result in results))
+
+
 def _get_modified_time(path):
     if os.path.exists(path):
         return os.path.getmtime(path)
     return None
 
 
+class _ReadOnlyTier(object):
+    """
+    A cache root that is only read, such as a shared cache that another client downloads files to. Cached copies
+    are looked up in its index or, if it has none, in the .cacheMap files of its cache directories.
+    """
+
+    def __init__(self, cache_root_dir, fanout, cache_map_file_name):
+        self.cache_root_dir = os.path.expandvars(os.path.expanduser(cache_root_dir))
+        self.fanout = fanout
+        self.cache_map_file_name = cache_map_file_name
+        self._index = None
+
+    def get_cache_dir(self, file_handle_id):
+        return os.path.join(self.cache_root_dir, str(int(file_handle_id) % self.fanout), str(file_handle_id))
+
+    def get_many(self, file_handle_ids):
+        """Returns a dict of the given file handle IDs, as ints, to their cache maps in this tier"""
+        index_path = os.path.join(self.cache_root_dir, INDEX_FILENAME)
+        if self._index is None and sqlite3 is not None and os.path.exists(index_path):
+            self._index = CacheIndex(index_path, read_only=True)
+        if self._index is not None:
+            try:
+                return self._index.get_many(file_handle_ids)
+            except sqlite3.Error:
+                ## an index we can't read, look in the .cacheMap files instead
+                self._index = None
+        cache_maps = {}
+        for file_handle_id in file_handle_ids:
+            cache_map_file = os.path.join(self.get_cache_dir(file_handle_id), self.cache_map_file_name)
+            try:
+                with open(cache_map_file, 'r') as f:
+                    cache_maps[int(file_handle_id)] = json.load(f)
+            except (IOError, OSError, ValueError):
+                cache_maps[int(file_handle_id)] = {}
+        return cache_maps
+
+
+class _CacheMapIndex(object):
+    """
+    Keeps the cached paths of each file handle only in the .cacheMap file of its cache directory, as was done before
+    the index, for Pythons built without sqlite3. It has the methods of
+    :py:class:`synapseclient.cache_index.CacheIndex` that the cache uses, but lookups aren't counted, so file handles
+    are evicted in the order they were last cached whatever the eviction policy, and purges aren't resumed.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _cache_map_file(self, file_handle_id):
+        return os.path.join(self.cache.get_cache_dir(file_handle_id), self.cache.cache_map_file_name)
+
+    def _read(self, file_handle_id):
+        try:
+            with open(self._cache_map_file(file_handle_id), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _update(self, file_handle_id, update):
+        """Applies a function to the cache map of a file handle and writes the result"""
+        cache_dir = self.cache.get_cache_dir(file_handle_id)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with Lock(self.cache.cache_map_file_name, dir=cache_dir):
+            cache_map = update(self._read(file_handle_id))
+            with open(self._cache_map_file(file_handle_id), 'w') as f:
+                json.dump(cache_map, f)
+                f.write('\n') # For compatibility with R's JSON parser
+
+    def get(self, file_handle_id):
+        cache_dir = self.cache.get_cache_dir(file_handle_id)
+        if not os.path.exists(cache_dir):
+            return {}
+        with Lock(self.cache.cache_map_file_name, dir=cache_dir):
+            return self._read(file_handle_id)
+
+    def get_many(self, file_handle_ids):
+        return dict((int(file_handle_id), self.get(file_handle_id)) for file_handle_id in set(file_handle_ids))
+
+    def import_cache_map(self, file_handle_id, cache_map_file, sizes=None):
+        ## the .cacheMap files are what is looked up in the first place
+        return {}
+
+    def add_many(self, entries):
+        by_file_handle = {}
+        for file_handle_id, path, modified_time, size in entries:
+            by_file_handle.setdefault(file_handle_id, {})[path] = modified_time
+        for file_handle_id, added in six.iteritems(by_file_handle):
+            def add(cache_map):
+                cache_map.update(added)
+                return cache_map
+            self._update(file_handle_id, add)
+
+    def replace(self, file_handle_id, cache_map, sizes=None):
+        self._update(file_handle_id, lambda old_cache_map: cache_map)
+
+    def remove(self, file_handle_id, paths=None):
+        if not os.path.exists(self.cache.get_cache_dir(file_handle_id)):
+            return
+        if paths is None:
+            self._update(file_handle_id, lambda cache_map: {})
+        else:
+            self._update(file_handle_id, lambda cache_map: dict((path, modified_time)
+                                                                for path, modified_time in six.iteritems(cache_map)
+                                                                if path not in paths))
+
+    def entry_sizes(self, file_handle_id):
+        sizes = dict((path, self.cache._cached_size(path)) for path in self.get(file_handle_id))
+        return dict((path, size) for path, size in six.iteritems(sizes) if size is not None)
+
+    def record_lookups(self, hit_file_handle_ids, misses=0):
+        pass
+
+    def file_handle_ids(self):
+        return [int(os.path.basename(cache_dir)) for cache_dir in self.cache._cache_dirs()
+                if os.path.exists(os.path.join(cache_dir, self.cache.cache_map_file_name))]
+
+    def cached_size(self):
+        return sum(sum(self.entry_sizes(file_handle_id).values()) for file_handle_id in self.file_handle_ids())
+
+    def eviction_candidates(self, policy='lru'):
+        last_cached = dict((file_handle_id, os.path.getmtime(self._cache_map_file(file_handle_id)))
+                           for file_handle_id in self.file_handle_ids())
+        for file_handle_id in sorted(last_cached, key=last_cached.get):
+            size = sum(self.entry_sizes(file_handle_id).values())
+            if size:
+                yield file_handle_id, size
+
+    def stats(self):
+        cache_maps = [self.get(file_handle_id) for file_handle_id in self.file_handle_ids()]
+        return {'file_handles': len([cache_map for cache_map in cache_maps if cache_map]),
+                'files': sum(len(cache_map) for cache_map in cache_maps),
+                'size': self.cached_size(),
+                'hits': 0,
+                'misses': 0}
+
+    def cached_before(self, before_time):
+        return [file_handle_id for file_handle_id in self.file_handle_ids()
+                if os.path.getmtime(self._cache_map_file(file_handle_id)) < before_time]
+
+    def indexed(self, file_handle_ids):
+        return set(int(file_handle_id) for file_handle_id in file_handle_ids
+                   if os.path.exists(self._cache_map_file(file_handle_id)))
+
+    def purged_buckets(self, purge):
+        return set()
+
+    def mark_purged(self, purge, bucket):
+        pass
+
+    def clear_purge_progress(self):
+        pass
+
+    def cache_map_written(self, file_handle_id, modified):
+        pass
+
+    def migrate(self, cache_dirs, cache_map_file_name, sizes=None):
+        pass
+
+
 class Cache():
     """
     Represent a cache in which files are accessed by file handle ID.
+
+    The paths of the cached copies of each file handle are recorded in a
+    :py:class:`synapseclient.cache_index.CacheIndex` in the cache root directory.
+
+    Optionally the cache is bounded in size. Whenever a file is added and the files in the cache root directory
+    take up more than `max_size` bytes, the files of the least recently used ('lru') or least frequently used
+    ('lfu') file handles are deleted until they fit. Copies of files outside the cache root directory and the
+    files of pinned file handles, see :py:meth:`pin`, are never deleted.
+
+    Cached copies can also be looked up in other, read-only, cache roots, such as a shared cache on a network file
+    system that is populated by another client. These tiers are looked in, in order, before the cache root
+    directory, which is the only one that files are added to or removed from.
+
+    :param write_cache_maps: Also keep the ``.cacheMap`` file of each file handle up to date, for the R client
+                             and older versions of this one, which still read them. This rewrites a file on
+                             every change, to write them all at once instead see :py:meth:`export_cache_maps`
+    :param max_size:         The most bytes the files in the cache root directory may take up, or None for no limit
+    :param eviction_policy:  'lru' or 'lfu'
+    :param read_only_cache_root_dirs: Cache roots to look for cached copies in before the cache root directory
     """
 
     def __setattr__(self, key, value):
@@ -85,16 +347,26 @@ class Cache():
             #create the cache_root_dir if it does not already exist
             if not os.path.exists(value):
                 os.makedirs(value)
+            # the index of the new cache root is opened when it is first needed
+            self.__dict__['_index'] = None
         self.__dict__[key] = value
 
 
-    def __init__(self, cache_root_dir=CACHE_ROOT_DIR, fanout=1000):
+    def __init__(self, cache_root_dir=CACHE_ROOT_DIR, fanout=1000, write_cache_maps=False, max_size=None,
+                 eviction_policy='lru', read_only_cache_root_dirs=None):
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError('Invalid eviction policy: "%s", expected one of %s' % (eviction_policy, EVICTION_POLICIES))
 
         ## set root dir of cache in which meta data will be stored and files
         ## will be stored here by default, but other locations can be specified
         self.cache_root_dir = cache_root_dir
         self.fanout = fanout
         self.cache_map_file_name = ".cacheMap"
+        self.write_cache_maps = write_cache_maps
+        self.max_size = max_size
+        self.eviction_policy = eviction_policy
+        self.read_only_tiers = [_ReadOnlyTier(root, fanout, self.cache_map_file_name)
+                                for root in read_only_cache_root_dirs or []]
 
 
     def get_cache_dir(self, file_handle_id):
@@ -106,26 +378,115 @@ class Cache():
         return os.path.join(self.cache_root_dir, str(int(file_handle_id) % self.fanout), str(file_handle_id))
 
 
+    def _get_index(self):
+        """Opens the index of the cache root, importing the .cacheMap files of the cache the first time."""
+        if self._index is None and sqlite3 is None:
+            self._index = _CacheMapIndex(self)
+        elif self._index is None:
+            index = CacheIndex(os.path.join(self.cache_root_dir, INDEX_FILENAME))
+            index.migrate(self._cache_dirs(), self.cache_map_file_name, self._cached_size)
+            self._index = index
+        return self._index
+
+
+    def _in_cache_root(self, path):
+        return utils.normalize_path(path).startswith(utils.normalize_path(self.cache_root_dir) + os.sep)
+
+
+    def _cached_size(self, path):
+        """The size of a cached file if it is in the cache root directory, and so counts towards max_size"""
+        if self._in_cache_root(path) and os.path.isfile(path):
+            return os.path.getsize(path)
+        return None
+
+
     def _read_cache_map(self, cache_dir):
-        cache_map_file = os.path.join(cache_dir, self.cache_map_file_name)
+        """Returns a dict of the cached paths of the file handle of a cache directory to their modification times."""
+        key = os.path.basename(cache_dir)
+        return self._read_cache_maps([key])[int(key)]
 
-        if not os.path.exists(cache_map_file):
-            return {}
 
-        with open(cache_map_file, 'r') as f:
-            cache_map = json.load(f)
-        return cache_map
+    def _read_cache_maps(self, file_handle_ids):
+        """
+        Looks up the cache maps of file handles in the index, as a dict of their IDs as ints, falling back to the
+        .cacheMap files of those it has nothing for, which may have been written by a client that doesn't use it.
+        """
+        index = self._get_index()
+        cache_maps = index.get_many(file_handle_ids)
+        for file_handle_id, cache_map in six.iteritems(cache_maps):
+            if not cache_map:
+                cache_map_file = os.path.join(self.get_cache_dir(file_handle_id), self.cache_map_file_name)
+                cache_maps[file_handle_id] = index.import_cache_map(file_handle_id, cache_map_file, self._cached_size)
+        return cache_maps
 
 
     def _write_cache_map(self, cache_dir, cache_map):
+        """Replaces the cached paths of the file handle of a cache directory."""
+        self._get_index().replace(os.path.basename(cache_dir), cache_map,
+                                  dict((path, self._cached_size(path)) for path in cache_map))
+        if self._exports_cache_maps():
+            self._export_cache_map(cache_dir, cache_map)
+
+
+    def _remove_cache_entries(self, cache_dir, paths=None):
+        index = self._get_index()
+        index.remove(os.path.basename(cache_dir), paths)
+        if self._exports_cache_maps():
+            self._export_cache_map(cache_dir, index.get(os.path.basename(cache_dir)))
+
+
+    def _exports_cache_maps(self):
+        """Whether changes to the index are also written to .cacheMap files, which are the index without sqlite3"""
+        return self.write_cache_maps and sqlite3 is not None
+
+
+    def _export_cache_map(self, cache_dir, cache_map):
+        """Writes a .cacheMap file in the format the R client reads."""
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
 
-        cache_map_file = os.path.join(cache_dir, self.cache_map_file_name)
+        with Lock(self.cache_map_file_name, dir=cache_dir):
+            cache_map_file = os.path.join(cache_dir, self.cache_map_file_name)
+
+            with open(cache_map_file, 'w') as f:
+                json.dump(cache_map, f)
+                f.write('\n') # For compatibility with R's JSON parser
+            self._get_index().cache_map_written(os.path.basename(cache_dir), os.path.getmtime(cache_map_file))
+
 
-        with open(cache_map_file, 'w') as f:
-            json.dump(cache_map, f)
-            f.write('\n') # For compatibility with R's JSON parser
+    def export_cache_maps(self):
+        """
+        Writes the .cacheMap file of every file handle in the cache from the index, so that the R client
+        sees the files cached by this client.
+
+        :returns: the number of .cacheMap files written
+        """
+        index = self._get_index()
+        count = 0
+        for file_handle_id in index.file_handle_ids():
+            self._export_cache_map(self.get_cache_dir(file_handle_id), index.get(file_handle_id))
+            count += 1
+        return count
+
+
+    def _tiers(self, file_handle_ids, cache_maps=None):
+        """
+        Returns a dict of the keys of the given file handles to a list of (cache directory, cache map, writable)
+        tuples, one per tier in the order they are looked in.
+
+        :param cache_maps: the cache maps of the writable tier, if they have already been read
+        """
+        keys = [os.path.basename(self.get_cache_dir(file_handle_id)) for file_handle_id in file_handle_ids]
+        if cache_maps is None:
+            cache_maps = self._read_cache_maps(keys)
+        tiers = dict((key, []) for key in keys)
+        for tier in self.read_only_tiers:
+            tier_cache_maps = tier.get_many(keys)
+            for key in keys:
+                tiers[key].append((tier.get_cache_dir(key), tier_cache_maps[int(key)], False))
+        for key in keys:
+            tiers[key].append((self.get_cache_dir(key), cache_maps[int(key)], True))
+        return tiers
 
 
     def contains(self, file_handle_id, path):
@@ -136,17 +497,15 @@ class Cache():
         :param path: file path at which to look for a cached copy
         """
         cache_dir = self.get_cache_dir(file_handle_id)
-        if not os.path.exists(cache_dir):
-            return False
-
-        with Lock(self.cache_map_file_name, dir=cache_dir):
-            cache_map = self._read_cache_map(cache_dir)
+        key = os.path.basename(cache_dir)
+        tiers = self._tiers([key], {int(key): self._read_cache_map(cache_dir)})[key]
 
-            path = utils.normalize_path(path)
+        path = utils.normalize_path(path)
 
+        for cache_dir, cache_map, writable in tiers:
             cached_time = cache_map.get(path, None)
-            if cached_time:
-                return compare_timestamps(_get_modified_time(path), cached_time)
+            if cached_time and compare_timestamps(_get_modified_time(path), cached_time):
+                return True
         return False
 
 
@@ -165,76 +524,138 @@ class Cache():
                   exists in the specified location or None if it does not
         """
         cache_dir = self.get_cache_dir(file_handle_id)
-        if not os.path.exists(cache_dir):
-            return None
+        key = os.path.basename(cache_dir)
+        tiers = self._tiers([key], {int(key): self._read_cache_map(cache_dir)})[key]
+        cached_file_path = self._find_cached_file(tiers, path)
+        if cached_file_path is not None:
+            self._get_index().record_lookups([key])
+        else:
+            self._get_index().record_lookups([], misses=1)
+        return cached_file_path
 
-        with Lock(self.cache_map_file_name, dir=cache_dir):
-            cache_map = self._read_cache_map(cache_dir)
 
-            path = utils.normalize_path(path)
+    def get_many(self, file_handle_ids, path=None):
+        """
+        Retrieve the files of many file handles from the cache at once, looking them all up in the index
+        with a few queries instead of one per file handle.
+
+        :param file_handle_ids: the IDs of the file handles
+        :param path:            a directory or file path, used for every file handle as by :py:meth:`get`
+
+        :returns: a dict of the given file handle IDs to the paths of their cached copies, or None
+        """
+        file_handle_ids = list(file_handle_ids)
+        keys = dict((file_handle_id, os.path.basename(self.get_cache_dir(file_handle_id)))
+                    for file_handle_id in file_handle_ids)
+        tiers = self._tiers(set(keys.values()))
+        cached_file_paths = {}
+        for file_handle_id, key in keys.items():
+            cached_file_paths[file_handle_id] = self._find_cached_file(tiers[key], path)
+        hits = [keys[file_handle_id]
+                for file_handle_id, cached_file_path in cached_file_paths.items() if cached_file_path is not None]
+        self._get_index().record_lookups(hits, misses=len(cached_file_paths) - len(hits))
+        return cached_file_paths
+
+
+    def _find_in_directory(self, cache_dir, cache_map, path, writable):
+        """Returns an unmodified cached copy in the directory at `path`, removing invalid entries of a writable tier"""
+        matching_unmodified_directory = None
+        removed_entries = []  # invalid entries to remove from the index
+
+        for cached_file_path, cached_time in six.iteritems(cache_map):
+            if path == os.path.dirname(cached_file_path):
+                # compare_timestamps has an implicit check for whether the path exists
+                if compare_timestamps(_get_modified_time(cached_file_path), cached_time):
+                    # "break" instead of "return" to remove invalid entries if necessary
+                    matching_unmodified_directory = cached_file_path
+                    break
+                else:
+                    # remove invalid cache entries pointing to files that that no longer exist or have been modified
+                    removed_entries.append(cached_file_path)
 
-            ## If the caller specifies a path and that path exists in the cache
-            ## but has been modified, we need to indicate no match by returning
-            ## None. The logic for updating a synapse entity depends on this to
-            ## determine the need to upload a new file.
-
-            if path is not None:
-                ## If we're given a path to a directory, look for a cached file in that directory
-                if os.path.isdir(path):
-                    matching_unmodified_directory = None
-                    removed_entry_from_cache = False  # determines if cache_map needs to be rewritten to disk
-
-                    # iterate a copy of cache_map to allow modifying original cache_map
-                    for cached_file_path, cached_time in six.iteritems(dict(cache_map)):
-                        if path == os.path.dirname(cached_file_path):
-                            # compare_timestamps has an implicit check for whether the path exists
-                            if compare_timestamps(_get_modified_time(cached_file_path), cached_time):
-                                # "break" instead of "return" to write removed invalid entries to disk if necessary
-                                matching_unmodified_directory = cached_file_path
-                                break
-                            else:
-                                # remove invalid cache entries pointing to files that that no longer exist or have been modified
-                                del cache_map[cached_file_path]
-                                removed_entry_from_cache = True
-                                
-                    if removed_entry_from_cache:
-                        # write cache_map with non-existant entries removed
-                        self._write_cache_map(cache_dir, cache_map)
+        if removed_entries and writable:
+            self._remove_cache_entries(cache_dir, removed_entries)
+            for cached_file_path in removed_entries:
+                del cache_map[cached_file_path]
 
+        return matching_unmodified_directory
+
+
+    def _find_cached_file(self, tiers, path=None):
+        """
+        Chooses the cached copy of a file handle to use from its cache map in each tier, see :py:meth:`get`.
+        A copy at or in the given path is preferred over one in an earlier tier.
+        """
+        if not any(cache_map for cache_dir, cache_map, writable in tiers):
+            return None
+
+        path = utils.normalize_path(path)
+
+        ## If the caller specifies a path and that path exists in the cache
+        ## but has been modified, we need to indicate no match by returning
+        ## None. The logic for updating a synapse entity depends on this to
+        ## determine the need to upload a new file.
+
+        if path is not None:
+            ## If we're given a path to a directory, look for a cached file in that directory
+            if os.path.isdir(path):
+                for cache_dir, cache_map, writable in tiers:
+                    matching_unmodified_directory = self._find_in_directory(cache_dir, cache_map, path, writable)
                     if matching_unmodified_directory is not None:
                         return matching_unmodified_directory
 
-                ## if we're given a full file path, look up a matching file in the cache
-                else:
-                    cached_time = cache_map.get(path, None)
-                    if cached_time:
-                        return path if compare_timestamps(_get_modified_time(path), cached_time) else None
-
-            ## return most recently cached and unmodified file OR
-            ## None if there are no unmodified files
+            ## if we're given a full file path, look up a matching file in the cache
+            else:
+                cached_times = [cache_map[path] for cache_dir, cache_map, writable in tiers if cache_map.get(path)]
+                if cached_times:
+                    modified_time = _get_modified_time(path)
+                    if any(compare_timestamps(modified_time, cached_time) for cached_time in cached_times):
+                        return path
+                    return None
+
+        ## return most recently cached and unmodified file of the first tier that has one OR
+        ## None if there are no unmodified files
+        for cache_dir, cache_map, writable in tiers:
             for cached_file_path, cached_time in sorted(cache_map.items(), key=operator.itemgetter(1), reverse=True):
                 if compare_timestamps(_get_modified_time(cached_file_path), cached_time):
                     return cached_file_path
-            return None
+        return None
 
 
     def add(self, file_handle_id, path):
         """
         Add a file to the cache
         """
-        if not path or not os.path.exists(path):
-            raise ValueError("Can't find file \"%s\"" % path)
+        return self.add_many([(file_handle_id, path)])[os.path.basename(self.get_cache_dir(file_handle_id))]
 
-        cache_dir = self.get_cache_dir(file_handle_id)
-        with Lock(self.cache_map_file_name, dir=cache_dir):
-            cache_map = self._read_cache_map(cache_dir)
 
+    def add_many(self, file_handle_ids_and_paths):
+        """
+        Add many files to the cache at once, recording them in the index in a single transaction.
+
+        :param file_handle_ids_and_paths: pairs of a file handle ID and the path of a copy of its file
+
+        :returns: a dict of the IDs of the file handles, as strings, to their cache maps
+        """
+        entries = []
+        for file_handle_id, path in file_handle_ids_and_paths:
+            if not path or not os.path.exists(path):
+                raise ValueError("Can't find file \"%s\"" % path)
             path = utils.normalize_path(path)
             ## write .000 milliseconds for backward compatibility
-            cache_map[path] = epoch_time_to_iso(floor(_get_modified_time(path)))
-            self._write_cache_map(cache_dir, cache_map)
+            entries.append((os.path.basename(self.get_cache_dir(file_handle_id)), path,
+                            epoch_time_to_iso(floor(_get_modified_time(path))), self._cached_size(path)))
+        index = self._get_index()
+        index.add_many(entries)
 
-        return cache_map
+        file_handle_ids = sorted(set(entry[0] for entry in entries))
+        cache_maps = dict((str(key), value) for key, value in six.iteritems(index.get_many(file_handle_ids)))
+        if self._exports_cache_maps():
+            for file_handle_id in file_handle_ids:
+                self._export_cache_map(self.get_cache_dir(file_handle_id), cache_maps[file_handle_id])
+        if self.max_size is not None:
+            self.evict(keep=file_handle_ids)
+        return cache_maps
 
 
     def remove(self, file_handle_id, path=None, delete=None):
@@ -243,8 +664,8 @@ class Cache():
 
         :param file_handle_id: Will also extract file handle id from either a File or file handle
         :param path: If the given path is None, remove (and potentially delete)
-                     all cached copies. If the path is that of a file in the
-                     .cacheMap file, remove it.
+                     all cached copies. If the path is that of a cached copy,
+                     remove it.
 
         :returns: A list of files removed
         """
@@ -255,62 +676,279 @@ class Cache():
         if path is None and isinstance(file_handle_id, collections.Mapping) and 'path' in file_handle_id:
             path = file_handle_id['path']
 
-        with Lock(self.cache_map_file_name, dir=cache_dir):
-            cache_map = self._read_cache_map(cache_dir)
+        cache_map = self._read_cache_map(cache_dir)
 
-            if path is None:
-                for path in cache_map:
-                    if delete is True and os.path.exists(path):
-                        os.remove(path)
-                    removed.append(path)
-                cache_map = {}
-            else:
-                path = utils.normalize_path(path)
-                if path in cache_map:
-                    if delete is True and os.path.exists(path):
-                        os.remove(path)
-                    del cache_map[path]
-                    removed.append(path)
+        if path is None:
+            removed = list(cache_map)
+        else:
+            path = utils.normalize_path(path)
+            if path in cache_map:
+                removed = [path]
 
-            self._write_cache_map(cache_dir, cache_map)
+        if removed:
+            if delete is True:
+                for removed_path in removed:
+                    if os.path.exists(removed_path):
+                        os.remove(removed_path)
+            self._remove_cache_entries(cache_dir, removed)
 
         return removed
 
 
+    @contextlib.contextmanager
+    def pin(self, file_handle_id):
+        """
+        Keeps the files of a file handle from being evicted, by this or any other process, while in the context.
+        Where flock isn't available they are only kept from being evicted by this process.
+        """
+        cache_dir = self.get_cache_dir(file_handle_id)
+        if not os.path.isdir(cache_dir):
+            ## none of its files are in the cache root directory, where they could be evicted from
+            yield
+            return
+        with _pins_lock:
+            _pins[cache_dir] += 1
+        try:
+            with Lock(PIN_LOCK_NAME, dir=cache_dir, shared=True):
+                yield
+        finally:
+            with _pins_lock:
+                _pins[cache_dir] -= 1
+                if not _pins[cache_dir]:
+                    del _pins[cache_dir]
+
+
+    def _lock_unpinned(self, cache_dir):
+        """Returns an exclusive pin lock of a cache directory that exists, or None if the file handle is pinned"""
+        lock = Lock(PIN_LOCK_NAME, dir=cache_dir)
+        with _pins_lock:
+            if _pins[cache_dir]:
+                return None
+        if os.path.isdir(cache_dir) and not lock.acquire(break_old_locks=False):
+            return None
+        return lock
+
+
+    def _linked_from_outside(self, file_handle_id):
+        """
+        True if a copy of a file handle outside the cache root directory is a symbolic link to a file in its cache
+        directory, as made by the 'symlink' link_mode, which deleting the cache directory would leave dangling.
+        """
+        cache_dir = os.path.realpath(self.get_cache_dir(file_handle_id)) + os.sep
+        for path in self._get_index().get(file_handle_id):
+            if not self._in_cache_root(path) and os.path.islink(path) \
+                    and os.path.realpath(path).startswith(cache_dir):
+                return True
+        return False
+
+
+    def evict(self, max_size=None, keep=None):
+        """
+        Deletes the files in the cache root directory of the least recently or frequently used file handles,
+        according to the eviction policy, until they take up no more than `max_size` bytes. File handles that
+        are pinned, or that have symbolic links to their cached files outside the cache root directory, are skipped.
+
+        :param max_size: defaults to the max_size of the cache
+        :param keep:     a file handle, or list of them, whose files are not to be evicted, such as those just added
+
+        :returns: the IDs of the file handles whose files were deleted
+        """
+        max_size = self.max_size if max_size is None else max_size
+        index = self._get_index()
+        cached_size = index.cached_size()
+        evicted = []
+        if max_size is None or cached_size <= max_size:
+            return evicted
+        if keep is None:
+            keep = []
+        elif isinstance(keep, (six.string_types, six.integer_types, collections.Mapping)):
+            keep = [keep]
+        keep = set(os.path.basename(self.get_cache_dir(file_handle_id)) for file_handle_id in keep)
+        for file_handle_id, size in index.eviction_candidates(self.eviction_policy):
+            if cached_size <= max_size:
+                break
+            if str(file_handle_id) in keep or self._linked_from_outside(file_handle_id):
+                continue
+            cache_dir = self.get_cache_dir(file_handle_id)
+            lock = self._lock_unpinned(cache_dir)
+            if lock is None:
+                continue
+            try:
+                ## the entries may have changed since the candidate was read
+                sizes = dict((path, size) for path, size in six.iteritems(index.entry_sizes(file_handle_id))
+                             if self._in_cache_root(path))
+                paths = list(sizes)
+                index.remove(file_handle_id, paths)
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+            finally:
+                lock.release()
+            if self._exports_cache_maps():
+                self._export_cache_map(cache_dir, index.get(file_handle_id))
+            cached_size -= sum(sizes.values())
+            evicted.append(file_handle_id)
+        return evicted
+
+
+    def stats(self):
+        """
+        Returns a dict of the number of file handles and files in the cache, the size of the files in the cache
+        root directory and the number of lookups that found a cached copy ('hits') or not ('misses').
+        """
+        return self._get_index().stats()
+
+
     def _cache_dirs(self):
         """
         Generate a list of all cache dirs, directories of the form:
         [cache.cache_root_dir]/949/59949
         """
-        for item1 in os.listdir(self.cache_root_dir):
-            path1 = os.path.join(self.cache_root_dir, item1)
-            if os.path.isdir(path1) and re.match('\d+', item1):
-                for item2 in os.listdir(path1):
-                    path2 = os.path.join(path1, item2)
-                    if os.path.isdir(path2) and re.match('\d+', item2):
-                        yield path2
+        for bucket, bucket_dir in _numbered_subdirectories(self.cache_root_dir):
+            for file_handle_id, cache_dir in _numbered_subdirectories(bucket_dir):
+                yield cache_dir
 
 
-    def purge(self, before_date, dry_run=False):
+    def _purge_file_handle(self, file_handle_id, dry_run):
+        """
+        Deletes the cache directory and index entries of a file handle, unless it is pinned or has symbolic links
+        to its cached files outside the cache root directory.
+
+        :returns: the size of the cache directory, or None if the file handle was skipped
         """
-        Purge the cache. Use with caution. Delete files whose cache maps were last updated prior to the given date.
+        if self._linked_from_outside(file_handle_id):
+            return None
+        cache_dir = self.get_cache_dir(file_handle_id)
+        lock = self._lock_unpinned(cache_dir)
+        if lock is None:
+            return None
+        try:
+            size = _directory_size(cache_dir)
+            if dry_run:
+                print(cache_dir)
+            else:
+                ## the index entries go first, so that an interrupted purge never leaves entries for deleted files
+                self._get_index().remove(file_handle_id)
+                shutil.rmtree(cache_dir, ignore_errors=True)
+        finally:
+            lock.release()
+        return size
+
 
-        Deletes .cacheMap files and files stored in the cache.cache_root_dir, but does not delete
-        files stored outside the cache.
+    def _purge_file_handles(self, file_handle_ids, dry_run):
+        """Purges file handles, returning a PurgeResult and the IDs of those that were purged"""
+        sizes = dict((file_handle_id, self._purge_file_handle(file_handle_id, dry_run))
+                     for file_handle_id in file_handle_ids)
+        purged = [file_handle_id for file_handle_id, size in six.iteritems(sizes) if size is not None]
+        return PurgeResult(len(purged), sum(sizes[file_handle_id] for file_handle_id in purged),
+                           len(sizes) - len(purged)), purged
+
+
+    def _purge_bucket(self, bucket, candidates, before_date, dry_run):
+        """
+        Purges the file handles of a fanout bucket that were last cached before the given date, and the cache
+        directories in the bucket that are not in the index unless their .cacheMap was written since then.
+        """
+        bucket_dir = os.path.join(self.cache_root_dir, str(bucket))
+        cache_dirs = dict(_numbered_subdirectories(bucket_dir)) if os.path.isdir(bucket_dir) else {}
+        indexed = self._get_index().indexed(cache_dirs)
+        file_handle_ids = set(int(file_handle_id) for file_handle_id in candidates)
+        for file_handle_id, cache_dir in six.iteritems(cache_dirs):
+            if int(file_handle_id) not in indexed:
+                ## It's OK to purge directories in the cache that nothing was recorded for
+                last_modified_time = _get_modified_time(os.path.join(cache_dir, self.cache_map_file_name))
+                if last_modified_time is None or before_date > last_modified_time:
+                    file_handle_ids.add(int(file_handle_id))
+        return self._purge_file_handles(sorted(file_handle_ids), dry_run)[0]
+
+
+    def purge(self, before_date=None, dry_run=False, target_size=None, max_threads=DEFAULT_MAX_THREADS):
+        """
+        Purge the cache. Use with caution. Deletes the cache directories and index entries of file handles,
+        including the files stored in the cache.cache_root_dir, but does not delete files stored outside the cache.
+        File handles that are pinned, see :py:meth:`pin`, and those that have symbolic links to their cached files
+        outside the cache root directory, which would be left dangling, are skipped.
+
+        :param before_date: delete the file handles that were last cached prior to this date or time in seconds
+                            since the epoch
+        :param dry_run:     only print the cache directories that would be deleted
+        :param target_size: delete the least recently or frequently used file handles, according to the eviction
+                            policy, until the files in the cache root directory take up no more than this many bytes
+        :param max_threads: the number of threads that delete directories, each working through a fanout bucket
+                            (the directories named by file handle ID modulo the fanout) at a time
+
+        A purge by date records the buckets it has finished in the index, so that if it is interrupted it picks
+        up where it left off when it is run again with the same date.
+
+        :returns: the number of file handles purged, as a :py:class:`PurgeResult` that also has the bytes reclaimed
+                  and the number of file handles skipped because they were pinned or linked to
         """
+        if before_date is None and target_size is None:
+            raise ValueError("Either before_date or target_size is required")
+        pool = TransferPool(max_threads)
+        try:
+            results = []
+            if before_date is not None:
+                results.append(self._purge_before(before_date, dry_run, pool))
+            if target_size is not None:
+                results.append(self._purge_to_size(target_size, dry_run, pool))
+        finally:
+            pool.close()
+        return _total(results)
+
+
+    def _purge_before(self, before_date, dry_run, pool):
         if isinstance(before_date, datetime.datetime):
             before_date = utils.to_unix_epoch_time_secs(before_date)
-        count = 0
-        for cache_dir in self._cache_dirs():
-            ## _get_modified_time returns None if the cache map file doesn't
-            ## exist and n > None evaluates to True in python 2.7(wtf?). I'm guessing it's
-            ## OK to purge directories in the cache that have no .cacheMap file
-            last_modified_time = _get_modified_time(os.path.join(cache_dir, self.cache_map_file_name))
-            if last_modified_time == None or before_date > last_modified_time:
-                if dry_run:
-                    print(cache_dir)
-                else:
-                    shutil.rmtree(cache_dir)
-                count += 1
-        return count
+        index = self._get_index()
+        purge = 'before %r' % before_date
+        done = index.purged_buckets(purge) if not dry_run else set()
+
+        candidates = {}
+        for file_handle_id in index.cached_before(before_date):
+            candidates.setdefault(file_handle_id % self.fanout, []).append(file_handle_id)
+        buckets = set(int(bucket) for bucket, bucket_dir in _numbered_subdirectories(self.cache_root_dir))
+        buckets = sorted((buckets | set(candidates)) - done)
+
+        def purge_bucket(bucket):
+            result = self._purge_bucket(bucket, candidates.get(bucket, []), before_date, dry_run)
+            if not dry_run:
+                index.mark_purged(purge, bucket)
+            return result
 
+        results = pool.map(purge_bucket, buckets)
+        if not dry_run:
+            index.clear_purge_progress()
+        return _total(results)
+
+
+    def _purge_to_size(self, target_size, dry_run, pool):
+        """
+        Purges the file handles in eviction order in batches of a size that would bring the cache under the
+        target, deleting each batch concurrently, until the cache is under the target or nothing is left to purge.
+        """
+        index = self._get_index()
+        cached_size = index.cached_size()
+        results = []
+        candidates = index.eviction_candidates(self.eviction_policy)
+        while cached_size > target_size:
+            batch = {}
+            batch_size = 0
+            for file_handle_id, size in candidates:
+                batch.setdefault(file_handle_id % self.fanout, []).append((file_handle_id, size))
+                batch_size += size
+                if cached_size - batch_size <= target_size:
+                    break
+            if not batch:
+                break
+
+            def purge_bucket(file_handles):
+                sizes = dict(file_handles)
+                result, purged = self._purge_file_handles(sorted(sizes), dry_run)
+                ## what counts towards the target is the recorded size of the files in the cache root
+                return result, sum(sizes[file_handle_id] for file_handle_id in purged)
+
+            for result, reclaimed in pool.map(purge_bucket, list(batch.values())):
+                results.append(result)
+                cached_size -= reclaimed
+        return _total(results)
@@ -0,0 +1,594 @@
+"""
+***********
+Cache index
+***********
+
+An SQLite database in the cache root directory that records, for each file
+handle, the local paths it has been downloaded or uploaded from and their
+modification times when they were cached. It replaces the ``.cacheMap`` JSON
+file that used to be kept in the cache directory of every file handle, which
+had to be locked, read and rewritten on each lookup. The database is opened in
+write-ahead logging mode so that lookups don't wait on writers, and is shared
+by every thread and process that uses the same cache root directory. Write-ahead
+logging needs memory shared between the processes, so on network file systems,
+or wherever it can't be turned on, the database uses a rollback journal instead.
+
+The index also records the size of the cached files that are inside the cache
+root directory, when each file handle was last looked up and how often, and
+the number of lookups that found or missed a cached copy, which are used to
+evict files when the cache is bounded in size. The size of each file handle
+and the total size of the cache are updated along with its entries, so that
+checking the size of the cache and finding what to evict don't read the
+entries of every file handle.
+
+The ``.cacheMap`` files of an existing cache are imported the first time the
+index is opened, and those written later by clients that don't use the index,
+such as the R client, are imported when a file handle isn't found in it. The
+index of a cache that is only read, such as a shared cache maintained by another
+client, is opened read-only and never changed. The ``.cacheMap`` files are
+only kept up to date as well if the cache is asked to, otherwise they can be
+written all at once with :py:meth:`synapseclient.cache.Cache.export_cache_maps`
+so that those clients see the files cached by this one. Without
+the ``sqlite3`` module the cache keeps using only the ``.cacheMap`` files.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+
+import six
+
+try:
+    import sqlite3
+except ImportError:
+    ## the cache falls back to .cacheMap files, see synapseclient.cache
+    sqlite3 = None
+
+INDEX_FILENAME = '.cacheIndex.sqlite'
+## seconds to wait on another process that is writing to the index, which can be long while a large cache is migrated
+BUSY_TIMEOUT = 600
+## the most parameters in one SQLite statement
+_MAX_VARIABLES = 500
+## the types of file system, as listed in /proc/mounts, that don't support write-ahead logging
+NETWORK_FILE_SYSTEMS = frozenset(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'lustre', 'gpfs', 'ceph',
+                                  'glusterfs', 'fuse.glusterfs', 'fuse.sshfs', 'beegfs', '9p'])
+
+## the order in which file handles are evicted, by least recent or least frequent use, ties broken by least recent use
+EVICTION_ORDER = {'lru': ('last_accessed', 'file_handle_id'),
+                  'lfu': ('access_count', 'last_accessed', 'file_handle_id')}
+## the number of eviction candidates read from the index at a time
+EVICTION_BATCH_SIZE = 100
+
+_SCHEMA = ["""CREATE TABLE IF NOT EXISTS cache_entries (
+                  file_handle_id INTEGER NOT NULL,
+                  path TEXT NOT NULL,
+                  modified_time TEXT NOT NULL,
+                  cached_at REAL NOT NULL,
+                  size INTEGER,
+                  PRIMARY KEY (file_handle_id, path))""",
+           """CREATE TABLE IF NOT EXISTS file_handle_usage (
+                  file_handle_id INTEGER PRIMARY KEY,
+                  last_accessed REAL NOT NULL,
+                  access_count INTEGER NOT NULL,
+                  size INTEGER)""",
+           """CREATE TABLE IF NOT EXISTS purge_progress (
+                  purge TEXT NOT NULL,
+                  bucket INTEGER NOT NULL,
+                  PRIMARY KEY (purge, bucket))""",
+           """CREATE TABLE IF NOT EXISTS counters (
+                  key TEXT PRIMARY KEY,
+                  value INTEGER NOT NULL)""",
+           """CREATE TABLE IF NOT EXISTS metadata (
+                  key TEXT PRIMARY KEY,
+                  value TEXT)""",
+           """CREATE TABLE IF NOT EXISTS imported_cache_maps (
+                  file_handle_id INTEGER PRIMARY KEY,
+                  modified REAL NOT NULL)"""]
+
+
+def _batches(items, size=_MAX_VARIABLES):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+## columns added since the index was introduced, which older databases are upgraded with
+_ADDED_COLUMNS = [('cache_entries', 'size', 'INTEGER'),
+                  ('file_handle_usage', 'size', 'INTEGER')]
+
+## the file handles with files in the cache root directory in each eviction order, created after the added columns
+_INDEXES = ["CREATE INDEX IF NOT EXISTS usage_%s ON file_handle_usage (%s) WHERE size > 0"
+            % (policy, ', '.join(columns)) for policy, columns in sorted(EVICTION_ORDER.items())]
+
+## the counter of the total size of the files in the cache root directory
+_CACHED_SIZE = 'size'
+
+
+## the number of lookups counted in memory before they are written to the index
+LOOKUP_BATCH_SIZE = 1000
+## the writable indexes whose lookup counts are written when the process exits
+_open_indexes = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_indexes():
+    for index in list(_open_indexes):
+        try:
+            index.flush_lookups()
+        except Exception:
+            ## the counts are only used to choose what to evict, so losing them is not an error
+            pass
+
+
+def _counter(hit):
+    return 'hits' if hit else 'misses'
+
+
+def _increment_counter(cursor, key, amount):
+    if amount:
+        cursor.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (key,))
+        cursor.execute("UPDATE counters SET value=value+? WHERE key=?", (amount, key))
+
+
+def _recount_sizes(cursor):
+    """
+    Sets the size of each file handle and the total size of the cache from the cache entries, and records a use of
+    the file handles that have none when they were last cached. This reads every entry, so it is only done once,
+    when an index that didn't keep the sizes is upgraded, and after the .cacheMap files are migrated.
+    """
+    cursor.execute('INSERT OR IGNORE INTO file_handle_usage (file_handle_id, last_accessed, access_count)'
+                   ' SELECT file_handle_id, MAX(cached_at), 0 FROM cache_entries GROUP BY file_handle_id')
+    cursor.execute('UPDATE file_handle_usage SET'
+                   ' last_accessed=MAX(last_accessed, COALESCE((SELECT MAX(cached_at) FROM cache_entries e'
+                   '                                            WHERE e.file_handle_id=file_handle_usage.file_handle_id), 0)),'
+                   ' size=(SELECT SUM(size) FROM cache_entries e WHERE e.file_handle_id=file_handle_usage.file_handle_id)')
+    cursor.execute('INSERT OR REPLACE INTO counters VALUES (?, (SELECT COALESCE(SUM(size), 0) FROM cache_entries))',
+                   (_CACHED_SIZE,))
+
+
+def _sizes(cursor, file_handle_ids):
+    """Returns a dict of file handle IDs to the total size of their files in the cache root directory, if any"""
+    sizes = {}
+    for batch in _batches(file_handle_ids):
+        sizes.update(cursor.execute('SELECT file_handle_id, SUM(size) FROM cache_entries WHERE file_handle_id IN (%s)'
+                                    ' GROUP BY file_handle_id' % ','.join('?' * len(batch)), batch).fetchall())
+    return sizes
+
+
+## row values, which let a query seek to a position in an index of several columns, need SQLite 3.15
+_ROW_VALUES = sqlite3 is not None and sqlite3.sqlite_version_info >= (3, 15, 0)
+
+
+def _after(columns, values):
+    """
+    Returns the condition that a row comes after one with the given values of `columns`, in the order of those
+    columns, and its parameters.
+    """
+    if _ROW_VALUES:
+        return '(%s) > (%s)' % (', '.join(columns), ', '.join('?' * len(columns))), list(values)
+    condition = ' OR '.join('(%s)' % ' AND '.join(['%s=?' % column for column in columns[:i]] + ['%s>?' % columns[i]])
+                            for i in range(len(columns)))
+    parameters = [values[0]]
+    for i in range(len(columns)):
+        parameters.extend(values[:i+1])
+    ## the bound on the first column lets the query seek in the index
+    return '%s>=? AND (%s)' % (columns[0], condition), parameters
+
+
+def _file_system_type(path):
+    """The type of the file system a path is on, as listed in /proc/mounts, or None where that isn't available"""
+    try:
+        with open('/proc/mounts', 'r') as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) > 2]
+    except (IOError, OSError):
+        return None
+    path = os.path.realpath(path)
+    file_system_type = None
+    longest = -1
+    for mount_point, mount_type in mounts:
+        ## spaces in mount points are escaped as octal
+        mount_point = mount_point.replace('\\040', ' ')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > longest:
+            file_system_type, longest = mount_type, len(mount_point)
+    return file_system_type
+
+
+class CacheIndex(object):
+    """
+    The paths of the cached copies of file handles and the modification times they were cached with, as
+    ISO formatted strings like the values of a ``.cacheMap``. Sizes are only recorded for files in the cache
+    root directory, those that may be evicted.
+
+    :param db_path:   the database file, created when it is first needed
+    :param read_only: only look up entries, without creating or changing the database
+    """
+
+    def __init__(self, db_path, read_only=False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self._local = threading.local()
+        self._lookups_lock = threading.Lock()
+        self._reset_lookups()
+        if not read_only:
+            _open_indexes.add(self)
+
+    def _connect_read_only(self):
+        if six.PY2:
+            return sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        uri = 'file:%s?mode=ro' % six.moves.urllib.request.pathname2url(os.path.abspath(self.db_path))
+        connection = sqlite3.connect(uri, timeout=BUSY_TIMEOUT, isolation_level=None, uri=True)
+        try:
+            connection.execute('SELECT 1 FROM cache_entries LIMIT 1').fetchall()
+        except sqlite3.OperationalError:
+            ## a database in WAL mode on a read-only file system can only be read as immutable
+            connection.close()
+            connection = sqlite3.connect(uri + '&immutable=1', isolation_level=None, uri=True)
+        return connection
+
+    def _connection(self):
+        ## connections are not shared between threads, nor with processes forked from this one
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            if self.read_only:
+                connection = self._connect_read_only()
+            else:
+                connection = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+                self._set_journal_mode(connection)
+                for statement in _SCHEMA:
+                    connection.execute(statement)
+                for table, column, column_type in _ADDED_COLUMNS:
+                    if column not in [row[1] for row in connection.execute('PRAGMA table_info(%s)' % table)]:
+                        try:
+                            connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, column_type))
+                        except sqlite3.OperationalError:
+                            ## another process added it first
+                            pass
+                for statement in _INDEXES:
+                    connection.execute(statement)
+                self._count_sizes(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _set_journal_mode(self, connection):
+        journal_mode = None
+        if _file_system_type(os.path.dirname(os.path.abspath(self.db_path))) not in NETWORK_FILE_SYSTEMS:
+            try:
+                journal_mode = connection.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+            except sqlite3.OperationalError:
+                pass
+        if journal_mode != 'wal':
+            try:
+                connection.execute('PRAGMA journal_mode=DELETE')
+            except sqlite3.OperationalError:
+                ## a process on another host has the database open in WAL mode, which only it can change
+                pass
+
+    def _count_sizes(self, connection):
+        """Starts keeping the sizes of the file handles and the total size of the cache, if not done already."""
+        if connection.execute("SELECT value FROM metadata WHERE key='sizes_counted'").fetchone() is not None:
+            return
+        cursor = connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if cursor.execute("SELECT value FROM metadata WHERE key='sizes_counted'").fetchone() is None:
+                _recount_sizes(cursor)
+                cursor.execute("INSERT INTO metadata VALUES ('sizes_counted', ?)", (str(time.time()),))
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+    @staticmethod
+    def _changing_sizes(cursor, file_handle_ids, statements, used_at=None):
+        """
+        Runs a function that changes the cache entries of the given file handles and updates their sizes and the
+        total size of the cache in the same transaction, without reading the entries of any other file handle.
+
+        :param used_at: (optional) a time to record as a use of the file handles, for those that were added
+        """
+        file_handle_ids = sorted(set(int(file_handle_id) for file_handle_id in file_handle_ids))
+        before = _sizes(cursor, file_handle_ids)
+        statements()
+        after = _sizes(cursor, file_handle_ids)
+        if used_at is not None:
+            cursor.executemany('INSERT OR IGNORE INTO file_handle_usage (file_handle_id, last_accessed, access_count)'
+                               ' VALUES (?, ?, 0)', [(file_handle_id, used_at) for file_handle_id in file_handle_ids])
+            cursor.executemany('UPDATE file_handle_usage SET last_accessed=MAX(last_accessed, ?) WHERE file_handle_id=?',
+                               [(used_at, file_handle_id) for file_handle_id in file_handle_ids])
+        cursor.executemany('UPDATE file_handle_usage SET size=? WHERE file_handle_id=?',
+                           [(after.get(file_handle_id), file_handle_id) for file_handle_id in file_handle_ids])
+        _increment_counter(cursor, _CACHED_SIZE, sum(size or 0 for size in after.values()) -
+                           sum(size or 0 for size in before.values()))
+
+    def _transaction(self, statements):
+        """Runs a function of a cursor in a write transaction and returns its result."""
+        if self.read_only:
+            raise ValueError("The cache index %s is read-only" % self.db_path)
+        connection = self._connection()
+        cursor = connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(cursor)
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+        return result
+
+    def get(self, file_handle_id):
+        """Returns a dict of the cached paths of a file handle to their modification times."""
+        rows = self._connection().execute('SELECT path, modified_time FROM cache_entries WHERE file_handle_id=?',
+                                          (int(file_handle_id),))
+        return dict(rows.fetchall())
+
+    def get_many(self, file_handle_ids):
+        """Looks up many file handles at once, returning a dict of file handle ID to the dict :py:meth:`get` returns."""
+        file_handle_ids = list(set(int(file_handle_id) for file_handle_id in file_handle_ids))
+        entries = dict((file_handle_id, {}) for file_handle_id in file_handle_ids)
+        connection = self._connection()
+        for batch in _batches(file_handle_ids):
+            rows = connection.execute('SELECT file_handle_id, path, modified_time FROM cache_entries'
+                                      ' WHERE file_handle_id IN (%s)' % ','.join('?' * len(batch)), batch)
+            for file_handle_id, path, modified_time in rows:
+                entries[file_handle_id][path] = modified_time
+        return entries
+
+    def add(self, file_handle_id, path, modified_time, size=None):
+        self.add_many([(file_handle_id, path, modified_time, size)])
+
+    def add_many(self, entries):
+        """Adds (file handle ID, path, modified time, size) tuples in one transaction."""
+        now = time.time()
+        hits, misses = self._take_lookups()
+
+        def statements(cursor):
+            self._changing_sizes(cursor, [entry[0] for entry in entries], lambda: cursor.executemany(
+                'INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?)',
+                [(int(file_handle_id), path, modified_time, now, size)
+                 for file_handle_id, path, modified_time, size in entries]), used_at=now)
+            self._write_lookups(cursor, hits, misses)
+        self._transaction(statements)
+
+    def entry_sizes(self, file_handle_id):
+        """Returns a dict of the cached paths of a file handle that have a recorded size to their sizes."""
+        rows = self._connection().execute('SELECT path, size FROM cache_entries'
+                                          ' WHERE file_handle_id=? AND size IS NOT NULL', (int(file_handle_id),))
+        return dict(rows.fetchall())
+
+    def record_lookups(self, hit_file_handle_ids, misses=0):
+        """
+        Counts the lookups that found a cached copy of the given file handles, recording them as uses of the
+        file handles, and a number of lookups that found none. The counts are kept in memory and written in
+        batches, along with added entries, before they are read and when the process exits.
+        """
+        now = time.time()
+        with self._lookups_lock:
+            if self._lookups_pid != os.getpid():
+                ## lookups counted by the process this one was forked from are its own to write
+                self._reset_lookups()
+            for file_handle_id in hit_file_handle_ids:
+                last_accessed, count = self._hits.get(int(file_handle_id), (now, 0))
+                self._hits[int(file_handle_id)] = (now, count + 1)
+            self._misses += misses
+            self._unwritten_lookups += len(hit_file_handle_ids) + misses
+            unwritten_lookups = self._unwritten_lookups
+        if unwritten_lookups >= LOOKUP_BATCH_SIZE:
+            self.flush_lookups()
+
+    def _reset_lookups(self):
+        self._hits = {}
+        self._misses = 0
+        self._unwritten_lookups = 0
+        self._lookups_pid = os.getpid()
+
+    def _take_lookups(self):
+        """Returns the lookups counted since they were last written, and forgets them"""
+        with self._lookups_lock:
+            if self._lookups_pid != os.getpid():
+                self._reset_lookups()
+            hits, misses = self._hits, self._misses
+            self._reset_lookups()
+        return hits, misses
+
+    @staticmethod
+    def _write_lookups(cursor, hits, misses):
+        for hit, count in ((True, sum(count for last_accessed, count in hits.values())), (False, misses)):
+            _increment_counter(cursor, _counter(hit), count)
+        cursor.executemany('INSERT OR IGNORE INTO file_handle_usage (file_handle_id, last_accessed, access_count)'
+                           ' VALUES (?, 0, 0)',
+                           [(file_handle_id,) for file_handle_id in hits])
+        cursor.executemany('UPDATE file_handle_usage SET last_accessed=MAX(last_accessed, ?),'
+                           ' access_count=access_count+? WHERE file_handle_id=?',
+                           [(last_accessed, count, file_handle_id)
+                            for file_handle_id, (last_accessed, count) in six.iteritems(hits)])
+
+    def flush_lookups(self):
+        """Writes the lookups counted by :py:meth:`record_lookups` that haven't been written yet."""
+        if self.read_only:
+            return
+        hits, misses = self._take_lookups()
+        if hits or misses:
+            self._transaction(lambda cursor: self._write_lookups(cursor, hits, misses))
+
+    def cached_size(self):
+        """The total size of the files in the cache root directory."""
+        connection = self._connection()
+        row = connection.execute('SELECT value FROM counters WHERE key=?', (_CACHED_SIZE,)).fetchone()
+        if row is None:
+            ## a read-only index written by a version that didn't keep the total
+            return connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries').fetchone()[0]
+        return row[0]
+
+    def eviction_candidates(self, policy='lru', batch_size=None):
+        """
+        Yields the IDs of the file handles with files in the cache root directory and the total size of those
+        files, in the order they should be evicted by the given policy, 'lru' or 'lfu'. They are read from the
+        index `batch_size` at a time, each batch starting after the last file handle of the one before, so that
+        file handles can be removed while the candidates are being read.
+        """
+        self.flush_lookups()
+        columns = EVICTION_ORDER[policy]
+        batch_size = batch_size or EVICTION_BATCH_SIZE
+        query = 'SELECT %s, size FROM file_handle_usage WHERE size > 0 %%s ORDER BY %s LIMIT ?' \
+                % (', '.join(columns), ', '.join(columns))
+        rows = self._connection().execute(query % '', (batch_size,)).fetchall()
+        while rows:
+            for row in rows:
+                yield row[-2], row[-1]
+            condition, parameters = _after(columns, rows[-1][:-1])
+            rows = self._connection().execute(query % ('AND ' + condition), parameters + [batch_size]).fetchall()
+
+    def stats(self):
+        """Returns a dict of the number of file handles and files in the cache, their size and lookup counts."""
+        self.flush_lookups()
+        connection = self._connection()
+        file_handles, files = connection.execute('SELECT COUNT(DISTINCT file_handle_id), COUNT(*)'
+                                                 ' FROM cache_entries').fetchone()
+        counters = dict(connection.execute('SELECT key, value FROM counters').fetchall())
+        return {'file_handles': file_handles,
+                'files': files,
+                'size': self.cached_size(),
+                'hits': counters.get(_counter(True), 0),
+                'misses': counters.get(_counter(False), 0)}
+
+    def remove(self, file_handle_id, paths=None):
+        """Removes the given paths of a file handle, or all of them if `paths` is None."""
+        def statements(cursor):
+            if paths is None:
+                self._changing_sizes(cursor, [file_handle_id], lambda: cursor.execute(
+                    'DELETE FROM cache_entries WHERE file_handle_id=?', (int(file_handle_id),)))
+                cursor.execute('DELETE FROM file_handle_usage WHERE file_handle_id=?', (int(file_handle_id),))
+            else:
+                self._changing_sizes(cursor, [file_handle_id], lambda: cursor.executemany(
+                    'DELETE FROM cache_entries WHERE file_handle_id=? AND path=?',
+                    [(int(file_handle_id), path) for path in paths]))
+        self._transaction(statements)
+
+    def replace(self, file_handle_id, cache_map, sizes=None):
+        """
+        Makes the paths of a file handle those of a ``.cacheMap`` style dict of path to modification time.
+
+        :param sizes: a dict of the paths in the cache root directory to their sizes
+        """
+        now = time.time()
+        sizes = sizes or {}
+
+        def replace_entries(cursor):
+            cursor.execute('DELETE FROM cache_entries WHERE file_handle_id=?', (int(file_handle_id),))
+            cursor.executemany('INSERT INTO cache_entries VALUES (?, ?, ?, ?, ?)',
+                               [(int(file_handle_id), path, modified_time, now, sizes.get(path))
+                                for path, modified_time in cache_map.items()])
+        self._transaction(lambda cursor: self._changing_sizes(cursor, [file_handle_id], lambda: replace_entries(cursor),
+                                                              used_at=now if cache_map else None))
+
+    def file_handle_ids(self):
+        """Returns the IDs of all file handles with cached copies."""
+        return [row[0] for row in self._connection().execute('SELECT DISTINCT file_handle_id FROM cache_entries')]
+
+    def cached_before(self, before_time):
+        """Returns the IDs of the file handles that were last cached before the given time, in seconds since the epoch."""
+        return [row[0] for row in self._connection().execute('SELECT file_handle_id FROM cache_entries GROUP BY'
+                                                             ' file_handle_id HAVING MAX(cached_at) < ?', (before_time,))]
+
+    def indexed(self, file_handle_ids):
+        """Returns the set of the given file handle IDs that have cached copies."""
+        file_handle_ids = list(set(int(file_handle_id) for file_handle_id in file_handle_ids))
+        connection = self._connection()
+        found = set()
+        for batch in _batches(file_handle_ids):
+            found.update(row[0] for row in connection.execute('SELECT DISTINCT file_handle_id FROM cache_entries'
+                                                              ' WHERE file_handle_id IN (%s)' % ','.join('?' * len(batch)),
+                                                              batch))
+        return found
+
+    def purged_buckets(self, purge):
+        """Returns the fanout buckets that an interrupted purge, identified by a string of its parameters, finished."""
+        return set(row[0] for row in self._connection().execute('SELECT bucket FROM purge_progress WHERE purge=?',
+                                                                (purge,)))
+
+    def mark_purged(self, purge, bucket):
+        self._transaction(lambda cursor: cursor.execute('INSERT OR IGNORE INTO purge_progress VALUES (?, ?)',
+                                                        (purge, int(bucket))))
+
+    def clear_purge_progress(self):
+        self._transaction(lambda cursor: cursor.execute('DELETE FROM purge_progress'))
+
+    def migrate(self, cache_dirs, cache_map_file_name, sizes=lambda path: None):
+        """
+        Imports the ``.cacheMap`` files of the given cache directories, named by file handle ID, unless it has
+        been done before. The time each file handle was cached is taken to be when its ``.cacheMap`` was written.
+
+        :param sizes: a function of a cached path that returns its size if it is in the cache root directory
+        """
+        if self._connection().execute("SELECT value FROM metadata WHERE key='migrated'").fetchone() is not None:
+            return
+
+        def statements(cursor):
+            if cursor.execute("SELECT value FROM metadata WHERE key='migrated'").fetchone() is not None:
+                return
+            for cache_dir in cache_dirs:
+                cache_map_file = os.path.join(cache_dir, cache_map_file_name)
+                try:
+                    with open(cache_map_file, 'r') as f:
+                        cache_map = json.load(f)
+                    cached_at = os.path.getmtime(cache_map_file)
+                except (IOError, OSError, ValueError):
+                    continue
+                file_handle_id = int(os.path.basename(cache_dir))
+                cursor.executemany('INSERT OR IGNORE INTO cache_entries VALUES (?, ?, ?, ?, ?)',
+                                   [(file_handle_id, path, modified_time, cached_at, sizes(path))
+                                    for path, modified_time in cache_map.items()])
+            _recount_sizes(cursor)
+            cursor.execute("INSERT INTO metadata VALUES ('migrated', ?)", (str(time.time()),))
+        self._transaction(statements)
+
+    def import_cache_map(self, file_handle_id, cache_map_file, sizes=lambda path: None):
+        """
+        Imports the ``.cacheMap`` file of a file handle if it has changed since the index was created and since it
+        was last imported, such as when it was written by a client that doesn't use the index.
+
+        :returns: the imported dict of paths to modification times, or an empty dict if nothing was imported
+        """
+        modified = os.path.getmtime(cache_map_file) if os.path.exists(cache_map_file) else None
+        if modified is None:
+            return {}
+        connection = self._connection()
+        migrated = connection.execute("SELECT value FROM metadata WHERE key='migrated'").fetchone()
+        imported = connection.execute('SELECT modified FROM imported_cache_maps WHERE file_handle_id=?',
+                                      (int(file_handle_id),)).fetchone()
+        if modified <= max(float(migrated[0]) if migrated else 0, imported[0] if imported else 0):
+            return {}
+        try:
+            with open(cache_map_file, 'r') as f:
+                cache_map = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        def statements(cursor):
+            self._changing_sizes(cursor, [file_handle_id], lambda: cursor.executemany(
+                'INSERT OR IGNORE INTO cache_entries VALUES (?, ?, ?, ?, ?)',
+                [(int(file_handle_id), path, modified_time, modified, sizes(path))
+                 for path, modified_time in cache_map.items()]), used_at=modified if cache_map else None)
+            cursor.execute('INSERT OR REPLACE INTO imported_cache_maps VALUES (?, ?)', (int(file_handle_id), modified))
+        self._transaction(statements)
+        return cache_map
+
+    def cache_map_written(self, file_handle_id, modified):
+        """Records that the ``.cacheMap`` of a file handle was written from the index, so it isn't imported back."""
+        self._transaction(lambda cursor: cursor.execute('INSERT OR REPLACE INTO imported_cache_maps VALUES (?, ?)',
+                                                        (int(file_handle_id), modified)))
+
+    def close(self):
+        self.flush_lookups()
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
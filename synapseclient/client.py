@@ -44,6 +44,7 @@ except ImportError:
 import collections
 import os, sys, re, time
 import hashlib
+import io
 import six
 
 try:
@@ -89,6 +90,13 @@ from .team import UserProfile, Team, TeamMember, UserGroupHeader
 from .wiki import Wiki, WikiAttachment
 from .retry import _with_retry
 from .multipart_upload import multipart_upload, multipart_upload_string
+from . import multipart_download
+from . import pool_provider
+from .presigned_url_cache import PresignedUrlCache
+from .rate_limit import TransferRateLimiter
+from .throughput import ThroughputMonitor
+from .md5_cache import Md5Cache, MD5_CACHE_FILENAME
+from . import remote_file
 from .remote_file_storage_wrappers import S3ClientWrapper, SFTPWrapper
 from .upload_functions import upload_file_handle, upload_synapse_s3
 from .dozer import doze
@@ -115,6 +123,7 @@ PUBLIC = 273949  #PrincipalId of public "user"
 AUTHENTICATED_USERS = 273948
 DEBUG_DEFAULT = False
 REDIRECT_LIMIT = 5
+MAX_FILE_HANDLE_BATCH_SIZE = 100
 
 
 # Defines the standard retry policy applied to the rest methods
@@ -175,6 +184,8 @@ class Synapse(object):
     :param skip_checks:           Skip version and endpoint checks
     :param configPath:            Path to config File with setting for Synapse
                                   defaults to ~/.synapseConfig
+    :param max_threads:           Number of threads shared by the uploads and downloads of the process,
+                                  overrides the max_threads setting in the [transfer] section of the config file
 
     Typically, no parameters are needed::
 
@@ -189,10 +200,15 @@ class Synapse(object):
 
     # TODO: add additional boolean for write to disk?
     def __init__(self, repoEndpoint=None, authEndpoint=None, fileHandleEndpoint=None, portalEndpoint=None,
-                 debug=None, skip_checks=False, configPath=CONFIG_FILE):
+                 debug=None, skip_checks=False, configPath=CONFIG_FILE, max_threads=None):
         self._requests_session = requests.Session()
 
         cache_root_dir = cache.CACHE_ROOT_DIR
+        link_mode = 'copy'
+        write_cache_maps = False
+        cache_options = {}
+        transfer_limits = {}
+        adaptive_part_size = False
 
         config_debug = None
         # Check for a config file
@@ -201,13 +217,35 @@ class Synapse(object):
             config = self.getConfigFile(configPath)
             if config.has_option('cache', 'location'):
                 cache_root_dir=config.get('cache', 'location')
+            if config.has_option('cache', 'link_mode'):
+                link_mode = config.get('cache', 'link_mode')
+            if config.has_option('cache', 'write_cache_map'):
+                write_cache_maps = config.getboolean('cache', 'write_cache_map')
+            if config.has_option('cache', 'max_size'):
+                cache_options['max_size'] = cache.parse_size(config.get('cache', 'max_size'))
+            if config.has_option('cache', 'eviction_policy'):
+                cache_options['eviction_policy'] = config.get('cache', 'eviction_policy')
+            if config.has_option('cache', 'read_only_locations'):
+                cache_options['read_only_cache_root_dirs'] = [location.strip() for location in
+                                                             config.get('cache', 'read_only_locations').split(',')
+                                                             if location.strip()]
+            for option in ('max_upload_rate', 'max_download_rate', 'max_request_rate'):
+                if config.has_option('transfer', option):
+                    transfer_limits[option] = config.getfloat('transfer', option)
+            if max_threads is None and config.has_option('transfer', 'max_threads'):
+                max_threads = config.getint('transfer', 'max_threads')
+            if config.has_option('transfer', 'adaptive_part_size'):
+                adaptive_part_size = config.getboolean('transfer', 'adaptive_part_size')
             if config.has_section('debug'):
                 debug = True
 
         if debug is None:
             debug = config_debug if config_debug is not None else DEBUG_DEFAULT
 
-        self.cache = cache.Cache(cache_root_dir)
+        self.cache = cache.Cache(cache_root_dir, write_cache_maps=write_cache_maps, **cache_options)
+
+        # MD5s of local files, kept until the files change
+        self._md5_cache = Md5Cache(os.path.join(self.cache.cache_root_dir, MD5_CACHE_FILENAME))
 
         self.setEndpoints(repoEndpoint, authEndpoint, fileHandleEndpoint, portalEndpoint, skip_checks)
 
@@ -221,6 +259,34 @@ class Synapse(object):
         self.table_query_max_sleep = 20
         self.table_query_timeout = 600 # in seconds
 
+        # download large files stored in S3 over several concurrent ranged connections
+        self.multi_threaded = True
+
+        # reuses pre-signed URLs until shortly before they expire
+        self._presigned_url_cache = PresignedUrlCache()
+
+        # bandwidth and request rate limits shared by all transfers
+        self._rate_limiter = TransferRateLimiter(**transfer_limits)
+
+        # size of the thread pool shared by transfers, see pool_provider
+        if max_threads is None:
+            max_threads = pool_provider.DEFAULT_MAX_THREADS
+        if max_threads < 1:
+            raise ValueError("max_threads must be at least 1")
+        self.max_threads = max_threads
+
+        # keep-alive connections for the parts of multipart uploads, see multipart_upload
+        self._part_upload_session = None
+
+        # fits the part size and threads of multipart uploads to the measured round trip time and throughput
+        self.adaptive_part_size = adaptive_part_size
+        self._throughput_monitor = ThroughputMonitor()
+
+        # how files already in the cache are placed in other download locations, one of utils.LINK_MODES
+        if link_mode not in utils.LINK_MODES:
+            raise ValueError("link_mode in %s must be one of %s" % (configPath, ", ".join(utils.LINK_MODES)))
+        self.link_mode = link_mode
+
         # TODO: remove once most clients are no longer on versions <= 1.7.5
         cached_sessions.migrate_old_session_file_credentials_if_necessary(self)
 
@@ -643,6 +709,43 @@ class Synapse(object):
 
 
 
+    def open(self, entity, version=None, blockSize=remote_file.DEFAULT_BLOCK_SIZE,
+             maxCachedBlocks=remote_file.DEFAULT_MAX_CACHED_BLOCKS, cacheDir=None):
+        """
+        Opens the file of a File entity for reading without downloading it.
+
+        :param entity:          A Synapse ID or a File entity
+        :param version:         The specific version to open. Defaults to the most recent version.
+        :param blockSize:       Number of bytes fetched from the server at a time
+        :param maxCachedBlocks: Number of fetched blocks kept in memory
+        :param cacheDir:        (optional) A directory in which fetched blocks are also stored
+                                so that they can be reused when the file is opened again
+
+        :returns: A read-only, seekable binary file-like object. Only the parts of the file
+                  that are read are transferred and nothing is added to the Synapse cache.
+
+        Example::
+
+            with syn.open('syn1906479') as f:
+                f.seek(-1024, io.SEEK_END)
+                trailer = f.read()
+
+        """
+        bundle = self._getEntityBundle(entity, version)
+        self._check_entity_restrictions(bundle['restrictionInformation'], entity, True)
+        if bundle['entity']['concreteType'] != File._synapse_entity_type:
+            raise ValueError("%s is a %s, only Files can be opened" % (id_of(entity), bundle['entity']['concreteType']))
+        fileHandle = find_data_file_handle(bundle)
+        if fileHandle is None:
+            raise SynapseError("You have READ permission on %s but not DOWNLOAD permission" % id_of(entity))
+        if fileHandle['concreteType'] == concrete_types.EXTERNAL_OBJECT_STORE_FILE_HANDLE:
+            raise remote_file.RemoteReadNotSupportedError("Files in external object stores can not be opened remotely,"
+                                                          " use get() instead")
+        raw = remote_file.RemoteFile(self, fileHandle['id'], bundle['entity']['id'], 'FileEntity',
+                                     fileHandle['contentSize'], name=fileHandle['fileName'], blockSize=blockSize,
+                                     maxCachedBlocks=maxCachedBlocks, cacheDir=cacheDir)
+        return io.BufferedReader(raw)
+
     def _getFromFile(self, filepath, limitSearch=None):
         """
         Gets a Synapse entityBundle based on the md5 of a local file
@@ -651,7 +754,7 @@ class Synapse(object):
         :param filepath: path to local file
         :param limitSearch:   Limits the places in Synapse where the file is searched for.
         """
-        results = self.restGET('/entity/md5/%s' %utils.md5_for_file(filepath).hexdigest())['results']
+        results = self.restGET('/entity/md5/%s' % self._md5_cache.md5_for_file(filepath))['results']
         if limitSearch is not None:
             #Go through and find the path of every entity found
             paths = [self.restGET('/entity/%s/path' %ent['id']) for ent in results]
@@ -736,48 +839,53 @@ class Synapse(object):
         return entity
 
 
-    def _download_file_entity(self, downloadLocation, entity, ifcollision, submission):
+    def _download_file_entity(self, downloadLocation, entity, ifcollision, submission, fileResult=None):
         # set the initial local state
         entity.path = None
         entity.files = []
         entity.cacheDir = None
 
-        # check to see if an UNMODIFIED version of the file (since it was last downloaded) already exists
-        # this location could be either in .synapseCache
-        # or a user specified location to which the user previously downloaded the file
-        cached_file_path = self.cache.get(entity.dataFileHandleId, downloadLocation)
-
-        #location in .synapseCache where the file would be corresponding to its FileHandleId
-        synapseCache_location = self.cache.get_cache_dir(entity.dataFileHandleId)
-
-        file_name = entity._file_handle.fileName if cached_file_path is None else os.path.basename(cached_file_path)
-
-        #Decide the best download location for the file
-        if downloadLocation is not None:
-            # Make sure the specified download location is a fully resolved directory
-            downloadLocation = os.path.expandvars(os.path.expanduser(downloadLocation))
-            if os.path.isfile(downloadLocation):
-                raise ValueError("Parameter 'downloadLocation' should be a directory, not a file.")
-        elif cached_file_path is not None:
-            #file already cached so use that as the download location
-            downloadLocation = os.path.dirname(cached_file_path)
-        else:
-            #file not cached and no user-specified location so default to .synapseCache
-            downloadLocation = synapseCache_location
+        # keep the cached copy from being evicted between finding it and copying it to the download location
+        with self.cache.pin(entity.dataFileHandleId):
+            # check to see if an UNMODIFIED version of the file (since it was last downloaded) already exists
+            # this location could be either in .synapseCache
+            # or a user specified location to which the user previously downloaded the file
+            cached_file_path = self.cache.get(entity.dataFileHandleId, downloadLocation)
+
+            #location in .synapseCache where the file would be corresponding to its FileHandleId
+            synapseCache_location = self.cache.get_cache_dir(entity.dataFileHandleId)
+
+            file_name = entity._file_handle.fileName if cached_file_path is None else os.path.basename(cached_file_path)
+
+            #Decide the best download location for the file
+            if downloadLocation is not None:
+                # Make sure the specified download location is a fully resolved directory
+                downloadLocation = os.path.expandvars(os.path.expanduser(downloadLocation))
+                if os.path.isfile(downloadLocation):
+                    raise ValueError("Parameter 'downloadLocation' should be a directory, not a file.")
+            elif cached_file_path is not None:
+                #file already cached so use that as the download location
+                downloadLocation = os.path.dirname(cached_file_path)
+            else:
+                #file not cached and no user-specified location so default to .synapseCache
+                downloadLocation = synapseCache_location
 
-        #resolve file path collisions by either overwriting, renaming, or not downloading, depending on the ifcollision value
-        downloadPath = self._resolve_download_path_collisions(downloadLocation, file_name, ifcollision, synapseCache_location, cached_file_path)
-        if downloadPath is None:
-            return
+            #resolve file path collisions by either overwriting, renaming, or not downloading, depending on the ifcollision value
+            downloadPath = self._resolve_download_path_collisions(downloadLocation, file_name, ifcollision, synapseCache_location, cached_file_path)
+            if downloadPath is None:
+                return
 
-        if cached_file_path is not None: #copy from cache
-            if downloadPath != cached_file_path:
+            if cached_file_path is not None and downloadPath != cached_file_path: #copy from cache
                 # create the foider if it does not exist already
                 if not os.path.exists(downloadLocation):
                     os.makedirs(downloadLocation)
-                shutil.copy(cached_file_path, downloadPath)
+                link_mode = utils.link_or_copy_file(cached_file_path, downloadPath, self.link_mode)
+                if link_mode != self.link_mode:
+                    self.logger.debug("Could not %s %s, copied it instead" % (self.link_mode, cached_file_path))
+                # record the new location so that it is found and validated by its own timestamp
+                self.cache.add(entity.dataFileHandleId, downloadPath)
 
-        else: #download the file from URL (could be a local file)
+        if cached_file_path is None: #download the file from URL (could be a local file)
             objectType = 'FileEntity' if submission is None else 'SubmissionAttachment'
             objectId = entity['id'] if submission is None else submission
 
@@ -786,7 +894,7 @@ class Synapse(object):
             # it won't be "downloaded" and, instead, downloadPath will just point to '~/someLocalFile.txt'
             # _downloadFileHandle may also return None to indicate that the download failed
             downloadPath = self._downloadFileHandle(entity.dataFileHandleId, objectId, objectType,
-                                                      downloadPath)
+                                                      downloadPath, fileResult=fileResult)
 
             if downloadPath is None or not os.path.exists(downloadPath):
                 return
@@ -844,6 +952,9 @@ class Synapse(object):
                                     or review board approval for this entity.
                                     You will be contacted with regards to the specific data being restricted
                                     and the requirements of access.
+        :param dedupe:              If True, a file with the same MD5 and size as one already in Synapse, that the
+                                    user can download and that is in the same storage location, is not uploaded
+                                    again. Its file handle is copied instead. Defaults to False.
 
         :returns: A Synapse Entity, Evaluation, or Wiki
 
@@ -874,6 +985,7 @@ class Synapse(object):
         forceVersion = kwargs.get('forceVersion', True)
         versionLabel = kwargs.get('versionLabel', None)
         isRestricted = kwargs.get('isRestricted', False)
+        dedupe = kwargs.get('dedupe', False)
 
         ## _before_store hook
         ## give objects a chance to do something before being stored
@@ -920,33 +1032,9 @@ class Synapse(object):
             # Check if the File already exists in Synapse by fetching metadata on it
             bundle = self._getEntityBundle(entity)
 
-            if bundle:
-                # Check if the file should be uploaded
-                fileHandle = find_data_file_handle(bundle)
-                if fileHandle and fileHandle['concreteType'] == "org.sagebionetworks.repo.model.file.ExternalFileHandle":
-                    #switching away from ExternalFileHandle or the url was updated
-                    needs_upload = entity['synapseStore'] or (fileHandle['externalURL'] != entity['externalURL'])
-                else:
-                    ## Check if we need to upload a new version of an existing
-                    ## file. If the file referred to by entity['path'] has been
-                    ## modified, we want to upload the new version.
-                    ## If synapeStore is false then we must upload a ExternalFileHandle
-                    needs_upload = not entity['synapseStore'] or not self.cache.contains(bundle['entity']['dataFileHandleId'], entity['path'])
-            elif entity.get('dataFileHandleId',None) is not None:
-                needs_upload = False
-            else:
-                needs_upload = True
-
-            if needs_upload:
-                local_state_fh = local_state.get('_file_handle', {})
-                synapseStore = local_state.get('synapseStore', True)
-                fileHandle = upload_file_handle(self,
-                                                 entity['parentId'],
-                                                 local_state['path'] if (synapseStore or local_state_fh.get('externalURL') is None) else local_state_fh.get('externalURL'),
-                                                 synapseStore=synapseStore,
-                                                 md5=local_state_fh.get('contentMd5'),
-                                                 file_size=local_state_fh.get('contentSize'),
-                                                 mimetype=local_state_fh.get('contentType'))
+            if self._needs_upload(entity, bundle):
+                path, upload_kwargs = self._upload_file_handle_args(local_state)
+                fileHandle = upload_file_handle(self, entity['parentId'], path, dedupe=dedupe, **upload_kwargs)
                 properties['dataFileHandleId'] = fileHandle['id']
                 local_state['_file_handle'] = fileHandle
 
@@ -957,17 +1045,7 @@ class Synapse(object):
 
             #update the file_handle metadata if the FileEntity's FileHandle id has changed
             if '_file_handle' in local_state and properties['dataFileHandleId'] != local_state['_file_handle'].get('id', None):
-                local_state['_file_handle'] = self._getFileHandle(properties['dataFileHandleId'])
-                #check if we alredy have the filehandleid cached somewhere
-                cached_path = self.cache.get(properties['dataFileHandleId'])
-                if cached_path is None:
-                    local_state['path'] = None
-                    local_state['cacheDir'] = None
-                    local_state['files'] = []
-                else:
-                    local_state['path'] = cached_path
-                    local_state['cacheDir'] = os.path.dirname(cached_path)
-                    local_state['files'] = [os.path.basename(cached_path)]
+                self._set_local_file_handle(local_state, properties['dataFileHandleId'], self._getFileHandle(properties['dataFileHandleId']))
 
         # Create or update Entity in Synapse
         if 'id' in properties:
@@ -976,10 +1054,7 @@ class Synapse(object):
             #If Link, get the target name, version number and concrete type and store in link properties
             if properties['concreteType']=="org.sagebionetworks.repo.model.Link":
                 target_properties = self._getEntity(properties['linksTo']['targetId'], version=properties['linksTo'].get('targetVersionNumber'))
-                properties['linksToClassName'] = target_properties['concreteType']
-                if target_properties.get('versionNumber') is not None and properties['linksTo'].get('targetVersionNumber') is not None:
-                    properties['linksTo']['targetVersionNumber'] = target_properties['versionNumber']
-                properties['name'] = target_properties['name']
+                self._set_link_target(properties, target_properties)
             try:
                 properties = self._createEntity(properties)
             except SynapseHTTPError as ex:
@@ -992,17 +1067,9 @@ class Synapse(object):
                     if not bundle:
                         bundle = self._getEntityBundle(existing_entity_id, bitFlags=0x1|0x2)
 
-                    # Need some fields from the existing entity: id, etag, and version info.
-                    existing_entity = bundle['entity']
-
-                    # Update the conflicting Entity
-                    existing_entity.update(properties)
+                    # Update the conflicting Entity and merge new annotations with existing annotations
+                    existing_entity, annotations = self._merge_existing_entity(bundle, properties, annotations)
                     properties = self._updateEntity(existing_entity, forceVersion, versionLabel)
-
-                    # Merge new annotations with existing annotations
-                    existing_annos = from_synapse_annotations(bundle['annotations'])
-                    existing_annos.update(annotations)
-                    annotations = existing_annos
                 else:
                     raise
 
@@ -1015,7 +1082,95 @@ class Synapse(object):
         annotations = self.setAnnotations(properties, annotations)
         properties['etag'] = annotations.etag
 
-        # If the parameters 'used' or 'executed' are given, create an Activity object
+        # If we have an Activity, set it as the Entity's provenance record
+        activity = self._activity_to_store(kwargs)
+        if activity:
+            activity = self.setProvenance(properties, activity)
+
+            # 'etag' has changed, so get the new Entity
+            properties = self._getEntity(properties)
+
+        # Return the updated Entity object
+        return Entity.create(properties, annotations, local_state)
+
+
+    ## The steps of storing an Entity that don't make requests, shared with synapseclient.aio
+
+    def _needs_upload(self, entity, bundle):
+        """
+        Decides whether the file of a File entity that is being stored has to be uploaded.
+
+        :param entity: the File being stored, with a path
+        :param bundle: the EntityBundle of the entity already in Synapse, if there is one
+        """
+        if bundle:
+            # Check if the file should be uploaded
+            fileHandle = find_data_file_handle(bundle)
+            if fileHandle and fileHandle['concreteType'] == "org.sagebionetworks.repo.model.file.ExternalFileHandle":
+                #switching away from ExternalFileHandle or the url was updated
+                return entity['synapseStore'] or (fileHandle['externalURL'] != entity['externalURL'])
+            ## Check if we need to upload a new version of an existing
+            ## file. If the file referred to by entity['path'] has been
+            ## modified, we want to upload the new version.
+            ## If synapeStore is false then we must upload a ExternalFileHandle
+            return not entity['synapseStore'] or not self.cache.contains(bundle['entity']['dataFileHandleId'], entity['path'])
+        return entity.get('dataFileHandleId',None) is None
+
+    @staticmethod
+    def _upload_file_handle_args(local_state):
+        """
+        :returns: the path or URL of a File to upload and the keyword arguments of
+                  :py:func:`synapseclient.upload_functions.upload_file_handle` to upload it with
+        """
+        local_state_fh = local_state.get('_file_handle', {})
+        synapseStore = local_state.get('synapseStore', True)
+        path = local_state['path'] if (synapseStore or local_state_fh.get('externalURL') is None) else local_state_fh.get('externalURL')
+        return path, dict(synapseStore=synapseStore,
+                          md5=local_state_fh.get('contentMd5'),
+                          file_size=local_state_fh.get('contentSize'),
+                          mimetype=local_state_fh.get('contentType'))
+
+    def _set_local_file_handle(self, local_state, dataFileHandleId, fileHandle):
+        """Points the local state of a File at a new file handle and at the copy of it in the cache, if any."""
+        local_state['_file_handle'] = fileHandle
+        #check if we alredy have the filehandleid cached somewhere
+        cached_path = self.cache.get(dataFileHandleId)
+        if cached_path is None:
+            local_state['path'] = None
+            local_state['cacheDir'] = None
+            local_state['files'] = []
+        else:
+            local_state['path'] = cached_path
+            local_state['cacheDir'] = os.path.dirname(cached_path)
+            local_state['files'] = [os.path.basename(cached_path)]
+
+    @staticmethod
+    def _set_link_target(properties, target_properties):
+        """Stores the name, version number and concrete type of the target of a Link in its properties."""
+        properties['linksToClassName'] = target_properties['concreteType']
+        if target_properties.get('versionNumber') is not None and properties['linksTo'].get('targetVersionNumber') is not None:
+            properties['linksTo']['targetVersionNumber'] = target_properties['versionNumber']
+        properties['name'] = target_properties['name']
+
+    @staticmethod
+    def _merge_existing_entity(bundle, properties, annotations):
+        """
+        Merges the properties and annotations of an Entity that conflicts with an existing one into those of
+        the existing Entity, which has some of the fields needed to update it: id, etag, and version info.
+
+        :returns: the properties to update the existing Entity with and the merged annotations
+        """
+        existing_entity = bundle['entity']
+        existing_entity.update(properties)
+        existing_annos = from_synapse_annotations(bundle['annotations'])
+        existing_annos.update(annotations)
+        return existing_entity, existing_annos
+
+    @staticmethod
+    def _activity_to_store(kwargs):
+        """
+        :returns: the Activity given to :py:meth:`store` or one made of the 'used' and 'executed' parameters, if any
+        """
         activity = kwargs.get('activity', None)
         used = kwargs.get('used', None)
         executed = kwargs.get('executed', None)
@@ -1026,16 +1181,7 @@ class Synapse(object):
             activityName = kwargs.get('activityName', None)
             activityDescription = kwargs.get('activityDescription', None)
             activity = Activity(name=activityName, description=activityDescription, used=used, executed=executed)
-
-        # If we have an Activity, set it as the Entity's provenance record
-        if activity:
-            activity = self.setProvenance(properties, activity)
-
-            # 'etag' has changed, so get the new Entity
-            properties = self._getEntity(properties)
-
-        # Return the updated Entity object
-        return Entity.create(properties, annotations, local_state)
+        return activity
 
 
     def _createAccessRequirementIfNone(self, entity):
@@ -1092,15 +1238,18 @@ class Synapse(object):
         except ValueError:
             return None
 
-        if version is not None:
-            uri = '/entity/%s/version/%d/bundle?mask=%d' %(id_of(entity), version, bitFlags)
-        else:
-            uri = '/entity/%s/bundle?mask=%d' %(id_of(entity), bitFlags)
-        bundle = self.restGET(uri)
+        bundle = self.restGET(self._entity_bundle_uri(entity, version, bitFlags))
 
         return bundle
 
 
+    @staticmethod
+    def _entity_bundle_uri(entity, version, bitFlags):
+        if version is not None:
+            return '/entity/%s/version/%d/bundle?mask=%d' %(id_of(entity), version, bitFlags)
+        return '/entity/%s/bundle?mask=%d' %(id_of(entity), bitFlags)
+
+
     def delete(self, obj, version=None):
         """
         Removes an object from Synapse.
@@ -1362,19 +1511,26 @@ class Synapse(object):
 
         :returns: the updated annotations for the entity
         """
-        uri = '/entity/%s/annotations' % id_of(entity)
+        uri, synapseAnnos = self._annotations_request(entity, annotations, kwargs)
+        if 'etag' not in synapseAnnos:
+            old_annos = self.restGET(uri)
+            synapseAnnos['etag'] = old_annos['etag']
+
+        return from_synapse_annotations(self.restPUT(uri, body=json.dumps(synapseAnnos)))
 
+
+    @staticmethod
+    def _annotations_request(entity, annotations, kwargs):
+        """
+        :returns: the URI of the annotations of an Entity and the Synapse annotations to store there,
+                  without an etag if neither the annotations nor the entity have one
+        """
         annotations.update(kwargs)
         synapseAnnos = to_synapse_annotations(annotations)
         synapseAnnos['id'] = id_of(entity)
-        if 'etag' not in synapseAnnos:
-            if 'etag' in entity:
-                synapseAnnos['etag'] = entity['etag']
-            else:
-                old_annos = self.restGET(uri)
-                synapseAnnos['etag'] = old_annos['etag']
-
-        return from_synapse_annotations(self.restPUT(uri, body=json.dumps(synapseAnnos)))
+        if 'etag' not in synapseAnnos and 'etag' in entity:
+            synapseAnnos['etag'] = entity['etag']
+        return '/entity/%s/annotations' % id_of(entity), synapseAnnos
 
 
 
@@ -1401,12 +1557,7 @@ class Synapse(object):
 
         - :py:func:`synapseutils.walk`
         """
-        parentId = id_of(parent) if parent is not None else None
-        entityChildrenRequest = {'parentId':parentId,
-                                 'includeTypes':includeTypes,
-                                 'sortBy':sortBy,
-                                 'sortDirection':sortDirection,
-                                 'nextPageToken': None}
+        entityChildrenRequest = self._entity_children_request(parent, includeTypes, sortBy, sortDirection)
         entityChildrenResponse = {"nextPageToken":"first"}
         while entityChildrenResponse.get('nextPageToken') is not None:
             entityChildrenResponse = self.restPOST('/entity/children',body =json.dumps(entityChildrenRequest))
@@ -1415,6 +1566,17 @@ class Synapse(object):
             if entityChildrenResponse.get('nextPageToken') is not None:
                 entityChildrenRequest['nextPageToken'] = entityChildrenResponse['nextPageToken']
 
+
+    @staticmethod
+    def _entity_children_request(parent, includeTypes, sortBy, sortDirection):
+        """:returns: the first EntityChildrenRequest of :py:meth:`getChildren`"""
+        parentId = id_of(parent) if parent is not None else None
+        return {'parentId':parentId,
+                'includeTypes':includeTypes,
+                'sortBy':sortBy,
+                'sortDirection':sortDirection,
+                'nextPageToken': None}
+
     def query(self, queryStr):
         """
         Query for Synapse entities.
@@ -1801,32 +1963,77 @@ class Synapse(object):
     ##               File handle service calls                ##
     ############################################################
 
-    def _getFileHandleDownload(self, fileHandleId,  objectId, objectType='FileEntity'):
+    def getFileHandleDownloads(self, associations, includePreSignedURLs=True):
+        """
+        Gets the URLs and metadata for many file handles using as few requests as possible.
+
+        :param associations:         a list of FileHandleAssociation_ dicts, each with the keys
+                                     fileHandleId, associateObjectId and associateObjectType
+        :param includePreSignedURLs: whether to request pre-signed URLs along with the file handles
+
+        :returns: a list of FileResult_ dicts, in the same order as the given associations, with keys
+                  fileHandleId, fileHandle and preSignedURL. Files that could not be retrieved have a
+                  failureCode of NOT_FOUND or UNAUTHORIZED instead.
+
+        Pre-signed URLs retrieved earlier in the session are reused until shortly before they expire.
+
+        Example::
+
+            results = syn.getFileHandleDownloads([{'fileHandleId': '123', 'associateObjectId': 'syn456',
+                                                   'associateObjectType': 'FileEntity'}])
+            print(results[0]['preSignedURL'])
+
+        .. FileHandleAssociation: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/FileHandleAssociation.html
+        .. FileResult: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/FileResult.html
+        """
+        keys = [(association['fileHandleId'], association['associateObjectId'], association['associateObjectType'])
+                for association in associations]
+        results = [self._presigned_url_cache.get(*key) if includePreSignedURLs else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        for i in range(0, len(missing), MAX_FILE_HANDLE_BATCH_SIZE):
+            batch = missing[i:i+MAX_FILE_HANDLE_BATCH_SIZE]
+            body = {'includeFileHandles': True, 'includePreSignedURLs': includePreSignedURLs,
+                    'requestedFiles': [{'fileHandleId': keys[j][0],
+                                        'associateObjectId': keys[j][1],
+                                        'associateObjectType': keys[j][2]}
+                                       for j in batch]}
+            response = self.restPOST('/fileHandle/batch', body=json.dumps(body),
+                                     endpoint=self.fileHandleEndpoint)
+            for j, result in zip(batch, response['requestedFiles']):
+                results[j] = result
+                if includePreSignedURLs and not result.get('failureCode'):
+                    self._presigned_url_cache.put(keys[j][0], keys[j][1], keys[j][2], result)
+        return results
+
+    def _getFileHandleDownload(self, fileHandleId,  objectId, objectType='FileEntity', refresh=False):
         """
         Gets the URL and the metadata as filehandle object for a filehandle or fileHandleId
 
         :param fileHandleId:   ID of fileHandle to download
         :param objectId:       The ID of the object associated with the file e.g. syn234
         :param objectType:     Type of object associated with a file e.g. FileEntity, TableEntity
+        :param refresh:        whether to request a new pre-signed URL rather than reuse a cached one,
+                               e.g. because the cached one was rejected
 
         :returns: dictionary with keys: fileHandle, fileHandleId and preSignedURL
         """
-        body = {'includeFileHandles':True, 'includePreSignedURLs': True,
-                'requestedFiles':[{'fileHandleId':fileHandleId,
-                                   'associateObjectId': objectId,
-                                   'associateObjectType':objectType}]}
-        response = self.restPOST('/fileHandle/batch', body=json.dumps(body),
-                                endpoint=self.fileHandleEndpoint)
-        result = response['requestedFiles'][0]
+        if refresh:
+            self._presigned_url_cache.remove(fileHandleId, objectId, objectType)
+        result = self.getFileHandleDownloads([{'fileHandleId': fileHandleId,
+                                               'associateObjectId': objectId,
+                                               'associateObjectType': objectType}])[0]
+        self._check_file_result(result, fileHandleId, objectId, objectType)
+        return result
+
+    def _check_file_result(self, result, fileHandleId, objectId, objectType):
+        """Raises an error if a FileResult from /fileHandle/batch records a failure."""
         failure = result.get('failureCode')
         if failure == 'NOT_FOUND':
             raise exceptions.SynapseFileNotFoundError("The fileHandleId %s could not be found" % fileHandleId)
         elif failure == "UNAUTHORIZED":
             raise exceptions.SynapseError("You are not authorized to access fileHandleId %s associated with the Synapse %s: %s" % (fileHandleId, objectType, objectId))
 
-        return result
-
-    def _downloadFileHandle(self, fileHandleId, objectId, objectType, destination, retries=5):
+    def _downloadFileHandle(self, fileHandleId, objectId, objectType, destination, retries=5, fileResult=None):
         """
         Download a file from the given URL to the local file system.
 
@@ -1836,6 +2043,8 @@ class Synapse(object):
         :param destination: destination on local file system
         :param retries:     (default=5) Number of download retries attempted before
                             throwing an exception.
+        :param fileResult:  (optional) a result of :py:func:`getFileHandleDownloads` for this file handle,
+                            used for the first attempt instead of requesting a new pre-signed URL
 
         :returns: path to downloaded file
         """
@@ -1844,31 +2053,54 @@ class Synapse(object):
         except OSError as exception:
             if exception.errno != os.errno.EEXIST:
                 raise
+        refresh = False
         while retries > 0:
             try:
-                fileResult = self._getFileHandleDownload(fileHandleId,
-                                                        objectId, objectType)
+                if fileResult is None:
+                    fileResult = self._getFileHandleDownload(fileHandleId,
+                                                            objectId, objectType, refresh=refresh)
+                else:
+                    self._check_file_result(fileResult, fileHandleId, objectId, objectType)
                 fileHandle = fileResult['fileHandle']
                 if fileHandle['concreteType'] == concrete_types.EXTERNAL_OBJECT_STORE_FILE_HANDLE:
                     profile = self._get_client_authenticated_s3_profile(fileHandle['endpointUrl'], fileHandle['bucket'])
-                    downloaded_path = S3ClientWrapper.download_file(fileHandle['bucket'], fileHandle['endpointUrl'], fileHandle['fileKey'], destination, profile_name=profile)
+                    downloaded_path = S3ClientWrapper.download_file(fileHandle['bucket'], fileHandle['endpointUrl'], fileHandle['fileKey'], destination, profile_name=profile,
+                                                                    rate_limiter=self._rate_limiter, max_threads=self.max_threads)
+                elif self._should_download_in_parts(fileHandle):
+                    try:
+                        downloaded_path = multipart_download.download_file_in_parts(
+                            self, fileResult['preSignedURL'],
+                            os.path.join(destination, fileHandle['fileName']) if os.path.isdir(destination) else destination,
+                            fileHandle['contentSize'], fileHandle['id'], expected_md5=fileHandle.get('contentMd5'))
+                    except multipart_download.RangeNotSupportedError:
+                        self.logger.debug("Ranged requests are not supported, falling back to a single connection", exc_info=True)
+                        downloaded_path = self._download_from_URL(fileResult['preSignedURL'], destination, fileHandle['id'], expected_md5=fileHandle.get('contentMd5'))
                 else:
                     downloaded_path = self._download_from_URL(fileResult['preSignedURL'], destination, fileHandle['id'], expected_md5=fileHandle.get('contentMd5'))
                 self.cache.add(fileHandle['id'], downloaded_path)
                 return downloaded_path
             except Exception as ex:
                 exc_info = sys.exc_info()
+                fileResult = None
                 ex.progress = 0 if not hasattr(ex, 'progress') else ex.progress
                 self.logger.debug("\nRetrying download on error: [%s] after progressing %i bytes" %
                                   (exc_info[0], ex.progress), exc_info=True)# this will include stack trace
                 if ex.progress==0 :  #No progress was made reduce remaining retries.
                     retries -= 1
+                # a URL that did not work at all may have expired, so don't reuse it
+                refresh = ex.progress == 0
                 if retries <= 0:
                     ## Re-raise exception
                     raise exc_info[0](exc_info[1])
                 
         raise Exception("should not reach this line")
 
+    def _should_download_in_parts(self, fileHandle):
+        """Large files in S3 are downloaded over several connections using range requests."""
+        return self.multi_threaded \
+            and fileHandle['concreteType'] == concrete_types.S3_FILE_HANDLE \
+            and fileHandle.get('contentSize', 0) >= multipart_download.MULTIPART_DOWNLOAD_THRESHOLD
+
     def _download_from_URL(self, url, destination, fileHandleId=None, expected_md5=None):
         """
         Download a file from the given URL to the local file system.
@@ -1900,7 +2132,8 @@ class Synapse(object):
                 break
             elif scheme == 'sftp':
                 username, password = self._getUserCredentials(url)
-                destination = SFTPWrapper.download_file(url, destination, username, password)
+                destination = SFTPWrapper.download_file(url, destination, username, password,
+                                                        rate_limiter=self._rate_limiter)
                 break
             elif scheme == 'ftp':
                 urlretrieve(url, destination)
@@ -1911,6 +2144,7 @@ class Synapse(object):
                 temp_destination = utils.temp_download_filename(destination, fileHandleId)
                 range_header = {"Range": "bytes={start}-".format(start=os.path.getsize(temp_destination))} \
                                 if os.path.exists(temp_destination) else {}
+                self._rate_limiter.limit_request()
                 response = _with_retry(
                     lambda: self._requests_session.get(url, headers=self._generateSignedHeaders(url, range_header),
                                                                                   stream=True, allow_redirects=False),
@@ -1965,6 +2199,7 @@ class Synapse(object):
                             for nChunks, chunk in enumerate(response.iter_content(FILE_BUFFER_SIZE)):
                                 fd.write(chunk)
                                 sig.update(chunk)
+                                self._rate_limiter.limit_download(len(chunk))
 
                                 # the 'content-length' header gives the total number of bytes that will be transfered to us
                                 # len(chunk) cannot be used to track progress because iter_content
@@ -2028,7 +2263,7 @@ class Synapse(object):
         file_handle = {'concreteType': 'org.sagebionetworks.repo.model.file.ExternalObjectStoreFileHandle',
                        'fileKey': s3_file_key,
                        'fileName': os.path.basename(file_path),
-                       'contentMd5': utils.md5_for_file(file_path).hexdigest(),
+                       'contentMd5': self._md5_cache.md5_for_file(file_path),
                        'contentSize': os.stat(file_path).st_size,
                        'storageLocationId': storage_location_id,
                        'contentType': mimetype}
@@ -2909,6 +3144,15 @@ class Synapse(object):
                             Max Rows Per Page (maxRowsPerPage) = 0x8
         """
 
+        query_bundle_request = self._query_bundle_request(query, limit, offset, isConsistent, partMask)
+
+        uri = '/entity/{id}/table/query/async'.format(id=_extract_synapse_id_from_query(query))
+
+        return self._waitForAsync(uri=uri, request=query_bundle_request)
+
+
+    @staticmethod
+    def _query_bundle_request(query, limit=None, offset=None, isConsistent=True, partMask=None):
         # See: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/table/QueryBundleRequest.html
         query_bundle_request = {
             "concreteType": "org.sagebionetworks.repo.model.table.QueryBundleRequest",
@@ -2926,10 +3170,7 @@ class Synapse(object):
         if offset is not None:
             query_bundle_request["query"]["offset"] = offset
         query_bundle_request["query"]["isConsistent"] = isConsistent
-
-        uri = '/entity/{id}/table/query/async'.format(id=_extract_synapse_id_from_query(query))
-
-        return self._waitForAsync(uri=uri, request=query_bundle_request)
+        return query_bundle_request
 
 
     def _queryTableNext(self, nextPageToken, tableId):
@@ -3256,14 +3497,16 @@ class Synapse(object):
                 with zipfile.ZipFile(zipfilepath) as zf:
                     ## the directory structure within the zip follows that of the cache:
                     ## {fileHandleId modulo 1000}/{fileHandleId}/{fileName}
+                    extracted = []
                     for summary in response['fileSummary']:
                         if summary['status'] == 'SUCCESS':
                             cache_dir = self.cache.get_cache_dir(summary['fileHandleId'])
                             filepath = _extract_zip_file_to_directory(zf, summary['zipEntryName'], cache_dir)
-                            self.cache.add(summary['fileHandleId'], filepath)
+                            extracted.append((summary['fileHandleId'], filepath))
                             file_handle_to_path_map[summary['fileHandleId']] = filepath
                         elif summary['failureCode'] not in RETRIABLE_FAILURE_CODES:
                             permanent_failures[summary['fileHandleId']] = summary
+                    self.cache.add_many(extracted)
             finally:
                 if os.path.exists(zipfilepath):
                     os.remove(zipfilepath)
@@ -3288,24 +3531,30 @@ class Synapse(object):
             raise ValueError("Columns not found: " + ", ".join('"' + col + '"' for col in cols_not_found))
         col_indices = [i for i, h in enumerate(table.headers) if h.name in columns]
         ## see: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/BulkFileDownloadRequest.html
-        file_handle_associations = []
-        file_handle_to_path_map = OrderedDict()
-        seen_file_handle_ids = set()  # ensure not sending duplicate requests for the same FileHandle IDs
+        file_handle_ids = []
         for row in table:
             for col_index in col_indices:
                 file_handle_id = row[col_index]
                 if _is_integer(file_handle_id):
-                    path_to_cached_file = self.cache.get(file_handle_id)
-                    if path_to_cached_file:
-                        file_handle_to_path_map[file_handle_id] = path_to_cached_file
-                    elif file_handle_id not in seen_file_handle_ids:
-                        file_handle_associations.append(dict(
-                            associateObjectType="TableEntity",
-                            fileHandleId=file_handle_id,
-                            associateObjectId=table.tableId))
-                    seen_file_handle_ids.add(file_handle_id)
+                    file_handle_ids.append(file_handle_id)
                 else:
                     warnings.warn("Weird file handle: %s" % file_handle_id)
+
+        ## look up all of the cells in the cache at once
+        paths_to_cached_files = self.cache.get_many(set(file_handle_ids))
+        file_handle_associations = []
+        file_handle_to_path_map = OrderedDict()
+        seen_file_handle_ids = set()  # ensure not sending duplicate requests for the same FileHandle IDs
+        for file_handle_id in file_handle_ids:
+            path_to_cached_file = paths_to_cached_files[file_handle_id]
+            if path_to_cached_file:
+                file_handle_to_path_map[file_handle_id] = path_to_cached_file
+            elif file_handle_id not in seen_file_handle_ids:
+                file_handle_associations.append(dict(
+                    associateObjectType="TableEntity",
+                    fileHandleId=file_handle_id,
+                    associateObjectId=table.tableId))
+            seen_file_handle_ids.add(file_handle_id)
         return file_handle_associations, file_handle_to_path_map
 
     @memoize
@@ -3368,6 +3617,17 @@ class Synapse(object):
         :returns: A dictionary containing an Entity's properties
         """
 
+        uri = self._update_entity_uri(entity, incrementVersion, versionLabel)
+        return self.restPUT(uri, body=json.dumps(get_properties(entity)))
+
+
+    @staticmethod
+    def _update_entity_uri(entity, incrementVersion=True, versionLabel=None):
+        """
+        Sets the version number and label that an Entity is updated to.
+
+        :returns: the URI to PUT the Entity to, which makes a new version of it if one was asked for
+        """
         uri = '/entity/%s' % id_of(entity)
 
         if is_versionable(entity):
@@ -3380,8 +3640,7 @@ class Synapse(object):
 
         if versionLabel:
             entity['versionLabel'] = str(versionLabel)
-
-        return self.restPUT(uri, body=json.dumps(get_properties(entity)))
+        return uri
 
 
     def findEntityId(self, name, parent=None):
@@ -3392,17 +3651,21 @@ class Synapse(object):
         :param parent: An Entity object or the Id of an entity as a string. Omit if searching for a Project by name
         :return: the Entity ID or None if not found
         """
-        # when we want to search for a project by name. set parentId as None instead of ROOT_ENTITY
-        entity_lookup_request = {"parentId": id_of(parent) if parent else None,
-                                 "entityName": name}
         try:
-            return self.restPOST("/entity/child", body=json.dumps(entity_lookup_request)).get("id")
+            return self.restPOST("/entity/child", body=json.dumps(self._entity_lookup_request(name, parent))).get("id")
         except SynapseHTTPError as e:
             if e.response.status_code == 404: # a 404 error is raised if the entity does not exist
                 return None
             raise
 
 
+    @staticmethod
+    def _entity_lookup_request(name, parent=None):
+        # when we want to search for a project by name. set parentId as None instead of ROOT_ENTITY
+        return {"parentId": id_of(parent) if parent else None,
+                "entityName": name}
+
+
 
     ############################################################
     ##                      Send Message                      ##
@@ -3466,6 +3729,7 @@ class Synapse(object):
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
+        self._rate_limiter.limit_request()
         response = _with_retry(lambda: self._requests_session.get(uri, headers=headers, **kwargs), verbose=self.debug, **retryPolicy)
         exceptions._raise_for_status(response, verbose=self.debug)
         return self._return_rest_body(response)
@@ -3486,6 +3750,7 @@ class Synapse(object):
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
+        self._rate_limiter.limit_request()
         response = _with_retry(lambda: self._requests_session.post(uri, data=body, headers=headers, **kwargs), verbose=self.debug, **retryPolicy)
         exceptions._raise_for_status(response, verbose=self.debug)
         return self._return_rest_body(response)
@@ -3507,6 +3772,7 @@ class Synapse(object):
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
+        self._rate_limiter.limit_request()
         response = _with_retry(lambda: self._requests_session.put(uri, data=body, headers=headers, **kwargs),
                                verbose = self.debug, **retryPolicy)
         exceptions._raise_for_status(response, verbose=self.debug)
@@ -3526,6 +3792,7 @@ class Synapse(object):
         uri, headers = self._build_uri_and_headers(uri, endpoint, headers)
         retryPolicy = self._build_retry_policy(retryPolicy)
 
+        self._rate_limiter.limit_request()
         response = _with_retry(lambda: self._requests_session.delete(uri, headers=headers, **kwargs),
                                verbose = self.debug, **retryPolicy)
         exceptions._raise_for_status(response, verbose=self.debug)
@@ -10,14 +10,34 @@ import inspect
 import os
 import shutil
 import sys
+import threading
 import time
 from datetime import timedelta
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from synapseclient.exceptions import *
 from synapseclient.dozer import doze
 
 LOCK_DEFAULT_MAX_AGE = timedelta(seconds=10)
 DEFAULT_BLOCKING_TIMEOUT = timedelta(seconds=70)
 CACHE_UNLOCK_WAIT_TIME = 0.5
+## errors of flock on file systems that don't support it, such as some network file systems
+_FLOCK_UNSUPPORTED_ERRNOS = set(getattr(errno, name) for name in ('ENOLCK', 'EOPNOTSUPP', 'ENOTSUP', 'EINVAL', 'ENOSYS')
+                                if hasattr(errno, name))
+## returned instead of a file descriptor when the lock is held elsewhere, or when flock isn't supported
+_HELD_ELSEWHERE = -1
+_UNSUPPORTED = -2
+
+
+def _unflock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
 
 
 class LockedException(Exception):
@@ -26,30 +46,115 @@ class LockedException(Exception):
 
 class Lock(object):
     """
-    Implements a lock by making a directory named [lockname].lock
+    Implements a lock with :py:func:`fcntl.flock` on a file named [lockname].flock, which waits for the lock in
+    the kernel and is released by the kernel if the process holding it dies. Shared locks can be held by any
+    number of readers at once, but not while an exclusive lock is held.
+
+    Where flock is not available, on Windows or file systems that don't support it, the lock is instead a
+    directory named [lockname].lock, which is polled for and broken when it is older than `max_age`. Such a lock
+    is always exclusive, so a shared lock is then acquired without locking anything, and callers that share it
+    within the process must keep track of it themselves.
+
+    :param shared: take a shared lock, for reading, instead of an exclusive one
+    :param use_flock: set to False to always use a lock directory
     """
     SUFFIX = 'lock'
+    FLOCK_SUFFIX = 'flock'
 
-    def __init__(self, name, dir=None, max_age=LOCK_DEFAULT_MAX_AGE, default_blocking_timeout=DEFAULT_BLOCKING_TIMEOUT):
+    def __init__(self, name, dir=None, max_age=LOCK_DEFAULT_MAX_AGE, default_blocking_timeout=DEFAULT_BLOCKING_TIMEOUT,
+                 shared=False, use_flock=True):
         self.name = name
         self.held = False
         self.dir = dir if dir else os.getcwd()
         self.lock_dir_path = os.path.join(self.dir, ".".join([name, Lock.SUFFIX]))
+        self.lock_file_path = os.path.join(self.dir, ".".join([name, Lock.FLOCK_SUFFIX]))
         self.max_age = max_age
         self.default_blocking_timeout = default_blocking_timeout
+        self.shared = shared
+        self.use_flock = use_flock and fcntl is not None
+        self._fd = None
 
     def get_age(self):
         try:
-            return time.time() - os.path.getmtime(self.lock_dir_path)
+            return time.time() - os.path.getmtime(self.lock_file_path if self.use_flock else self.lock_dir_path)
         except OSError as err:
             if err.errno != errno.ENOENT and err.errno != errno.EACCES:
                 raise
             return 0
 
+    def _flock(self, blocking):
+        """
+        Opens the lock file and locks it with flock. Returns the file descriptor, _HELD_ELSEWHERE if the lock is held
+        elsewhere or _UNSUPPORTED if flock isn't supported here.
+        """
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        fd = os.open(self.lock_file_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, mode if blocking else mode | fcntl.LOCK_NB)
+        except (IOError, OSError) as err:
+            os.close(fd)
+            if err.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return _HELD_ELSEWHERE
+            if err.errno in _FLOCK_UNSUPPORTED_ERRNOS:
+                return _UNSUPPORTED
+            raise
+        return fd
+
+    def _hold(self, fd):
+        self._fd = fd
+        self.held = True
+        if not self.shared:
+            os.utime(self.lock_file_path, None)
+
+    def _blocking_flock(self, timeout):
+        """
+        Waits for the lock in the kernel, in a helper thread so that the wait can time out. If it times out the
+        helper releases the lock as soon as it gets it. Returns like :py:meth:`_flock`.
+        """
+        state = {'done': False, 'abandoned': False, 'fd': _HELD_ELSEWHERE, 'error': None}
+        condition = threading.Condition()
+
+        def wait():
+            try:
+                fd = self._flock(blocking=True)
+            except Exception as ex:
+                fd, state['error'] = _HELD_ELSEWHERE, ex
+            with condition:
+                if state['abandoned']:
+                    if fd >= 0:
+                        _unflock(fd)
+                else:
+                    state['fd'] = fd
+                    state['done'] = True
+                    condition.notify_all()
+
+        waiter = threading.Thread(target=wait)
+        waiter.daemon = True
+        waiter.start()
+        deadline = time.time() + timeout.total_seconds()
+        with condition:
+            while not state['done'] and time.time() < deadline:
+                condition.wait(deadline - time.time())
+            state['abandoned'] = not state['done']
+        if state['error'] is not None:
+            raise state['error']
+        return state['fd']
+
     def acquire(self, break_old_locks=True):
         """Try to acquire lock. Return True on success or False otherwise"""
         if self.held:
             return True
+        if self.use_flock:
+            ## a kernel lock can't be left behind by a process that died, so it is never broken
+            fd = self._flock(blocking=False)
+            if fd >= 0:
+                self._hold(fd)
+            if fd != _UNSUPPORTED:
+                return self.held
+            self.use_flock = False
+        if self.shared:
+            self.held = True
+            return True
         try:
             os.makedirs(self.lock_dir_path)
             self.held = True
@@ -75,6 +180,20 @@ class Lock(object):
             return True
         if timeout is None:
             timeout = self.default_blocking_timeout
+        if self.use_flock:
+            ## only wait in a helper thread if the lock is held elsewhere
+            fd = self._flock(blocking=False)
+            if fd == _HELD_ELSEWHERE:
+                fd = self._blocking_flock(timeout)
+            if fd >= 0:
+                self._hold(fd)
+                return True
+            if fd == _HELD_ELSEWHERE:
+                raise SynapseFileCacheError("Could not obtain a lock on the file cache within timeout: %s  Please try again later" % str(timeout))
+            self.use_flock = False
+        if self.shared:
+            self.held = True
+            return True
         lock_acquired = False
         tryLockStartTime = time.time()
         while time.time() - tryLockStartTime < timeout.total_seconds():
@@ -89,6 +208,14 @@ class Lock(object):
     def release(self):
         """Release lock or do nothing if lock is not held"""
         if self.held:
+            if self._fd is not None:
+                fd, self._fd = self._fd, None
+                self.held = False
+                _unflock(fd)
+                return
+            if self.shared:
+                self.held = False
+                return
             try:
                 shutil.rmtree(self.lock_dir_path)
                 self.held = False
@@ -0,0 +1,152 @@
+"""
+*********
+MD5 cache
+*********
+
+Remembers the MD5s of local files in an SQLite database in the cache root
+directory, so that files that are uploaded, associated with Synapse or looked
+up by MD5 again are not read again. An entry is keyed by the absolute path of
+a file and only used while the size, modification time and inode of the file
+are the same as when it was hashed. The MD5s of the parts of a multipart upload
+are kept along with the MD5 of the whole file, for the last part size used.
+
+Without the ``sqlite3`` module, or if the database can't be opened, MD5s are
+computed every time.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from . import utils
+
+MD5_CACHE_FILENAME = '.md5cache.sqlite'
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS md5s (
+                 path TEXT PRIMARY KEY,
+                 size INTEGER NOT NULL,
+                 mtime_ns INTEGER NOT NULL,
+                 inode INTEGER NOT NULL,
+                 md5 TEXT NOT NULL,
+                 part_size INTEGER,
+                 part_md5s TEXT)"""
+
+
+def _file_key(path):
+    """The size, modification time in nanoseconds and inode of a file, which change when it is modified"""
+    stat = os.stat(path)
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1e9)
+    return stat.st_size, mtime_ns, stat.st_ino
+
+
+class Md5Cache(object):
+    """
+    MD5s of local files in an SQLite database, shared by the threads of a Synapse object and other processes
+    using the same cache root directory.
+
+    :param db_path: the database file, created when it is first needed
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._connection = None
+        self._disabled = sqlite3 is None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None and not self._disabled:
+            try:
+                connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+                connection.execute(_SCHEMA)
+                connection.commit()
+                self._connection = connection
+            except sqlite3.Error:
+                self._disabled = True
+        return self._connection
+
+    def _lookup(self, path, key):
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return None
+            try:
+                row = connection.execute('SELECT size, mtime_ns, inode, md5, part_size, part_md5s FROM md5s WHERE path=?',
+                                         (path,)).fetchone()
+            except sqlite3.Error:
+                return None
+        if row is None or tuple(row[:3]) != key:
+            return None
+        return row[3], row[4], json.loads(row[5]) if row[5] is not None else None
+
+    def _store(self, path, key, md5, part_size=None, part_md5s=None):
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return
+            try:
+                connection.execute('INSERT OR REPLACE INTO md5s VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   (path,) + tuple(key) + (md5, part_size,
+                                                           json.dumps(part_md5s) if part_md5s is not None else None))
+                connection.commit()
+            except sqlite3.Error:
+                pass
+
+    def _cached(self, filepath, use_entry, compute):
+        """
+        Returns what `use_entry` makes of the cached entry of a file if it is current and has what is needed,
+        otherwise computes a new entry and stores it if the file did not change while it was read.
+        """
+        path = os.path.abspath(filepath)
+        try:
+            key = _file_key(path)
+        except OSError:
+            return use_entry(compute())
+        entry = self._lookup(path, key)
+        if entry is not None and use_entry(entry) is not None:
+            return use_entry(entry)
+        entry = compute()
+        try:
+            if _file_key(path) == key:
+                self._store(path, key, *entry)
+        except OSError:
+            pass
+        return use_entry(entry)
+
+    def md5_for_file(self, filepath):
+        """Returns the hex MD5 of a file, reading it only if it has changed since its MD5 was last computed."""
+        return self._cached(filepath, lambda entry: entry[0],
+                            lambda: (utils.md5_for_file(filepath).hexdigest(), None, None))
+
+    def md5s_for_file_parts(self, filepath, partSize, compute):
+        """
+        Returns the hex MD5 of a file and a list of the hex MD5s of its parts of `partSize` bytes. If they are not
+        cached for the current version of the file and that part size they are computed with
+        `compute(filepath, partSize)`, such as :py:func:`synapseclient.multipart_upload.md5s_for_file_parts`.
+        """
+        def use_entry(entry):
+            md5, part_size, part_md5s = entry
+            return (md5, part_md5s) if part_size == partSize and part_md5s is not None else None
+
+        def compute_entry():
+            md5, part_md5s = compute(filepath, partSize)
+            return md5, partSize, part_md5s
+
+        return self._cached(filepath, use_entry, compute_entry)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,203 @@
+"""
+**************************
+Synapse Multipart Download
+**************************
+
+Implements a segmented download of a single large file over HTTP(S). The file
+is split into byte ranges which are fetched concurrently using ``Range``
+headers and written into a preallocated temporary file. The part numbers that
+have been completely written are recorded next to the temporary file, so an
+interrupted download resumes by fetching only the missing parts. End users
+should not need to call any of these functions directly.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from builtins import str
+
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from multiprocessing import Value
+
+from . import exceptions
+from . import pool_provider
+from . import utils
+from .exceptions import SynapseError, SynapseMd5MismatchError
+from .retry import _with_retry
+from .utils import MB, printTransferProgress
+
+MULTIPART_DOWNLOAD_THRESHOLD = 64*MB
+MIN_PART_SIZE = 8*MB
+MAX_NUMBER_OF_PARTS = 10000
+FILE_BUFFER_SIZE = 2*MB
+PART_STATUS_SUFFIX = '.parts'
+
+
+class RangeNotSupportedError(SynapseError):
+    """Raised when the server ignores the ``Range`` header of a part request."""
+
+
+def calculate_part_size(fileSize, min_part_size=MIN_PART_SIZE, max_parts=MAX_NUMBER_OF_PARTS):
+    """
+    Parts are at least min_part_size bytes and there are at most max_parts of them.
+    """
+    return max(min_part_size, int(math.ceil(fileSize/float(max_parts))))
+
+
+def get_byte_ranges(fileSize, partSize):
+    """
+    Split a file into parts.
+
+    :returns: a list of (partNumber, start, end) tuples where start and end are
+              inclusive byte offsets, as used in an HTTP ``Range`` header
+    """
+    return [(i+1, start, min(start+partSize, fileSize)-1)
+            for i, start in enumerate(range(0, fileSize, partSize))]
+
+
+def _read_part_status(status_path, fileSize, partSize):
+    """
+    Returns the set of completed part numbers recorded by a previous attempt,
+    or an empty set if there is no usable record.
+    """
+    try:
+        with open(status_path, 'r') as f:
+            status = json.load(f)
+    except (IOError, OSError, ValueError):
+        return set()
+    if status.get('fileSize') != fileSize or status.get('partSize') != partSize:
+        return set()
+    return set(status.get('completedParts', []))
+
+
+def _write_part_status(status_path, fileSize, partSize, completed_parts):
+    with open(status_path, 'w') as f:
+        json.dump({'fileSize': fileSize, 'partSize': partSize, 'completedParts': sorted(completed_parts)}, f)
+
+
+def _preallocate(path, fileSize):
+    with open(path, 'wb') as f:
+        f.truncate(fileSize)
+
+
+def _download_part(syn, url, temp_destination, part):
+    """
+    Fetch one byte range of the file and write it into place.
+
+    :returns: the number of bytes written
+    """
+    partNumber, start, end = part
+    range_header = {'Range': 'bytes={start}-{end}'.format(start=start, end=end)}
+    syn._rate_limiter.limit_request()
+    response = _with_retry(
+        lambda: syn._requests_session.get(url, headers=syn._generateSignedHeaders(url, range_header),
+                                          stream=True, allow_redirects=False),
+        verbose=syn.debug, **syn._build_retry_policy())
+    exceptions._raise_for_status(response, verbose=syn.debug)
+    if response.status_code != 206:
+        response.close()
+        raise RangeNotSupportedError("Server responded with status %d to a ranged request for part %d"
+                                     % (response.status_code, partNumber))
+
+    written = 0
+    with open(temp_destination, 'r+b') as fd:
+        fd.seek(start)
+        for chunk in response.iter_content(FILE_BUFFER_SIZE):
+            fd.write(chunk)
+            syn._rate_limiter.limit_download(len(chunk))
+            written += len(chunk)
+    if written != end - start + 1:
+        raise SynapseError("Part %d ended early after %d of %d bytes" % (partNumber, written, end - start + 1))
+    return written
+
+
+def download_file_in_parts(syn, url, destination, fileSize, fileHandleId=None, expected_md5=None,
+                           partSize=None, max_threads=None):
+    """
+    Download a file over several concurrent connections using HTTP range requests.
+
+    :param syn:           a Synapse object
+    :param url:           source of download, must support ``Range`` requests
+    :param destination:   destination on local file system
+    :param fileSize:      total number of bytes in the file
+    :param fileHandleId:  (optional) if given, the temporary file name includes the file handle id
+                          which allows resuming partial downloads of the same file from previous sessions
+    :param expected_md5:  (optional) if given, check that the MD5 of the downloaded file matched the expected MD5
+    :param partSize:      number of bytes per range request
+    :param max_threads:   (optional) the most concurrent connections, defaults to the size of the shared transfer pool
+
+    :returns: path to downloaded file
+
+    Raises :py:class:`RangeNotSupportedError` if the server does not honor range
+    requests, in which case the caller should fall back to a single streamed download.
+    """
+    destination = os.path.abspath(destination)
+    if partSize is None:
+        partSize = calculate_part_size(fileSize)
+    parts = get_byte_ranges(fileSize, partSize)
+
+    temp_destination = utils.temp_download_filename(destination, fileHandleId)
+    status_path = temp_destination + PART_STATUS_SUFFIX
+
+    completed_parts = _read_part_status(status_path, fileSize, partSize)
+    if not completed_parts or not os.path.exists(temp_destination) \
+            or os.path.getsize(temp_destination) != fileSize:
+        completed_parts = set()
+        _preallocate(temp_destination, fileSize)
+        _write_part_status(status_path, fileSize, partSize, completed_parts)
+
+    previously_transferred = sum(end - start + 1 for n, start, end in parts if n in completed_parts)
+    transferred = Value('d', previously_transferred)
+    status_lock = threading.Lock()
+    t0 = time.time()
+    filename = os.path.basename(destination)
+
+    def download_part(part):
+        try:
+            n_bytes = _download_part(syn, url, temp_destination, part)
+        except RangeNotSupportedError:
+            raise
+        except Exception as ex:
+            syn.logger.debug("Part %d of %s failed: %s" % (part[0], filename, ex), exc_info=True)
+            return ex
+        with status_lock:
+            completed_parts.add(part[0])
+            _write_part_status(status_path, fileSize, partSize, completed_parts)
+        with transferred.get_lock():
+            transferred.value += n_bytes
+            printTransferProgress(transferred.value, fileSize, 'Downloading ', filename,
+                                  dt=time.time()-t0, previouslyTransferred=previously_transferred)
+        return None
+
+    syn.logger.debug("Downloading %s in %d parts of %d bytes, %d already complete"
+                     % (filename, len(parts), partSize, len(completed_parts)))
+    pool = pool_provider.get_transfer_pool(syn.max_threads)
+    while len(completed_parts) < len(parts):
+        completed_before = len(completed_parts)
+        errors = [e for e in pool.map(download_part, [p for p in parts if p[0] not in completed_parts],
+                                      max_workers=max_threads)
+                  if e is not None]
+        ## parts retry transient errors on their own, so a pass without progress most
+        ## likely means the URL expired. Let the caller get a new one and resume.
+        if len(completed_parts) == completed_before:
+            ex = SynapseError("Download of %s did not complete, %d parts remaining. Last error: %s"
+                              % (filename, len(parts) - len(completed_parts), errors[-1]))
+            ex.progress = transferred.value - previously_transferred
+            raise ex
+
+    actual_md5 = utils.md5_for_file(temp_destination).hexdigest()
+    if expected_md5 and actual_md5 != expected_md5:
+        os.remove(temp_destination)
+        os.remove(status_path)
+        raise SynapseMd5MismatchError("Downloaded file {filename}'s md5 {md5} does not match expected MD5 of {expected_md5}"
+                                      .format(filename=destination, md5=actual_md5, expected_md5=expected_md5))
+
+    shutil.move(temp_destination, destination)
+    os.remove(status_path)
+    return destination
@@ -20,14 +20,16 @@ import hashlib
 import json
 import math
 import mimetypes
+import mmap
 import os
 import requests
 import sys
+import tempfile
+import threading
 import time
 import warnings
-from ctypes import c_bool
-from multiprocessing import Value
-from multiprocessing.dummy import Pool
+
+import six
 
 try:
     from urllib.parse import urlparse
@@ -37,15 +39,19 @@ except ImportError:
     from urlparse import parse_qs
 
 from . import exceptions
-from .utils import printTransferProgress, md5_for_file, MB
+from . import pool_provider
+from .utils import printTransferProgress, MB
 from .dict_object import DictObject
 from .exceptions import SynapseError
 from .exceptions import SynapseHTTPError
 from .utils import threadsafe_generator
+from .presigned_url_cache import get_expiration_time, EXPIRY_MARGIN
 
 MAX_NUMBER_OF_PARTS = 10000
 MIN_PART_SIZE = 8*MB
 MAX_RETRIES  = 7
+## number of part URLs requested at a time, just ahead of the threads that use them
+PRESIGNED_URL_BATCH_SIZE = 16
 
 
 def find_parts_to_upload(part_status):
@@ -78,6 +84,25 @@ def calculate_part_size(fileSize, partSize=None, min_part_size=MIN_PART_SIZE, ma
     return partSize
 
 
+def _choose_part_size(syn, fileSize, partSize=None):
+    """
+    Returns the part size and the number of threads with which to upload a file. Unless a part size is given,
+    they are fitted to the throughput measured by earlier uploads if the Synapse object has adaptive part
+    sizes turned on, otherwise the part size is the one given by :py:func:`calculate_part_size` and the
+    number of threads is None, for all of the threads of the transfer pool.
+    """
+    if partSize is None and syn.adaptive_part_size:
+        recommendation = syn._throughput_monitor.recommend(fileSize, syn.max_threads, MIN_PART_SIZE, MAX_NUMBER_OF_PARTS)
+        if recommendation is not None:
+            monitor = syn._throughput_monitor
+            syn.logger.debug("adaptive part size: rtt=%0.3fs throughput=%0.2f MB/s per connection failure rate=%0.2f"
+                             " -> part size %0.1f MB with %d threads"
+                             % (monitor.rtt, monitor.throughput/MB, monitor.failure_rate,
+                                float(recommendation[0])/MB, recommendation[1]))
+            return recommendation
+    return calculate_part_size(fileSize, partSize, MIN_PART_SIZE, MAX_NUMBER_OF_PARTS), None
+
+
 def get_file_chunk(filepath, n, chunksize=8*MB):
     """
     Read the nth chunk from the file.
@@ -87,6 +112,87 @@ def get_file_chunk(filepath, n, chunksize=8*MB):
         return f.read(chunksize)
 
 
+class MemoryMappedFile(object):
+    """
+    Serves the chunks of a file as :py:class:`memoryview` slices of a read-only memory map of it,
+    so that a chunk is passed to the HTTP request and to the hasher without being copied and
+    the pages of the file are only held in memory while they are being sent.
+    Falls back to :py:func:`get_file_chunk` for empty files and where a memory map can't be
+    viewed, as on Python 2.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        self._map = None
+        self._view = None
+        try:
+            if os.fstat(self._file.fileno()).st_size > 0:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+        except (TypeError, ValueError, EnvironmentError):
+            self.close()
+
+    def get_chunk(self, n, chunksize=8*MB):
+        """
+        Returns the nth chunk of the file.
+        """
+        if self._view is None:
+            return get_file_chunk(self.filepath, n, chunksize)
+        return self._view[(n-1)*chunksize : n*chunksize]
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                ## a chunk is still referenced somewhere, the map is closed once it is garbage collected
+                pass
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def md5s_for_file_parts(filepath, partSize, block_size=2*MB):
+    """
+    Calculates the MD5 of a file and of each of its parts in a single sequential read.
+
+    :param filepath:   The file to read in
+    :param partSize:   The number of bytes in each part, the last part may be shorter
+    :param block_size: How much of the file to read in at once (bytes)
+
+    :returns: A tuple of the hex MD5 of the whole file and a list of the hex MD5s of its parts,
+              the MD5 of part n being at index n-1
+    """
+    md5 = hashlib.md5()
+    part_md5s = []
+    part_md5 = hashlib.md5()
+    part_remaining = partSize
+    with open(filepath, 'rb') as f:
+        while True:
+            data = f.read(min(block_size, part_remaining))
+            if not data:
+                break
+            md5.update(data)
+            part_md5.update(data)
+            part_remaining -= len(data)
+            if part_remaining == 0:
+                part_md5s.append(part_md5.hexdigest())
+                part_md5 = hashlib.md5()
+                part_remaining = partSize
+    if part_remaining < partSize or not part_md5s:
+        part_md5s.append(part_md5.hexdigest())
+    return md5.hexdigest(), part_md5s
+
+
 def get_data_chunk(data, n, chunksize=8*MB):
     """
     Return the nth chunk of a buffer.
@@ -94,13 +200,13 @@ def get_data_chunk(data, n, chunksize=8*MB):
     return data[ (n-1)*chunksize : n*chunksize ]
 
 
-def _start_multipart_upload(syn, filename, md5, fileSize, partSize, contentType, preview=True, storageLocationId=None, forceRestart=False):
+def _multipart_upload_request(filename, md5, fileSize, partSize, contentType, preview=True, storageLocationId=None):
     """
-    :returns: A `MultipartUploadStatus`_
+    :returns: A `MultipartUploadRequest`_
 
-    .. _MultipartUploadStatus: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadStatus.html
+    .. _MultipartUploadRequest: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadRequest.html
     """
-    upload_request = {
+    return {
         'contentMD5Hex': md5,
         'fileName': filename,
         'generatePreview': preview,
@@ -110,32 +216,82 @@ def _start_multipart_upload(syn, filename, md5, fileSize, partSize, contentType,
         'storageLocationId': storageLocationId
     }
 
-    return DictObject(**syn.restPOST(uri='/file/multipart?forceRestart=%s' % forceRestart,
+
+def _start_multipart_upload(syn, filename, md5, fileSize, partSize, contentType, preview=True, storageLocationId=None, forceRestart=False):
+    """
+    :returns: A `MultipartUploadStatus`_
+
+    .. _MultipartUploadStatus: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadStatus.html
+    """
+    upload_request = _multipart_upload_request(filename, md5, fileSize, partSize, contentType,
+                                               preview=preview, storageLocationId=storageLocationId)
+
+    return DictObject(**syn.restPOST(uri=_start_multipart_upload_uri(forceRestart),
                                      body=json.dumps(upload_request),
                                      endpoint=syn.fileHandleEndpoint))
 
+
+def _start_multipart_upload_uri(forceRestart=False):
+    return '/file/multipart?forceRestart=%s' % forceRestart
+
+
+def _presigned_url_batch_request(uploadId, partNumbers):
+    """
+    :returns: The URI and body of a BatchPresignedUploadUrlRequest_ for the given parts.
+
+    .. BatchPresignedUploadUrlRequest: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/BatchPresignedUploadUrlRequest.html
+    """
+    uri = '/file/multipart/{uploadId}/presigned/url/batch'.format(uploadId=uploadId)
+    return uri, json.dumps({'uploadId': uploadId, 'partNumbers': partNumbers})
+
+
+def _add_part_uri(uploadId, partNumber, partMD5Hex):
+    return '/file/multipart/{uploadId}/add/{partNumber}?partMD5Hex={partMD5Hex}'.format(**locals())
+
+
+def _complete_multipart_upload_uri(uploadId):
+    return '/file/multipart/{uploadId}/complete'.format(uploadId=uploadId)
+
+
+def _get_presigned_url_batch(syn, uploadId, partNumbers):
+    """Returns the urls to upload the given parts to.
+
+    :param syn: a Synapse object
+    :param uploadId: The id of the multipart upload
+    :param partNumbers: A list of integers corresponding to the parts that need to be uploaded
+
+    :returns: The partPresignedUrls of a BatchPresignedUploadUrlResponse_.
+    .. BatchPresignedUploadUrlResponse: http://docs.synapse.org/rest/POST/file/multipart/uploadId/presigned/url/batch.html
+    """
+    uri, body = _presigned_url_batch_request(uploadId, partNumbers)
+    presigned_url_batch = syn.restPOST(uri, body=body, endpoint=syn.fileHandleEndpoint)
+    return presigned_url_batch['partPresignedUrls']
+
+
 @threadsafe_generator
-def _get_presigned_urls(syn, uploadId, parts_to_upload):
-    """Returns list of urls to upload parts to.
+def _get_presigned_urls(syn, uploadId, parts_to_upload, batch_size=PRESIGNED_URL_BATCH_SIZE):
+    """Generates the urls to upload parts to.
+
+    The urls are requested in batches of `batch_size` parts as the generator is advanced, so that
+    they are fetched just before they are used rather than all at once and left to expire.
 
     :param syn: a Synapse object
     :param uploadId: The id of the multipart upload
     :param parts_to_upload: A list of integers corresponding to the parts that need to be uploaded
+    :param batch_size: The number of urls requested at a time
 
-
-    :returns: A BatchPresignedUploadUrlResponse_.
-    .. BatchPresignedUploadUrlResponse: http://docs.synapse.org/rest/POST/file/multipart/uploadId/presigned/url/batch.html
+    :returns: A generator of PartPresignedUrl_.
+    .. PartPresignedUrl: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/PartPresignedUrl.html
     """
-    if len(parts_to_upload)==0:
-        return 
-    presigned_url_request = { 'uploadId':uploadId }
-    uri = '/file/multipart/{uploadId}/presigned/url/batch'.format(uploadId=uploadId)
+    for i in range(0, len(parts_to_upload), batch_size):
+        for part in _get_presigned_url_batch(syn, uploadId, parts_to_upload[i:i+batch_size]):
+            yield part
 
-    presigned_url_request['partNumbers'] = parts_to_upload
-    presigned_url_batch = syn.restPOST(uri, body=json.dumps(presigned_url_request),
-                                       endpoint=syn.fileHandleEndpoint)
-    for part in presigned_url_batch['partPresignedUrls']:
-        yield part
+
+def _is_expired(url):
+    """True if a pre-signed URL expires too soon to start a part upload with it."""
+    expires = get_expiration_time(url)
+    return expires is not None and expires - EXPIRY_MARGIN <= time.time()
 
 
 def _add_part(syn, uploadId, partNumber, partMD5Hex):
@@ -145,8 +301,7 @@ def _add_part(syn, uploadId, partNumber, partMD5Hex):
 
     .. AddPartResponse: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/AddPartResponse.html
     """
-    uri = '/file/multipart/{uploadId}/add/{partNumber}?partMD5Hex={partMD5Hex}'.format(**locals())
-    return DictObject(**syn.restPUT(uri, endpoint=syn.fileHandleEndpoint))
+    return DictObject(**syn.restPUT(_add_part_uri(uploadId, partNumber, partMD5Hex), endpoint=syn.fileHandleEndpoint))
 
 
 def _complete_multipart_upload(syn, uploadId):
@@ -155,12 +310,153 @@ def _complete_multipart_upload(syn, uploadId):
 
     .. MultipartUploadStatus: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadStatus.html
     """
-    uri = '/file/multipart/{uploadId}/complete'.format(uploadId=uploadId)
-    return DictObject(**syn.restPUT(uri, endpoint=syn.fileHandleEndpoint))
+    return DictObject(**syn.restPUT(_complete_multipart_upload_uri(uploadId), endpoint=syn.fileHandleEndpoint))
+
+
+def _part_md5(chunk, partNumber, part_md5s=None):
+    """The MD5 of a part, the one computed along with the MD5 of the file if there is one."""
+    return part_md5s[partNumber-1] if part_md5s is not None else hashlib.md5(chunk).hexdigest()
+
+
+def _parts_in_flight(syn, max_workers=None):
+    """
+    The most parts of an upload that are sent at once. The calling thread uploads parts alongside
+    the threads of the transfer pool, so by default it is one more than the size of the pool.
+    """
+    default = syn.max_threads + 1
+    return default if max_workers is None else min(default, max_workers)
 
 
-def _put_chunk(url, chunk, verbose=False):
-    response = requests.put(url, data=chunk)
+class _UploadState(object):
+    """
+    The progress of a multipart upload through its rounds, whichever way its parts are sent.
+    Each round uploads the parts that the last `MultipartUploadStatus`_ reports missing, rounds
+    that complete no new parts count towards :py:data:`MAX_RETRIES`, and the upload is
+    completed once the parts added add up to the size of the file.
+
+    .. _MultipartUploadStatus: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadStatus.html
+    """
+
+    def __init__(self, syn, filename, fileSize, partSize, status):
+        self.syn = syn
+        self.filename = filename
+        self.fileSize = fileSize
+        self.partSize = partSize
+        self.status = status
+        self.completedParts = count_completed_parts(status.partsState)
+        ## bytes that were uploaded before the current upload began
+        self.previously_completed_bytes = min(self.completedParts * partSize, fileSize)
+        self.completed = self.previously_completed_bytes
+        self.retries = 0
+        self.t0 = time.time()
+        self._lock = threading.Lock()
+        syn.logger.debug("file partitioned into size: %s" % partSize)
+        syn.logger.debug("current multipart-upload status: %s" % status)
+        syn.logger.debug("previously completed %d parts, estimated %d bytes"
+                         % (self.completedParts, self.previously_completed_bytes))
+
+    @property
+    def uploadId(self):
+        return self.status.uploadId
+
+    def retrying(self):
+        return self.retries < MAX_RETRIES
+
+    def start_round(self):
+        """Returns the numbers of the parts to upload in the next round."""
+        self.syn.logger.debug("Started retry loop for multipart_upload. Currently %d/%d retries" % (self.retries, MAX_RETRIES))
+        self.completed = min(self.completedParts * self.partSize, self.fileSize)
+        printTransferProgress(self.completed, self.fileSize, prefix='Uploading', postfix=self.filename)
+        return find_parts_to_upload(self.status.partsState)
+
+    def part_added(self, partNumber, add_part_response, size):
+        """Records the response to adding a part of `size` bytes to the upload."""
+        if add_part_response["addPartState"] != "ADD_SUCCESS":
+            self.syn.logger.debug("did not sucessfuly add part %s" % partNumber)
+            return
+        self.syn.logger.debug("finished contacting Synapse about adding part %s" % partNumber)
+        with self._lock:
+            self.completed += size
+            completed = self.completed
+        printTransferProgress(completed, self.fileSize, prefix='Uploading', postfix=self.filename,
+                              dt=time.time()-self.t0, previouslyTransferred=self.previously_completed_bytes)
+
+    def end_round(self, status):
+        """
+        Takes the status of the upload after a round.
+
+        :returns: True if every part has been added and the upload should be completed
+        """
+        self.status = status
+        oldCompletedParts, self.completedParts = self.completedParts, count_completed_parts(status.partsState)
+        progress = self.completedParts > oldCompletedParts
+        if not progress:
+            self.retries += 1
+        self.syn.logger.debug("progress made in this loop? %s" % progress)
+        if self.completed >= self.fileSize:
+            self.syn.logger.debug("attempting to finalize multipart upload because completed.value >= filesize ({completed} >= {size})".format(completed=self.completed, size=self.fileSize))
+            return True
+        return False
+
+    def completed_with(self, status):
+        """
+        Takes the status returned by completing the upload.
+
+        :returns: True if the upload is complete
+        """
+        self.status = status
+        return status.state == "COMPLETED"
+
+    def completion_failed(self, ex):
+        self.syn.logger.error("Attempt to complete the multipart upload failed with exception %s %s" % (type(ex),ex))
+        self.syn.logger.debug("multipart upload failed:", exc_info=True)
+
+    def result(self):
+        """Returns the final status of the upload, or raises an error if it didn't complete."""
+        if self.status["state"] != "COMPLETED":
+            raise SynapseError("Upload {id} did not complete. Try again.".format(id=self.status["uploadId"]))
+        return self.status
+
+
+def _get_part_upload_session(syn):
+    """
+    Returns the keep-alive session that the parts of the multipart uploads of a Synapse object are PUT with,
+    so that each part doesn't open a new connection to S3. It is kept apart from the session of the REST calls,
+    which are signed, and its connection pool holds a connection for each of the threads that upload parts.
+    """
+    with _part_upload_session_lock:
+        session = syn._part_upload_session
+        if session is None or session.pool_size != _parts_in_flight(syn):
+            session = requests.Session()
+            session.pool_size = _parts_in_flight(syn)
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=session.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            syn._part_upload_session = session
+        return session
+
+
+_part_upload_session_lock = threading.Lock()
+
+
+def _connection_stats(session):
+    """Returns the number of requests made by a session and the number of connections they were made over."""
+    requests_made = connections = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_made += getattr(pool, 'num_requests', 0)
+                connections += getattr(pool, 'num_connections', 0)
+    return requests_made, connections
+
+
+def _put_chunk(url, chunk, verbose=False, rate_limiter=None, session=None):
+    if rate_limiter is not None:
+        rate_limiter.limit_request()
+        rate_limiter.limit_upload(len(chunk))
+    response = (session or requests).put(url, data=chunk)
     try:
         # Make sure requests closes response stream?:
         # see: http://docs.python-requests.org/en/latest/user/advanced/#keep-alive
@@ -197,7 +493,9 @@ def multipart_upload(syn, filepath, filename=None, contentType=None, storageLoca
     fileSize = os.path.getsize(filepath)
     if not filename:
         filename = os.path.basename(filepath)
-    md5 = md5_for_file(filepath).hexdigest()
+    ## the part size is needed up front so that the part MD5s can be computed along with the MD5 of the file
+    partSize, max_workers = _choose_part_size(syn, fileSize, kwargs.pop('partSize', None))
+    md5, part_md5s = syn._md5_cache.md5s_for_file_parts(filepath, partSize, md5s_for_file_parts)
 
     if contentType is None:
         (mimetype, enc) = mimetypes.guess_type(filepath, strict=False)
@@ -206,14 +504,16 @@ def multipart_upload(syn, filepath, filename=None, contentType=None, storageLoca
         contentType = mimetype
     syn.logger.debug("Initiating multi-part upload for file: [{path}] size={size} md5={md5}, contentType={contentType}".format(path=filepath,size=fileSize,md5=md5,contentType=contentType))
 
-    get_chunk_function = lambda n,partSize: get_file_chunk(filepath, n, partSize)
-
-    status = _multipart_upload(syn, filename, contentType,
-                               get_chunk_function=get_chunk_function,
-                               md5=md5,
-                               fileSize=fileSize,
-                               storageLocationId=storageLocationId,
-                               **kwargs)
+    with MemoryMappedFile(filepath) as mapped_file:
+        status = _multipart_upload(syn, filename, contentType,
+                                   get_chunk_function=mapped_file.get_chunk,
+                                   md5=md5,
+                                   fileSize=fileSize,
+                                   partSize=partSize,
+                                   part_md5s=part_md5s,
+                                   storageLocationId=storageLocationId,
+                                   max_workers=max_workers,
+                                   **kwargs)
     syn.logger.debug("Completed multi-part upload. Result:%s" % status)
     return status["resultFileHandleId"]
 
@@ -260,54 +560,154 @@ def multipart_upload_string(syn, text, filename=None, contentType=None, storageL
     return status["resultFileHandleId"]
 
 
-def _upload_chunk(part, completed, status, syn, filename, get_chunk_function,
-                  fileSize, partSize, t0, expired, bytes_already_uploaded = 0):
+def _stream_blocks(readable, block_size=2*MB):
+    """
+    Generates the bytes of a file-like object, read `block_size` at a time, or of an iterable of
+    bytes such as a generator. Text is encoded as UTF-8.
+    """
+    if hasattr(readable, 'read'):
+        blocks = iter(lambda: readable.read(block_size), readable.read(0))
+    else:
+        blocks = iter(readable)
+    for data in blocks:
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        if data:
+            yield data
+
+
+def _spool_stream(readable, spool, partSize):
+    """
+    Copies a stream to a file while calculating its MD5 and the MD5s of its parts, so that it is
+    read only once.
+
+    :param readable: a file-like object or an iterable of bytes
+    :param spool:    a writable file to copy the stream into
+    :param partSize: The number of bytes in each part, the last part may be shorter
+
+    :returns: A tuple of the hex MD5 of the stream, a list of the hex MD5s of its parts and its size in bytes
+    """
+    md5 = hashlib.md5()
+    part_md5s = []
+    part_md5 = hashlib.md5()
+    part_remaining = partSize
+    size = 0
+    for data in _stream_blocks(readable):
+        spool.write(data)
+        md5.update(data)
+        size += len(data)
+        while data:
+            piece, data = data[:part_remaining], data[part_remaining:]
+            part_md5.update(piece)
+            part_remaining -= len(piece)
+            if part_remaining == 0:
+                part_md5s.append(part_md5.hexdigest())
+                part_md5 = hashlib.md5()
+                part_remaining = partSize
+    if part_remaining < partSize or not part_md5s:
+        part_md5s.append(part_md5.hexdigest())
+    return md5.hexdigest(), part_md5s, size
+
+
+def multipart_upload_stream(syn, readable, filename, contentType=None, storageLocationId=None, spool_dir=None, **kwargs):
+    """
+    Upload the contents of a stream that can only be read once, such as a pipe, socket or generator,
+    using the multipart file upload.
+
+    Synapse needs the MD5 of a file before any of it is uploaded, so the stream is first copied to a
+    temporary spool while it is hashed. The spool is kept in memory up to the size of one part, larger
+    streams are written to a temporary file in `spool_dir` that is removed once the upload is done.
+
+    :param syn: a Synapse object
+    :param readable: a file-like object opened in binary mode, or an iterable of bytes
+    :param filename: a string containing the base filename
+    :param contentType: `contentType`_
+    :param partSize: number of bytes per part. Minimum 5MB.
+    :param storageLocationId: a id indicating where the data should be stored. retrieved from Synapse's UploadDestination
+    :param spool_dir: the directory to spool large streams in, defaults to the system temporary directory
+
+    :return: a File Handle ID
+
+    Keyword arguments are passed down to :py:func:`_multipart_upload` and
+    :py:func:`_start_multipart_upload`.
+
+    .. _contentType: https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.17
+    """
+    if not contentType:
+        (mimetype, enc) = mimetypes.guess_type(filename, strict=False)
+        contentType = mimetype or "application/octet-stream"
+
+    ## the size of the stream isn't known until it has been read, so its parts are hashed at the
+    ## requested or smallest part size and hashed again on upload if a different one is chosen
+    requested_part_size = kwargs.pop('partSize', None)
+    hashed_part_size = requested_part_size or MIN_PART_SIZE
+    with tempfile.SpooledTemporaryFile(max_size=hashed_part_size, dir=spool_dir) as spool:
+        md5, part_md5s, fileSize = _spool_stream(readable, spool, hashed_part_size)
+        partSize, max_workers = _choose_part_size(syn, fileSize, requested_part_size)
+        if partSize != hashed_part_size:
+            part_md5s = None
+        syn.logger.debug("Spooled stream for multi-part upload: [{name}] size={size} md5={md5}".format(name=filename, size=fileSize, md5=md5))
+
+        spool_lock = threading.Lock()
+
+        def get_chunk_function(n, partSize):
+            with spool_lock:
+                spool.seek((n-1)*partSize)
+                return spool.read(partSize)
+
+        status = _multipart_upload(syn, filename, contentType,
+                                   get_chunk_function=get_chunk_function,
+                                   md5=md5,
+                                   fileSize=fileSize,
+                                   partSize=partSize,
+                                   part_md5s=part_md5s,
+                                   storageLocationId=storageLocationId,
+                                   max_workers=max_workers,
+                                   **kwargs)
+    return status["resultFileHandleId"]
+
+
+def _upload_chunk(part, state, syn, get_chunk_function, partSize, part_md5s=None, session=None):
     partNumber=part["partNumber"]
     url=part["uploadPresignedUrl"]
 
     syn.logger.debug("uploading this part of the upload: %s" % part)
-    #if the upload url for another worker has expired, assume that this one also expired and return early
-    with expired.get_lock():
-        if expired.value:
-            syn.logger.debug("part %s is returning early because other parts have already expired" % partNumber)
-            return
-
     try:
         chunk = get_chunk_function(partNumber, partSize)
+        ## only the URL of this part is replaced if it has expired, the other parts carry on
+        if _is_expired(url):
+            syn.logger.debug("The presigned upload URL for part %s has expired. Getting a new one..." % partNumber)
+            url = _get_presigned_url_batch(syn, state.uploadId, [partNumber])[0]["uploadPresignedUrl"]
         syn.logger.debug("start upload part %s" % partNumber)
-        _put_chunk(url, chunk, syn.debug)
+        put_started = time.time()
+        try:
+            _put_chunk(url, chunk, syn.debug, syn._rate_limiter, session=session)
+        except SynapseHTTPError as ex:
+            if ex.response.status_code != 403:
+                raise
+            syn.logger.debug("The presigned upload URL for part %s was rejected. Retrying with a new one..." % partNumber)
+            url = _get_presigned_url_batch(syn, state.uploadId, [partNumber])[0]["uploadPresignedUrl"]
+            put_started = time.time()
+            _put_chunk(url, chunk, syn.debug, syn._rate_limiter, session=session)
+        syn._throughput_monitor.record_transfer(len(chunk), time.time() - put_started)
         syn.logger.debug("PUT upload of part %s complete" % partNumber)
-        ## compute the MD5 for the chunk
-        md5 = hashlib.md5()
-        md5.update(chunk)
+        partMD5Hex = _part_md5(chunk, partNumber, part_md5s)
 
         ## confirm that part got uploaded
         syn.logger.debug("contacting Synapse to complete part %s" % partNumber)
-        add_part_response = _add_part(syn, uploadId=status.uploadId,
-                                      partNumber=partNumber, partMD5Hex=md5.hexdigest())
-        ## if part was successfully uploaded, increment progress
-        if add_part_response["addPartState"] == "ADD_SUCCESS":
-            syn.logger.debug("finished contacting Synapse about adding part %s" % partNumber)
-            with completed.get_lock():
-                completed.value += len(chunk)
-            printTransferProgress(completed.value, fileSize, prefix='Uploading', postfix=filename, dt=time.time()-t0, previouslyTransferred=bytes_already_uploaded)
-        else:
-            syn.logger.debug("did not sucessfuly add part %s" % partNumber)
+        add_part_started = time.time()
+        add_part_response = _add_part(syn, uploadId=state.uploadId,
+                                      partNumber=partNumber, partMD5Hex=partMD5Hex)
+        syn._throughput_monitor.record_request(time.time() - add_part_started)
+        state.part_added(partNumber, add_part_response, len(chunk))
+    #If we are not in verbose debug mode we will swallow the error and retry.
     except Exception as ex1:
-        if isinstance(ex1, SynapseHTTPError) and ex1.response.status_code == 403:
-            syn.logger.debug("The presigned upload URL for part %s has expired. Restarting upload...\n" % partNumber)
-            with expired.get_lock():
-                if not expired.value:
-                    warnings.warn("The presigned upload URL has expired. Restarting upload...\n")
-                    expired.value = True
-            return
-        #If we are not in verbose debug mode we will swallow the error and retry.
-        else:
-            syn.logger.debug("Encountered an exception: %s. Retrying...\n" % str(type(ex1)), exc_info=True)
+        syn._throughput_monitor.record_failure()
+        syn.logger.debug("Encountered an exception: %s. Retrying...\n" % str(type(ex1)), exc_info=True)
 
 
 def _multipart_upload(syn, filename, contentType, get_chunk_function, md5, fileSize, 
-                      partSize=None, storageLocationId = None,**kwargs):
+                      partSize=None, storageLocationId = None, part_md5s=None, max_workers=None, **kwargs):
     """
     Multipart Upload.
 
@@ -320,6 +720,9 @@ def _multipart_upload(syn, filename, contentType, get_chunk_function, md5, fileS
     :param fileSize: total number of bytes
     :param partSize: number of bytes per part. Minimum 5MB.
     :param storageLocationId: a id indicating where the file should be stored. retrieved from Synapse's UploadDestination
+    :param part_md5s: (optional) the hex MD5 of each part, in order, if they are already known.
+                      They are kept for all attempts, so resumed parts are not hashed again.
+    :param max_workers: (optional) the most parts to upload at once, defaults to the size of the transfer pool.
 
     :return: a MultipartUploadStatus_ object
 
@@ -328,61 +731,40 @@ def _multipart_upload(syn, filename, contentType, get_chunk_function, md5, fileS
     .. MultipartUploadStatus: http://docs.synapse.org/rest/org/sagebionetworks/repo/model/file/MultipartUploadStatus.html
     .. contentType: https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.17
     """
+    if partSize is None:
+        partSize, max_workers = _choose_part_size(syn, fileSize)
     partSize = calculate_part_size(fileSize, partSize, MIN_PART_SIZE, MAX_NUMBER_OF_PARTS)
     status = _start_multipart_upload(syn, filename, md5, fileSize, partSize, contentType, storageLocationId=storageLocationId,**kwargs)
 
     ## only force restart once
     kwargs['forceRestart'] = False
 
-    completedParts = count_completed_parts(status.partsState)
-    previously_completed_bytes =  min(completedParts * partSize, fileSize) # bytes that were previously uploaded before the current upload began. this variable is set only once
-    syn.logger.debug("file partitioned into size: %s" % partSize)
-    syn.logger.debug("current multipart-upload status: %s" % status)
-    syn.logger.debug("previously completed %d parts, estimated %d bytes" % (completedParts, previously_completed_bytes))
-    time_upload_started = time.time()
-    progress=True
-    retries=0
-    mp = Pool(8)
-    try:
-        while retries<MAX_RETRIES:
-            syn.logger.debug("Started retry loop for multipart_upload. Currently %d/%d retries" % (retries, MAX_RETRIES))
-            ## keep track of the number of bytes uploaded so far
-            completed = Value('d', min(completedParts * partSize, fileSize))
-            expired = Value(c_bool, False)
-
-            printTransferProgress(completed.value, fileSize, prefix='Uploading', postfix=filename)
-            chunk_upload = lambda part: _upload_chunk(part, completed=completed, status=status,
-                                                      syn=syn, filename=filename,
-                                                      get_chunk_function=get_chunk_function,
-                                                      fileSize=fileSize, partSize=partSize, t0=time_upload_started,
-                                                      expired=expired, bytes_already_uploaded=previously_completed_bytes)
-
-            syn.logger.debug("fetching presigned urls and mapping to Pool")
-            url_generator = _get_presigned_urls(syn, status.uploadId, find_parts_to_upload(status.partsState))
-            mp.map(chunk_upload, url_generator)
-            syn.logger.debug("completed pooled upload")
-
-
-            #Check if there are still parts
-            status = _start_multipart_upload(syn, filename, md5, fileSize, partSize, contentType, storageLocationId=storageLocationId, **kwargs)
-            oldCompletedParts, completedParts = completedParts, count_completed_parts(status.partsState)
-            progress = (completedParts>oldCompletedParts)
-            retries = retries+1 if not progress else retries
-            syn.logger.debug("progress made in this loop? %s" % progress)
-
-            ## Are we done, yet?
-            if completed.value >= fileSize:
-                try:
-                    syn.logger.debug("attempting to finalize multipart upload because completed.value >= filesize ({completed} >= {size})".format(completed=completed.value, size=fileSize))
-                    status = _complete_multipart_upload(syn, status.uploadId)
-                    if status.state == "COMPLETED":
-                        break
-                except Exception as ex1:
-                    syn.logger.error("Attempt to complete the multipart upload failed with exception %s %s" % (type(ex1),ex1))
-                    syn.logger.debug("multipart upload failed:", exc_info=True)
-    finally:
-        mp.terminate()
-    if status["state"] != "COMPLETED":
-        raise SynapseError("Upload {id} did not complete. Try again.".format(id=status["uploadId"]))
-
-    return status
+    state = _UploadState(syn, filename, fileSize, partSize, status)
+    pool = pool_provider.get_transfer_pool(syn.max_threads)
+    session = _get_part_upload_session(syn)
+    requests_before, connections_before = _connection_stats(session)
+    while state.retrying():
+        parts_to_upload = state.start_round()
+        chunk_upload = lambda part: _upload_chunk(part, state=state, syn=syn,
+                                                  get_chunk_function=get_chunk_function,
+                                                  partSize=partSize, part_md5s=part_md5s, session=session)
+
+        syn.logger.debug("fetching presigned urls and mapping to the transfer pool")
+        url_generator = _get_presigned_urls(syn, state.uploadId, parts_to_upload)
+        pool.map(chunk_upload, url_generator, max_workers=_parts_in_flight(syn, max_workers))
+        syn.logger.debug("completed pooled upload")
+
+        #Check if there are still parts
+        status = _start_multipart_upload(syn, filename, md5, fileSize, partSize, contentType, storageLocationId=storageLocationId, **kwargs)
+
+        ## Are we done, yet?
+        if state.end_round(status):
+            try:
+                if state.completed_with(_complete_multipart_upload(syn, state.uploadId)):
+                    break
+            except Exception as ex1:
+                state.completion_failed(ex1)
+    requests_after, connections_after = _connection_stats(session)
+    syn.logger.debug("uploaded parts with %d requests over %d new connections (%d connections opened in total)"
+                     % (requests_after - requests_before, connections_after - connections_before, connections_after))
+    return state.result()
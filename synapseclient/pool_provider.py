@@ -0,0 +1,145 @@
+"""
+*********************
+Transfer thread pool
+*********************
+
+A single pool of threads shared by the uploads and downloads of all Synapse
+objects in a process, instead of a new pool for every file. Its size is set
+with ``max_threads`` in the ``[transfer]`` section of the configuration file
+or the `max_threads` argument of :py:class:`synapseclient.Synapse`, and
+Synapse objects configured with different sizes each share the pool of theirs.
+
+The thread that calls :py:meth:`TransferPool.map` works through the items
+itself alongside at most `max_threads` helpers from the pool, and only hands
+out items as threads become free. This bounds the number of transfers in
+flight however many files are transferred at once, and lets maps be nested,
+such as the parts of files that are themselves downloaded concurrently,
+without the pool deadlocking when all of its threads are busy.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import threading
+from multiprocessing.dummy import Pool
+
+import six
+
+DEFAULT_MAX_THREADS = 8
+
+
+class _MapState(object):
+    """The items of a single call to :py:meth:`TransferPool.map`, shared by the threads working on them."""
+
+    def __init__(self, function, iterable):
+        self.function = function
+        self.items = enumerate(iterable)
+        self.results = {}
+        self.exc_info = None
+        self.done = False
+        self.active = 0
+        ## the iterable may be a generator that makes requests, so it has a lock of its own
+        self.items_lock = threading.Lock()
+        self.condition = threading.Condition()
+
+    def fail(self, exc_info):
+        with self.condition:
+            self.exc_info = self.exc_info or exc_info
+            self.done = True
+
+    def next_item(self):
+        with self.items_lock:
+            if self.done:
+                return None
+            try:
+                return next(self.items)
+            except StopIteration:
+                self.done = True
+            except Exception:
+                self.fail(sys.exc_info())
+            return None
+
+    def work(self, helper=False):
+        with self.condition:
+            ## helpers that start after every item has been handed out have nothing to do
+            if helper and self.done:
+                return
+            self.active += 1
+        try:
+            while True:
+                item = self.next_item()
+                if item is None:
+                    return
+                index, value = item
+                try:
+                    result = self.function(value)
+                except Exception:
+                    self.fail(sys.exc_info())
+                    return
+                with self.condition:
+                    self.results[index] = result
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+
+class TransferPool(object):
+    """
+    A fixed number of threads that run the items of any number of concurrent, possibly nested,
+    calls to :py:meth:`map`.
+
+    :param max_threads: the number of threads in the pool
+    """
+
+    def __init__(self, max_threads=DEFAULT_MAX_THREADS):
+        if max_threads < 1:
+            raise ValueError("max_threads must be at least 1")
+        self.max_threads = max_threads
+        self._pool = Pool(max_threads)
+
+    def map(self, function, iterable, max_workers=None):
+        """
+        Applies `function` to every item of `iterable` and returns the results in order, like
+        :py:meth:`multiprocessing.pool.Pool.map`. Items are taken from `iterable` as threads
+        become free, so it can be a generator that is slow or costly to advance.
+        If a call raises an exception no further items are started and the exception is
+        raised once the calls already running have finished.
+
+        :param max_workers: (optional) the most threads, including the calling one, to work on
+                            these items at once. Defaults to one more than the pool size.
+        """
+        state = _MapState(function, iterable)
+        helpers = self.max_threads if max_workers is None else min(self.max_threads, max_workers - 1)
+        for i in range(helpers):
+            self._pool.apply_async(state.work, kwds={'helper': True})
+        state.work()
+        with state.condition:
+            while state.active > 0:
+                state.condition.wait()
+        if state.exc_info is not None:
+            six.reraise(*state.exc_info)
+        return [state.results[i] for i in range(len(state.results))]
+
+    def close(self):
+        """Lets the threads exit once the work already given to the pool is done."""
+        self._pool.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_transfer_pool(max_threads=DEFAULT_MAX_THREADS):
+    """
+    Returns the process-wide :py:class:`TransferPool` with `max_threads` threads, creating it on
+    first use. Pools are kept for the life of the process and never closed, so a pool handed out
+    earlier keeps working when another client asks for a different number of threads.
+    """
+    with _pools_lock:
+        if max_threads not in _pools:
+            _pools[max_threads] = TransferPool(max_threads)
+        return _pools[max_threads]
@@ -0,0 +1,109 @@
+"""
+**********************
+Pre-signed URL caching
+**********************
+
+Keeps the results of ``/fileHandle/batch`` requests for file handle
+associations in memory so that repeated and retried downloads of the same file
+do not need to ask Synapse for a new pre-signed URL every time. Entries are
+dropped shortly before their URL expires, as read from the URL's query
+parameters. URLs whose expiry can't be determined are not cached.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from builtins import str
+
+import collections
+import threading
+import time
+from datetime import datetime
+
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+from . import utils
+
+## seconds before their expiry at which URLs are no longer handed out
+EXPIRY_MARGIN = 60
+MAX_ENTRIES = 10000
+
+
+def get_expiration_time(url):
+    """
+    Returns the time at which a pre-signed URL expires in seconds since the unix epoch,
+    or None if the URL does not say.
+
+    Understands AWS signature version 4 (``X-Amz-Date`` and ``X-Amz-Expires``) and the
+    equivalent Google Cloud Storage parameters, as well as the ``Expires`` parameter of
+    AWS signature version 2.
+    """
+    query = parse_qs(urlparse(url).query)
+    try:
+        for prefix in ('X-Amz-', 'X-Goog-'):
+            if prefix + 'Date' in query and prefix + 'Expires' in query:
+                signed = datetime.strptime(query[prefix + 'Date'][0], '%Y%m%dT%H%M%SZ')
+                return utils.to_unix_epoch_time_secs(signed) + int(query[prefix + 'Expires'][0])
+        if 'Expires' in query:
+            return int(query['Expires'][0])
+    except ValueError:
+        pass
+    return None
+
+
+class PresignedUrlCache(object):
+    """
+    A thread safe, size bounded map from file handle associations to FileResults that
+    include a pre-signed URL.
+
+    :param margin:      seconds before the expiry of a URL at which it is evicted
+    :param max_entries: number of entries kept, the oldest are evicted first
+    """
+
+    def __init__(self, margin=EXPIRY_MARGIN, max_entries=MAX_ENTRIES):
+        self.margin = margin
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(fileHandleId, objectId, objectType):
+        return str(fileHandleId), str(objectId), objectType
+
+    def get(self, fileHandleId, objectId, objectType):
+        """Returns the cached FileResult for an association, or None if there is no unexpired one."""
+        key = self._key(fileHandleId, objectId, objectType)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, fileResult = entry
+            if expires - self.margin <= time.time():
+                del self._entries[key]
+                return None
+            return fileResult
+
+    def put(self, fileHandleId, objectId, objectType, fileResult):
+        """Caches a FileResult, unless it has no pre-signed URL or its expiry is unknown."""
+        url = fileResult.get('preSignedURL')
+        expires = get_expiration_time(url) if url else None
+        if expires is None:
+            return
+        key = self._key(fileHandleId, objectId, objectType)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, fileResult)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, fileHandleId, objectId, objectType):
+        with self._lock:
+            self._entries.pop(self._key(fileHandleId, objectId, objectType), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
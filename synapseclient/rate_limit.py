@@ -0,0 +1,98 @@
+"""
+*************
+Rate limiting
+*************
+
+Token buckets that limit the bandwidth and request rate of all transfers made
+by a Synapse object, across all of the threads it uses. The limits are set in
+the ``[transfer]`` section of the configuration file::
+
+    [transfer]
+    max_upload_rate = 10485760     # bytes per second
+    max_download_rate = 52428800   # bytes per second
+    max_request_rate = 20          # HTTP requests per second
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Limits the average rate at which an amount, such as bytes or requests, is consumed.
+
+    Consumers that take more than the available tokens go into debt and are made to wait
+    until it is paid off, so a single large transfer does not have to be split to be limited.
+
+    :param rate:     amount per second
+    :param capacity: the largest burst allowed after a period of inactivity, defaults to one second's worth
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """Takes `amount` tokens without waiting and returns the number of seconds the caller should wait."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def consume(self, amount=1):
+        """Takes `amount` tokens, sleeping as long as is needed to keep to the rate."""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TransferRateLimiter(object):
+    """
+    The upload, download and request rate limits shared by the transfers of a Synapse object.
+    Limits that are None are not enforced.
+
+    :param max_upload_rate:   bytes per second
+    :param max_download_rate: bytes per second
+    :param max_request_rate:  HTTP requests per second
+    """
+
+    def __init__(self, max_upload_rate=None, max_download_rate=None, max_request_rate=None):
+        self._upload = TokenBucket(max_upload_rate) if max_upload_rate else None
+        self._download = TokenBucket(max_download_rate) if max_download_rate else None
+        self._request = TokenBucket(max_request_rate) if max_request_rate else None
+
+    def limit_upload(self, nbytes):
+        if self._upload is not None:
+            self._upload.consume(nbytes)
+
+    def limit_download(self, nbytes):
+        if self._download is not None:
+            self._download.consume(nbytes)
+
+    def limit_request(self):
+        if self._request is not None:
+            self._request.consume(1)
+
+    ## The reserve_* methods don't block, they return the number of seconds to wait,
+    ## so that callers running in an event loop can wait without blocking it
+
+    def reserve_upload(self, nbytes):
+        return self._upload.reserve(nbytes) if self._upload is not None else 0
+
+    def reserve_download(self, nbytes):
+        return self._download.reserve(nbytes) if self._download is not None else 0
+
+    def reserve_request(self):
+        return self._request.reserve(1) if self._request is not None else 0
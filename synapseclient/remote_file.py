@@ -0,0 +1,213 @@
+"""
+******************
+Remote File Access
+******************
+
+Read-only, seekable access to the content of a file stored in Synapse without
+downloading the whole file first. Reads are served from fixed size blocks that
+are fetched with HTTP ``Range`` requests and kept in a least recently used
+cache in memory and, optionally, on disk. End users obtain these objects from
+:py:func:`synapseclient.Synapse.open` rather than constructing them directly.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import errno
+import io
+import os
+import tempfile
+import threading
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from . import exceptions
+from .exceptions import SynapseError, SynapseHTTPError
+from .multipart_download import RangeNotSupportedError
+from .retry import _with_retry
+from .utils import MB
+
+DEFAULT_BLOCK_SIZE = 1*MB
+DEFAULT_MAX_CACHED_BLOCKS = 64
+REDIRECT_LIMIT = 5
+
+
+class RemoteReadNotSupportedError(SynapseError):
+    """Raised for files that can only be downloaded, such as those in external object stores or at non-HTTP URLs."""
+    pass
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    A read-only file-like object over the content of a file handle.
+
+    :param syn:             a Synapse object
+    :param fileHandleId:    id of the FileHandle to read
+    :param objectId:        id of the Synapse object that uses the FileHandle e.g. "syn123"
+    :param objectType:      type of the Synapse object that uses the FileHandle e.g. "FileEntity"
+    :param fileSize:        size of the file in bytes
+    :param name:            the file name, used for the ``name`` attribute
+    :param blockSize:       number of bytes fetched by each range request
+    :param maxCachedBlocks: number of blocks kept in memory
+    :param cacheDir:        (optional) directory in which fetched blocks are also stored, so
+                            that they can be reused by other RemoteFile objects and sessions
+    """
+
+    def __init__(self, syn, fileHandleId, objectId, objectType, fileSize, name=None,
+                 blockSize=DEFAULT_BLOCK_SIZE, maxCachedBlocks=DEFAULT_MAX_CACHED_BLOCKS, cacheDir=None):
+        super(RemoteFile, self).__init__()
+        if blockSize <= 0:
+            raise ValueError("blockSize must be positive")
+        self._syn = syn
+        self.fileHandleId = fileHandleId
+        self.objectId = objectId
+        self.objectType = objectType
+        self.size = fileSize
+        self.name = name
+        self.blockSize = blockSize
+        self.maxCachedBlocks = maxCachedBlocks
+        self.cacheDir = cacheDir
+        self._position = 0
+        self._url = None
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("invalid whence (%r, should be 0, 1 or 2)" % whence)
+        if position < 0:
+            raise ValueError("negative seek position %d" % position)
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        ## reads stop at the end of a block so that a buffered reader asking for more
+        ## than it needs does not cause further blocks to be fetched
+        self._checkClosed()
+        with self._lock:
+            if self._position >= self.size or len(b) == 0:
+                return 0
+            index, offset = divmod(self._position, self.blockSize)
+            block = self._get_block(index)
+            n = min(len(block) - offset, len(b))
+            memoryview(b)[:n] = block[offset:offset + n]
+            self._position += n
+            return n
+
+    def close(self):
+        self._blocks.clear()
+        super(RemoteFile, self).close()
+
+    def _get_block(self, index):
+        """Returns the bytes of a block from the memory cache, the disk cache or the server."""
+        block = self._blocks.pop(index, None)
+        if block is None:
+            block = self._read_cached_block(index)
+            if block is None:
+                block = self._fetch_block(index)
+                self._write_cached_block(index, block)
+        self._blocks[index] = block
+        while len(self._blocks) > self.maxCachedBlocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _block_path(self, index):
+        return os.path.join(self.cacheDir, str(self.fileHandleId), '%d-%d' % (self.blockSize, index))
+
+    def _read_cached_block(self, index):
+        if self.cacheDir is None:
+            return None
+        try:
+            with io.open(self._block_path(index), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def _write_cached_block(self, index, block):
+        if self.cacheDir is None:
+            return
+        path = self._block_path(index)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        ## write to a temporary file and rename it so other readers never see a partial block
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(block)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            ## another reader stored the same block first
+            os.remove(temp_path)
+
+    def _get_url(self, refresh=False):
+        if self._url is None or refresh:
+            fileResult = self._syn._getFileHandleDownload(self.fileHandleId, self.objectId, self.objectType,
+                                                          refresh=refresh)
+            self._url = fileResult['preSignedURL']
+            scheme = urlparse(self._url).scheme
+            if scheme not in ('http', 'https'):
+                raise RemoteReadNotSupportedError("Files stored at %s URLs can not be opened remotely, use get() instead"
+                                                  % scheme)
+        return self._url
+
+    def _fetch_block(self, index):
+        start = index * self.blockSize
+        end = min(start + self.blockSize, self.size) - 1
+        try:
+            return self._fetch_range(self._get_url(), start, end)
+        except SynapseHTTPError as ex:
+            ## pre-signed URLs expire, in which case S3 answers 403 Forbidden
+            if ex.response is None or ex.response.status_code not in (400, 403):
+                raise
+            self._syn.logger.debug("Refreshing the URL of file handle %s after: %s" % (self.fileHandleId, ex))
+            return self._fetch_range(self._get_url(refresh=True), start, end)
+
+    def _fetch_range(self, url, start, end):
+        syn = self._syn
+        range_header = {'Range': 'bytes={start}-{end}'.format(start=start, end=end)}
+        for i in range(REDIRECT_LIMIT):
+            syn._rate_limiter.limit_request()
+            response = _with_retry(
+                lambda: syn._requests_session.get(url, headers=syn._generateSignedHeaders(url, dict(range_header)),
+                                                  allow_redirects=False),
+                verbose=syn.debug, **syn._build_retry_policy())
+            exceptions._raise_for_status(response, verbose=syn.debug)
+            if response.status_code in (301, 302, 303, 307, 308):
+                url = response.headers['location']
+                continue
+            if response.status_code != 206:
+                raise RangeNotSupportedError("Server responded with status %d to a ranged request for %s"
+                                             % (response.status_code, self.name or self.fileHandleId))
+            block = response.content
+            syn._rate_limiter.limit_download(len(block))
+            if len(block) != end - start + 1:
+                raise SynapseError("Expected %d bytes of %s but received %d"
+                                   % (end - start + 1, self.name or self.fileHandleId, len(block)))
+            return block
+        raise SynapseError("Too many redirects while reading %s" % (self.name or self.fileHandleId))
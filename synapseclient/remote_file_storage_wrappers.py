@@ -46,7 +46,24 @@ class S3ClientWrapper:
         return progress_callback
 
     @staticmethod
-    def download_file(bucket, endpoint_url, remote_file_key, download_file_path, profile_name = None, show_progress=True):
+    def _limit_callback_func(limit, callback=None):
+        def limited_callback(bytes):
+            limit(bytes)
+            if callback is not None:
+                callback(bytes)
+        return limited_callback
+
+    @staticmethod
+    def _transfer_config(max_threads):
+        """Returns boto3 transfer settings that use at most `max_threads` threads, or None for its defaults."""
+        if max_threads is None:
+            return None
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(max_concurrency=max_threads)
+
+    @staticmethod
+    def download_file(bucket, endpoint_url, remote_file_key, download_file_path, profile_name = None, show_progress=True,
+                      rate_limiter=None, max_threads=None):
 
         boto3 = S3ClientWrapper._attempt_import_boto3()
         import botocore #if we boto3 is importable, botocore should also be importable since it is a dependency of boto3
@@ -63,7 +80,10 @@ class S3ClientWrapper:
                 file_size = s3_obj.content_length
                 filename = os.path.basename(download_file_path)
                 progress_callback = S3ClientWrapper._create_progress_callback_func(file_size, filename, prefix='Downloading')
-            s3_obj.download_file(download_file_path, Callback=progress_callback)
+            if rate_limiter is not None:
+                progress_callback = S3ClientWrapper._limit_callback_func(rate_limiter.limit_download, progress_callback)
+            s3_obj.download_file(download_file_path, Callback=progress_callback,
+                                 Config=S3ClientWrapper._transfer_config(max_threads))
             return download_file_path
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == "404":
@@ -73,7 +93,8 @@ class S3ClientWrapper:
 
 
     @staticmethod
-    def upload_file(bucket, endpoint_url, remote_file_key, upload_file_path, profile_name = None, show_progress=True):
+    def upload_file(bucket, endpoint_url, remote_file_key, upload_file_path, profile_name = None, show_progress=True,
+                    rate_limiter=None, max_threads=None):
         boto3 = S3ClientWrapper._attempt_import_boto3()
 
         if not os.path.isfile(upload_file_path):
@@ -87,8 +108,11 @@ class S3ClientWrapper:
             file_size = os.stat(upload_file_path).st_size
             filename = os.path.basename(upload_file_path)
             progress_callback = S3ClientWrapper._create_progress_callback_func(file_size, filename, prefix='Uploading')
+        if rate_limiter is not None:
+            progress_callback = S3ClientWrapper._limit_callback_func(rate_limiter.limit_upload, progress_callback)
 
-        s3.Bucket(bucket).upload_file(upload_file_path, remote_file_key, Callback=progress_callback) #automatically determines whether to perform multi-part upload
+        s3.Bucket(bucket).upload_file(upload_file_path, remote_file_key, Callback=progress_callback,
+                                      Config=S3ClientWrapper._transfer_config(max_threads)) #automatically determines whether to perform multi-part upload
         return upload_file_path
 
 
@@ -110,6 +134,22 @@ class SFTPWrapper:
                                 "For more information, see: http://docs.synapse.org/python/sftp.html")
 
 
+    @staticmethod
+    def _progress_callback(limit=None):
+        """
+        Returns a progress callback for pysftp that prints the progress and, if given,
+        enforces a limit on the bytes transferred.
+        """
+        if limit is None:
+            return printTransferProgress
+        transferred_before = Value('d', 0)
+        def limited_callback(transferred, toBeTransferred):
+            with transferred_before.get_lock():
+                limit(transferred - transferred_before.value)
+                transferred_before.value = transferred
+            printTransferProgress(transferred, toBeTransferred)
+        return limited_callback
+
     @staticmethod
     def _parse_for_sftp(url):
         parsedURL = urlparse(url)
@@ -120,7 +160,7 @@ class SFTPWrapper:
 
 
     @staticmethod
-    def upload_file(filepath, url, username=None, password=None):
+    def upload_file(filepath, url, username=None, password=None, rate_limiter=None):
         """
         Performs upload of a local file to an sftp server.
 
@@ -133,6 +173,8 @@ class SFTPWrapper:
 
         :param password: password for authentication on the sftp server
 
+        :param rate_limiter: (optional) a TransferRateLimiter whose upload rate is enforced
+
         :returns: A URL where file is stored
         """
         pysftp = SFTPWrapper._attempt_import_sftp()
@@ -142,14 +184,15 @@ class SFTPWrapper:
         with pysftp.Connection(parsedURL.hostname, username=username, password=password) as sftp:
             sftp.makedirs(parsedURL.path)
             with sftp.cd(parsedURL.path):
-                sftp.put(filepath, preserve_mtime=True, callback=printTransferProgress)
+                sftp.put(filepath, preserve_mtime=True, callback=SFTPWrapper._progress_callback(
+                    rate_limiter.limit_upload if rate_limiter is not None else None))
 
         path = quote(parsedURL.path+'/'+os.path.split(filepath)[-1])
         parsedURL = parsedURL._replace(path=path)
         return urlunparse(parsedURL)
 
     @staticmethod
-    def download_file(url, localFilepath=None, username=None, password=None):
+    def download_file(url, localFilepath=None, username=None, password=None, rate_limiter=None):
         """
         Performs download of a file from an sftp server.
 
@@ -157,6 +200,7 @@ class SFTPWrapper:
         :param localFilepath: location where to store file
         :param username: username on server
         :param password: password for authentication on  server
+        :param rate_limiter: (optional) a TransferRateLimiter whose download rate is enforced
 
         :returns: localFilePath
 
@@ -178,5 +222,6 @@ class SFTPWrapper:
 
         #Download file
         with pysftp.Connection(parsedURL.hostname, username=username, password=password) as sftp:
-            sftp.get(path, localFilepath, preserve_mtime=True, callback=printTransferProgress)
+            sftp.get(path, localFilepath, preserve_mtime=True, callback=SFTPWrapper._progress_callback(
+                rate_limiter.limit_download if rate_limiter is not None else None))
         return localFilepath
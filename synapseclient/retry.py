@@ -45,7 +45,6 @@ def _with_retry(function, verbose=False,
     while True:
         # Start with a clean slate
         exc_info = None
-        retry = False
         response = None
 
         # Try making the call
@@ -57,35 +56,7 @@ def _with_retry(function, verbose=False,
             if hasattr(ex, 'response'):
                 response = ex.response
 
-        # Check if we got a retry-able error
-        if response is not None:
-            if response.status_code in retry_status_codes:
-                response_message = _get_message(response)
-                retry = True
-                logger.debug("retrying on status code: %s" % str(response.status_code))
-                logger.debug(str(response_message)) #TODO: this was originally printed regardless of 'verbose' was that behavior correct?
-                if (response.status_code == 429) and (wait>10):
-                    logger.warning('%s...\n' % response_message)
-                    logger.warning('Retrying in %i seconds' %wait)
-                
-            elif response.status_code not in range(200,299):
-                ## For all other non 200 messages look for retryable errors in the body or reason field
-                response_message = _get_message(response)
-                if any([msg.lower() in response_message.lower() for msg in retry_errors]):
-                    retry = True
-                    logger.debug('retrying %s' %response_message)
-                ## special case for message throttling
-                elif 'Please slow down.  You may send a maximum of 10 message' in response:
-                    retry = True
-                    wait = 16
-                    logger.debug("retrying "+ response_message)
-
-        # Check if we got a retry-able exception
-        if exc_info is not None:
-            if (exc_info[1].__class__.__name__ in retry_exceptions or
-                any([msg.lower() in str(exc_info[1]).lower() for msg in retry_errors])):
-                retry = True
-                logger.debug("retrying exception: "+ exc_info[1].__class__.__name__ + str(exc_info[1]))
+        retry, wait = _is_retryable(response, exc_info, retry_status_codes, retry_errors, retry_exceptions, wait, logger)
 
         # Wait then retry
         retries -= 1
@@ -105,6 +76,48 @@ def _with_retry(function, verbose=False,
         return response
 
 
+def _is_retryable(response, exc_info, retry_status_codes, retry_errors, retry_exceptions, wait, logger):
+    """
+    Decides whether a call that returned `response` or raised the exception in `exc_info` should be retried.
+    Shared by :py:func:`_with_retry` and its asyncio counterpart in :py:mod:`synapseclient.aio.retry`.
+
+    :returns: a tuple of whether to retry and the number of seconds to wait before doing so
+    """
+    retry = False
+
+    # Check if we got a retry-able error
+    if response is not None:
+        if response.status_code in retry_status_codes:
+            response_message = _get_message(response)
+            retry = True
+            logger.debug("retrying on status code: %s" % str(response.status_code))
+            logger.debug(str(response_message)) #TODO: this was originally printed regardless of 'verbose' was that behavior correct?
+            if (response.status_code == 429) and (wait>10):
+                logger.warning('%s...\n' % response_message)
+                logger.warning('Retrying in %i seconds' %wait)
+
+        elif response.status_code not in range(200,299):
+            ## For all other non 200 messages look for retryable errors in the body or reason field
+            response_message = _get_message(response)
+            if any([msg.lower() in response_message.lower() for msg in retry_errors]):
+                retry = True
+                logger.debug('retrying %s' %response_message)
+            ## special case for message throttling
+            elif 'Please slow down.  You may send a maximum of 10 message' in response:
+                retry = True
+                wait = 16
+                logger.debug("retrying "+ response_message)
+
+    # Check if we got a retry-able exception
+    if exc_info is not None:
+        if (exc_info[1].__class__.__name__ in retry_exceptions or
+            any([msg.lower() in str(exc_info[1]).lower() for msg in retry_errors])):
+            retry = True
+            logger.debug("retrying exception: "+ exc_info[1].__class__.__name__ + str(exc_info[1]))
+
+    return retry, wait
+
+
 def _get_message(response):
     """
     Extracts the message body or a response object by checking for a
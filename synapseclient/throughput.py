@@ -0,0 +1,99 @@
+"""
+******************
+Throughput monitor
+******************
+
+Measures the round trip time of the small requests made during multipart
+uploads and the throughput of each connection that sends a part, so that the
+part size and number of threads of the next upload can be fitted to the link.
+Parts that are small compared to the bandwidth-delay product of a connection
+spend much of their time waiting on round trips, while parts that take long to
+send waste a lot of work when one of them fails and has to be sent again.
+
+Adaptive part sizes are turned on in the ``[transfer]`` section of the
+configuration file::
+
+    [transfer]
+    adaptive_part_size = true
+
+Until a client has measured a transfer the part size is chosen by
+:py:func:`synapseclient.multipart_upload.calculate_part_size`.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import threading
+
+from .utils import MB, GB
+
+## the largest part S3 accepts
+MAX_PART_SIZE = 5*GB
+## a part should take this many round trips to send, so that only a small share of the time goes to waiting on requests
+ROUND_TRIPS_PER_PART = 10
+## ... but no longer than this many seconds, so that a failed part costs little to send again
+MAX_PART_SECONDS = 60
+## weight of a new measurement in the moving averages
+SMOOTHING = 0.3
+
+
+class ThroughputMonitor(object):
+    """
+    Exponential moving averages of the round trip time, the throughput of a single connection and the
+    share of part uploads that fail, shared by the threads of a Synapse object.
+    """
+
+    def __init__(self, smoothing=SMOOTHING):
+        self.smoothing = smoothing
+        self.rtt = None
+        self.throughput = None
+        self.failure_rate = 0.0
+        self._lock = threading.Lock()
+
+    def _average(self, average, value):
+        return value if average is None else (1 - self.smoothing) * average + self.smoothing * value
+
+    def record_request(self, seconds):
+        """Records the time taken by a request that sends and receives little data."""
+        with self._lock:
+            self.rtt = self._average(self.rtt, seconds)
+
+    def record_transfer(self, nbytes, seconds):
+        """Records a part of `nbytes` that was sent in `seconds` over one connection."""
+        if seconds <= 0:
+            return
+        with self._lock:
+            self.throughput = self._average(self.throughput, nbytes / seconds)
+            self.failure_rate = self._average(self.failure_rate, 0.0)
+
+    def record_failure(self):
+        """Records a part that could not be sent."""
+        with self._lock:
+            self.failure_rate = self._average(self.failure_rate, 1.0)
+
+    def recommend(self, fileSize, max_threads, min_part_size, max_parts):
+        """
+        Chooses a part size and number of threads for uploading a file from the measurements so far.
+
+        The part size is large enough that sending it takes :py:data:`ROUND_TRIPS_PER_PART` round trips,
+        but takes no more than :py:data:`MAX_PART_SECONDS`, less the more often parts fail. It is kept
+        between the smallest size that splits the file into at most `max_parts` parts and
+        :py:data:`MAX_PART_SIZE`, and rounded to whole MB. The parts are sent by as many threads as there
+        are parts, up to `max_threads`.
+
+        :returns: a tuple of the part size and number of threads, or None if nothing has been measured yet
+        """
+        with self._lock:
+            rtt, throughput, failure_rate = self.rtt, self.throughput, self.failure_rate
+        if rtt is None or throughput is None:
+            return None
+        partSize = min(throughput * rtt * ROUND_TRIPS_PER_PART,
+                       throughput * MAX_PART_SECONDS * (1 - failure_rate))
+        smallest = max(min_part_size, int(math.ceil(fileSize / float(max_parts))))
+        partSize = int(math.ceil(partSize / MB)) * MB
+        partSize = max(smallest, min(partSize, MAX_PART_SIZE))
+        parts = max(1, int(math.ceil(fileSize / float(partSize))))
+        return partSize, min(max_threads, parts)
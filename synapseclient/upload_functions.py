@@ -3,12 +3,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import os
-from .utils import is_url, md5_for_file, as_url, file_url_to_path, id_of
+from .utils import is_url, as_url, file_url_to_path, id_of, find_data_file_handle
 from .constants import concrete_types
 from .remote_file_storage_wrappers import S3ClientWrapper, SFTPWrapper
 from .multipart_upload import  multipart_upload
-from .exceptions import SynapseMd5MismatchError
+from .exceptions import SynapseMd5MismatchError, SynapseHTTPError
 try:
     from urllib.parse import urlparse
     from urllib.parse import urlunparse
@@ -22,7 +23,7 @@ except ImportError:
     from urllib import unquote
     from urllib import urlretrieve
 
-def upload_file_handle(syn, parent_entity, path, synapseStore=True, md5=None, file_size=None, mimetype=None):
+def upload_file_handle(syn, parent_entity, path, synapseStore=True, md5=None, file_size=None, mimetype=None, dedupe=False):
     """Uploads the file in the provided path (if necessary) to a storage location based on project settings.
     Returns a new FileHandle as a dict to represent the stored file.
 
@@ -33,6 +34,9 @@ def upload_file_handle(syn, parent_entity, path, synapseStore=True, md5=None, fi
     :param md5: The MD5 checksum for the file, if known. Otherwise if the file is a local file, it will be calculated automatically.
     :param file_size: The size the file, if known. Otherwise if the file is a local file, it will be calculated automatically.
     :param file_size: The MIME type the file, if known. Otherwise if the file is a local file, it will be calculated automatically.
+    :param dedupe: If True, a copy is made of the file handle of a file already in Synapse with the same MD5 and size,
+                   that the user can download and that is in the storage location the file would be uploaded to,
+                   instead of uploading the file again. Otherwise, or if there is no such file, the file is uploaded.
 
 
     :returns: a dict of a new FileHandle as a dict that represents the uploaded file 
@@ -52,6 +56,13 @@ def upload_file_handle(syn, parent_entity, path, synapseStore=True, md5=None, fi
     #determine the upload function based on the UploadDestination
     location = syn._getDefaultUploadDestination(entity_parent_id)
     upload_destination_type = location['concreteType']
+    if dedupe and location.get('storageLocationId') is not None and upload_destination_type in (
+            concrete_types.SYNAPSE_S3_UPLOAD_DESTINATION, concrete_types.EXTERNAL_S3_UPLOAD_DESTINATION,
+            concrete_types.EXTERNAL_OBJECT_STORE_UPLOAD_DESTINATION):
+        file_handle = copy_matching_file_handle(syn, expanded_upload_path, location['storageLocationId'],
+                                                md5=md5, mimetype=mimetype)
+        if file_handle is not None:
+            return file_handle
     # synapse managed S3
     if upload_destination_type == concrete_types.SYNAPSE_S3_UPLOAD_DESTINATION or \
                     upload_destination_type == concrete_types.EXTERNAL_S3_UPLOAD_DESTINATION:
@@ -84,13 +95,51 @@ def upload_file_handle(syn, parent_entity, path, synapseStore=True, md5=None, fi
         return upload_synapse_s3(syn, expanded_upload_path, None, mimetype=mimetype)
 
 
+def copy_matching_file_handle(syn, file_path, storageLocationId, md5=None, mimetype=None):
+    """
+    Looks up the files in Synapse with the same MD5 as a local file and copies the file handle of the first one
+    that has the same size, is in the given storage location and that the user is allowed to download.
+
+    :returns: the new file handle as a dict, or None if there is no such file
+    """
+    if md5 is None:
+        md5 = syn._md5_cache.md5_for_file(file_path)
+    file_size = os.path.getsize(file_path)
+    for header in syn.md5Query(md5):
+        try:
+            bundle = syn._getEntityBundle(header['id'], version=header.get('versionNumber'), bitFlags=0x800 | 0x1)
+        except SynapseHTTPError:
+            continue
+        file_handle = find_data_file_handle(bundle)
+        if file_handle is None or file_handle.get('contentMd5') != md5 or file_handle.get('contentSize') != file_size \
+                or file_handle.get('storageLocationId') != storageLocationId:
+            continue
+        copy_request = {'copyRequests': [{'originalFile': {'fileHandleId': file_handle['id'],
+                                                           'associateObjectId': bundle['entity']['id'],
+                                                           'associateObjectType': 'FileEntity'},
+                                          'newFileName': os.path.basename(file_path),
+                                          'newContentType': mimetype or file_handle.get('contentType')}]}
+        copy_result = syn.restPOST('/filehandles/copy', body=json.dumps(copy_request),
+                                   endpoint=syn.fileHandleEndpoint)['copyResults'][0]
+        if 'newFileHandle' not in copy_result:
+            syn.logger.debug('Could not copy file handle %s of %s: %s' % (file_handle['id'], header['id'],
+                                                                         copy_result.get('failureCode')))
+            continue
+        syn.logger.info('Copied the file handle of %s, which has the same content as %s, instead of uploading it'
+                        % (header['id'], file_path))
+        new_file_handle = copy_result['newFileHandle']
+        syn.cache.add(new_file_handle['id'], file_path)
+        return new_file_handle
+    return None
+
+
 def create_external_file_handle(syn, path, mimetype=None, md5=None, file_size=None):
     is_local_file = False #defaults to false
     url = as_url(os.path.expandvars(os.path.expanduser(path)))
     if is_url(url):
         parsed_url = urlparse(url)
         if parsed_url.scheme == 'file' and os.path.isfile(parsed_url.path):
-            actual_md5 = md5_for_file(parsed_url.path).hexdigest()
+            actual_md5 = syn._md5_cache.md5_for_file(parsed_url.path)
             if md5 is not None and md5 != actual_md5:
                 raise SynapseMd5MismatchError(
                     "The specified md5 [%s] does not match the calculated md5 [%s] for local file [%s]", md5,
@@ -110,9 +159,10 @@ def create_external_file_handle(syn, path, mimetype=None, md5=None, file_size=No
 
 def upload_external_file_handle_sftp(syn, file_path, sftp_url, mimetype=None):
     username, password = syn._getUserCredentials(sftp_url)
-    uploaded_url = SFTPWrapper.upload_file(file_path, unquote(sftp_url), username, password)
+    uploaded_url = SFTPWrapper.upload_file(file_path, unquote(sftp_url), username, password,
+                                           rate_limiter=syn._rate_limiter)
 
-    file_handle = syn._createExternalFileHandle(uploaded_url, mimetype=mimetype, md5=md5_for_file(file_path).hexdigest(), fileSize=os.stat(file_path).st_size)
+    file_handle = syn._createExternalFileHandle(uploaded_url, mimetype=mimetype, md5=syn._md5_cache.md5_for_file(file_path), fileSize=os.stat(file_path).st_size)
     syn.cache.add(file_handle['id'], file_path)
     return file_handle
 
@@ -127,7 +177,8 @@ def upload_client_auth_s3(syn, file_path, bucket, endpoint_url, key_prefix, stor
     profile = syn._get_client_authenticated_s3_profile(endpoint_url, bucket)
     file_key = key_prefix + '/' + os.path.basename(file_path)
 
-    S3ClientWrapper.upload_file(bucket, endpoint_url, file_key, file_path, profile_name=profile)
+    S3ClientWrapper.upload_file(bucket, endpoint_url, file_key, file_path, profile_name=profile,
+                                rate_limiter=syn._rate_limiter, max_threads=syn.max_threads)
 
     file_handle = syn._createExternalObjectStoreFileHandle(file_key, file_path, storage_location_id, mimetype=mimetype)
     syn.cache.add(file_handle['id'], file_path)
@@ -34,6 +34,7 @@ except ImportError:
     import urllib
 
 import os, sys
+import shutil
 import hashlib, re
 import cgi
 import errno
@@ -60,6 +61,9 @@ GB = 2**30
 MB = 2**20
 KB = 2**10
 BUFFER_SIZE = 8*KB
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+## FICLONE ioctl request from linux/fs.h, clones a file on copy-on-write file systems such as btrfs and XFS
+_FICLONE = 0x40049409
 
 
 def md5_for_file(filename, block_size=2*MB):
@@ -793,6 +797,49 @@ def temp_download_filename(destination, file_handle_id):
             destination + '.' + suffix
 
 
+def _reflink(source, destination):
+    import fcntl
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except (IOError, OSError):
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def link_or_copy_file(source, destination, link_mode='copy'):
+    """
+    Makes the content of a file available at another path, replacing any file already there.
+
+    :param source:      path of an existing file
+    :param destination: path of the file to create
+    :param link_mode:   "copy", "hardlink", "reflink" (a copy-on-write clone, on file systems that
+                        support it) or "symlink"
+
+    :returns: the link_mode that was used, which is "copy" when the requested kind of link
+              can not be made, e.g. because source and destination are on different file systems
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError("link_mode must be one of %s, got: %s" % (", ".join(LINK_MODES), link_mode))
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if link_mode != 'copy':
+        try:
+            if link_mode == 'hardlink':
+                os.link(source, destination)
+            elif link_mode == 'symlink':
+                os.symlink(os.path.abspath(source), destination)
+            else:
+                _reflink(source, destination)
+            return link_mode
+        ## os.link and os.symlink are missing on some platforms and fcntl on Windows
+        except (IOError, OSError, AttributeError, ImportError, NotImplementedError):
+            pass
+    shutil.copy(source, destination)
+    return 'copy'
+
+
 def _extract_zip_file_to_directory(zip_file, zip_entry_name, target_dir):
     """
     Extracts a specified file in a zip to the specified directory
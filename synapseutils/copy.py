@@ -42,11 +42,11 @@ def copyFileHandles(syn, fileHandles, associateObjectTypes, associateObjectIds,
 
 def _copy_cached_file_handles(cache, copiedFileHandles):
     # type: (Cache , dict) -> None
-    for copy_result in copiedFileHandles['copyResults']:
-        if copy_result.get('failureCode') is None:  # sucessfully copied
-            original_cache_path = cache.get(copy_result['originalFileHandleId'])
-            if original_cache_path:
-                cache.add(copy_result['newFileHandle']['id'], original_cache_path)
+    copy_results = [copy_result for copy_result in copiedFileHandles['copyResults']
+                    if copy_result.get('failureCode') is None]  # sucessfully copied
+    original_cache_paths = cache.get_many(copy_result['originalFileHandleId'] for copy_result in copy_results)
+    cache.add_many((copy_result['newFileHandle']['id'], original_cache_paths[copy_result['originalFileHandleId']])
+                   for copy_result in copy_results if original_cache_paths[copy_result['originalFileHandleId']])
 
 
 def changeFileMetaData(syn, entity, downloadAs=None, contentType=None):
@@ -489,7 +489,13 @@ def copyWiki(syn, entity, destinationId, entitySubPageId=None, destinationSubPag
         if wiki['attachmentFileHandleIds'] == []:
             new_file_handles = []
         elif wiki['attachmentFileHandleIds'] != []:
-            results = [syn._getFileHandleDownload(filehandleId, wiki.id, objectType='WikiAttachment') for filehandleId in wiki['attachmentFileHandleIds']]
+            results = syn.getFileHandleDownloads([{'fileHandleId': filehandleId,
+                                                   'associateObjectId': wiki.id,
+                                                   'associateObjectType': 'WikiAttachment'}
+                                                  for filehandleId in wiki['attachmentFileHandleIds']],
+                                                 includePreSignedURLs=False)
+            for filehandleId, attach in zip(wiki['attachmentFileHandleIds'], results):
+                syn._check_file_result(attach, filehandleId, wiki.id, 'WikiAttachment')
             #Get rid of the previews
             nopreviews = [attach['fileHandle'] for attach in results if attach['fileHandle']['concreteType'] != "org.sagebionetworks.repo.model.file.PreviewFileHandle"]
             contentTypes = [attach['contentType'] for attach in nopreviews]
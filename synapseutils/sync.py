@@ -3,11 +3,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import errno
+import threading
+import six
 from .monitor import notifyMe
 from synapseclient.entity import is_container
-from synapseclient.utils import id_of, topolgical_sort, is_url
+from synapseclient.utils import id_of, topolgical_sort, is_url, normalize_path
 from synapseclient import File, table
+from synapseclient.client import MAX_FILE_HANDLE_BATCH_SIZE
+from synapseclient.pool_provider import get_transfer_pool
 from synapseclient.exceptions import *
 import os
 from sys import stderr
@@ -23,7 +28,8 @@ MANIFEST_FILENAME = 'SYNAPSE_METADATA_MANIFEST.tsv'
 DEFAULT_GENERATED_MANIFEST_KEYS = ['path', 'parent', 'name', 'synapseStore', 'contentType', 'used',
             'executed', 'activityName', 'activityDescription']
 
-def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFiles = None, followLink=False):
+def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFiles = None, followLink=False,
+                    max_concurrent_downloads=1):
     """Synchronizes all the files in a folder (including subfolders) from Synapse and adds a readme manifest with file metadata.
 
     :param syn:    A synapse object as obtained with syn = synapseclient.login()
@@ -41,6 +47,11 @@ def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFi
     :param followLink:  Determines whether the link returns the target Entity.
                         Defaults to False
 
+    :param max_concurrent_downloads: The number of files that are fetched at the same time.
+                                     Defaults to 1, which downloads one file after the other.
+                                     Files are fetched by the threads of the transfer pool shared
+                                     with other transfers, sized by ``syn.max_threads``.
+
     :returns: list of entities (files, tables, links)
 
     This function will crawl all subfolders of the project/folder
@@ -66,8 +77,16 @@ def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFi
         for f in entities:
             print(f.path)
 
+    With ``max_concurrent_downloads`` greater than 1 the folder hierarchy is crawled first and the
+    files are then downloaded by a pool of threads. Files that would be written to the same local
+    path are still downloaded one after the other in crawl order, so "ifcollision" behaves the same
+    and the returned list and manifests are in the same order as for a serial sync.
+
     """
     if allFiles is None: allFiles = list()
+    if max_concurrent_downloads > 1:
+        return _sync_from_synapse_concurrently(syn, entity, path, ifcollision, allFiles, followLink,
+                                               max_concurrent_downloads)
     id = id_of(entity)
     results = syn.getChildren(id)
     zero_results = True
@@ -106,6 +125,161 @@ def syncFromSynapse(syn, entity, path=None, ifcollision='overwrite.local', allFi
     return allFiles
 
 
+def _sync_from_synapse_concurrently(syn, entity, path, ifcollision, allFiles, followLink, max_concurrent_downloads):
+    """
+    Implements syncFromSynapse in three stages: crawl the containers, fetch the metadata of all
+    files and finally download them, each of the last two using a pool of threads.
+    """
+    # each job is a list of [synapse id, download location, entity (once fetched)]
+    jobs = []
+    # (manifest filename, number of jobs whose files it lists)
+    manifests = []
+    _collect_sync_jobs(syn, entity, path, ifcollision, followLink, jobs, manifests)
+
+    pool = get_transfer_pool(syn.max_threads)
+    pending = [job for job in jobs if job[2] is None]
+    entities = pool.map(lambda job: _get_entity_for_download(syn, job[0], followLink), pending,
+                        max_workers=max_concurrent_downloads)
+    for job, ent in zip(pending, entities):
+        job[2] = ent
+
+    groups, uncached = _group_by_download_location(syn, [(job[1], job[2]) for job in pending
+                                                          if isinstance(job[2], File)])
+    file_results = _FileResultPrefetcher(syn, uncached)
+    pool.map(lambda group: _download_group(syn, group, ifcollision, file_results), groups,
+             max_workers=max_concurrent_downloads)
+
+    files = [job[2] if isinstance(job[2], File) else None for job in jobs]
+    initial_count = len(allFiles)
+    allFiles.extend(ent for ent in files if ent is not None)
+    for filename, job_count in manifests:
+        generateManifest(syn, allFiles[:initial_count] + [ent for ent in files[:job_count] if ent is not None],
+                         filename)
+    return allFiles
+
+
+def _collect_sync_jobs(syn, entity, path, ifcollision, followLink, jobs, manifests):
+    """
+    Crawls the containers the way syncFromSynapse does, creating the local directories and
+    recording the files to fetch and the manifests to write instead of downloading anything.
+    """
+    id = id_of(entity)
+    zero_results = True
+    for result in syn.getChildren(id):
+        zero_results = False
+        if is_container(result):
+            if path is not None:  #If we are downloading outside cache create directory.
+                new_path = os.path.join(path, result['name'])
+                try:
+                    os.makedirs(new_path)
+                except OSError as err:
+                    if err.errno!=errno.EEXIST:
+                        raise
+                print('making dir', new_path)
+            else:
+                new_path = None
+            _collect_sync_jobs(syn, result['id'], new_path, ifcollision, followLink, jobs, manifests)
+        else:
+            jobs.append([result['id'], path, None])
+    if zero_results:
+        stderr.write("The synapse id %s is not a container (Project/Folder), attempting to get the entity anyways" % id)
+        ent = syn.get(id, downloadLocation=path, ifcollision=ifcollision, followLink=followLink)
+        if not isinstance(ent, File):
+            raise ValueError("The provided id: %s is was neither a container nor a File" % id)
+        jobs.append([id, path, ent])
+
+    if path is not None:
+        filename = os.path.join(path, MANIFEST_FILENAME)
+        manifests.append((os.path.expanduser(os.path.normcase(filename)), len(jobs)))
+
+
+def _get_entity_for_download(syn, entity_id, followLink):
+    """Fetches an entity's metadata, checking the access restrictions syn.get() checks before downloading."""
+    bundle = syn._getEntityBundle(entity_id)
+    syn._check_entity_restrictions(bundle['restrictionInformation'], entity_id, True)
+    return syn._getWithEntityBundle(entityBundle=bundle, entity=entity_id, downloadFile=False, followLink=followLink)
+
+
+def _group_by_download_location(syn, downloads):
+    """
+    Groups (download location, File) pairs by the local path the file will be written to,
+    keeping the crawl order within each group.
+
+    :returns: the list of groups and the list of Files that are not in the cache yet
+    """
+    ## look up the files to download to each location in the cache at once
+    file_handle_ids = {}
+    for location, ent in downloads:
+        file_handle_ids.setdefault(location, set()).add(ent.dataFileHandleId)
+    cached_file_paths = dict((location, syn.cache.get_many(ids, location)) for location, ids in file_handle_ids.items())
+
+    groups = {}
+    order = []
+    uncached = []
+    for location, ent in downloads:
+        cached_file_path = cached_file_paths[location][ent.dataFileHandleId]
+        if cached_file_path is not None:
+            file_name = os.path.basename(cached_file_path)
+            directory = location or os.path.dirname(cached_file_path)
+        else:
+            uncached.append(ent)
+            file_name = ent._file_handle.fileName if ent._file_handle.get('id') is not None else ent.id
+            directory = location or syn.cache.get_cache_dir(ent.dataFileHandleId)
+        key = (normalize_path(directory), file_name)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((location, ent))
+    return [groups[key] for key in order], uncached
+
+
+def _download_group(syn, group, ifcollision, file_results):
+    for location, ent in group:
+        if ent._file_handle.get('id') is None:
+            # no file handle means that we do not have DOWNLOAD permission
+            syn.logger.warning("WARNING: You have READ permission on %s but not DOWNLOAD permission. "
+                               "The file has NOT been downloaded." % ent.id)
+            continue
+        syn._download_file_entity(location, ent, ifcollision, None, fileResult=file_results.get(ent))
+
+
+class _FileResultPrefetcher(object):
+    """
+    Looks up the presigned URLs of the files to download in batches with a single request per
+    batch. Batches are resolved only when a download needs them so the URLs do not expire while
+    earlier files are still being transferred.
+    """
+
+    def __init__(self, syn, entities, batch_size=MAX_FILE_HANDLE_BATCH_SIZE):
+        self._syn = syn
+        self._batch_size = batch_size
+        self._entities = [ent for ent in entities if ent._file_handle.get('id') is not None]
+        self._index = {(ent.id, ent.dataFileHandleId): i for i, ent in enumerate(self._entities)}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def get(self, entity):
+        """Returns the FileResult for downloading a File entity, or None to let the client look it up."""
+        key = (entity.id, entity.dataFileHandleId)
+        with self._lock:
+            if key not in self._index:
+                return None
+            if key not in self._results:
+                start = self._index[key]
+                batch = [ent for ent in self._entities[start:start + self._batch_size]
+                         if (ent.id, ent.dataFileHandleId) not in self._results]
+                try:
+                    results = self._syn.getFileHandleDownloads(
+                        [{'fileHandleId': ent.dataFileHandleId, 'associateObjectId': ent.id,
+                          'associateObjectType': 'FileEntity'} for ent in batch])
+                except SynapseHTTPError as ex:
+                    self._syn.logger.debug("Batched presigned URL lookup failed: %s" % ex)
+                    return None
+                for ent, result in zip(batch, results):
+                    self._results[(ent.id, ent.dataFileHandleId)] = result
+            return self._results.pop(key)
+
+
 def generateManifest(syn, allFiles, filename):
     """Generates a manifest file based on a list of entities objects.
 
@@ -281,7 +455,7 @@ def readManifestFile(syn, manifestFile):
     return df
 
 
-def syncToSynapse(syn, manifestFile, dryRun=False, sendMessages=True, retries=MAX_RETRIES):
+def syncToSynapse(syn, manifestFile, dryRun=False, sendMessages=True, retries=MAX_RETRIES, max_concurrent_uploads=1):
     """Synchronizes files specified in the manifest file to Synapse
 
     :param syn:    A synapse object as obtained with syn = synapseclient.login()
@@ -291,10 +465,19 @@ def syncToSynapse(syn, manifestFile, dryRun=False, sendMessages=True, retries=MA
 
     :param dryRun: Performs validation without uploading if set to True (default is False)
 
+    :param max_concurrent_uploads: The number of files that are stored at the same time.
+                                   Defaults to 1, which stores one file after the other.
+
     Given a file describing all of the uploads uploads the content to
     Synapse and optionally notifies you via Synapse messagging (email)
     at specific intervals, on errors and on completion.
 
+    With ``max_concurrent_uploads`` greater than 1 the files are stored by the threads of the
+    transfer pool, sized by ``syn.max_threads``. A file is only stored once the files of the
+    manifest that it used or executed have been stored. A file that can not be stored does not
+    stop the others, the files that failed, along with those that depend on them, are reported
+    once the rest of the manifest has been stored.
+
 
 
     **Manifest file format**
@@ -383,22 +566,115 @@ def syncToSynapse(syn, manifestFile, dryRun=False, sendMessages=True, retries=MA
     if sendMessages:
         notify_decorator = notifyMe(syn, 'Upload of %s' %manifestFile, retries=retries)
         upload = notify_decorator(_manifest_upload)
-        upload(syn, df)
+        upload(syn, df, max_concurrent_uploads)
     else:
-        _manifest_upload(syn,df)
+        _manifest_upload(syn, df, max_concurrent_uploads)
 
-def _manifest_upload(syn, df):
+def _manifest_upload(syn, df, max_concurrent_uploads=1):
+    if max_concurrent_uploads > 1:
+        return _manifest_upload_concurrently(syn, df, max_concurrent_uploads)
     for i, row in df.iterrows():
-        #Todo extract known constructor variables
-        kwargs = {key: row[key] for key in FILE_CONSTRUCTOR_FIELDS if key in row }
-        entity = File(row['path'], parent=row['parent'], **kwargs)
-        entity.annotations = dict(row.drop(FILE_CONSTRUCTOR_FIELDS+STORE_FUNCTION_FIELDS+REQUIRED_FIELDS, errors = 'ignore'))
-
-        #Update provenance list again to replace all file references that were uploaded
-        if 'used' in row:
-            row['used'] = syn._convertProvenanceList(row['used'])
-        if 'executed' in row:
-            row['executed'] = syn._convertProvenanceList(row['executed'])
-        kwargs = {key: row[key] for key in STORE_FUNCTION_FIELDS if key in row}
-        entity = syn.store(entity, **kwargs)
+        _store_manifest_row(syn, row)
     return True
+
+
+def _store_manifest_row(syn, row):
+    #Todo extract known constructor variables
+    kwargs = {key: row[key] for key in FILE_CONSTRUCTOR_FIELDS if key in row }
+    entity = File(row['path'], parent=row['parent'], **kwargs)
+    entity.annotations = dict(row.drop(FILE_CONSTRUCTOR_FIELDS+STORE_FUNCTION_FIELDS+REQUIRED_FIELDS, errors = 'ignore'))
+
+    #Update provenance list again to replace all file references that were uploaded
+    if 'used' in row:
+        row['used'] = syn._convertProvenanceList(row['used'])
+    if 'executed' in row:
+        row['executed'] = syn._convertProvenanceList(row['executed'])
+    kwargs = {key: row[key] for key in STORE_FUNCTION_FIELDS if key in row}
+    return syn.store(entity, **kwargs)
+
+
+def _manifest_upload_concurrently(syn, df, max_concurrent_uploads):
+    """
+    Stores the rows of a manifest with a pool of threads, each row once the rows it references are stored.
+    Raises a SynapseError listing the rows that could not be stored after all of the others are done.
+    """
+    scheduler = _ManifestUploadScheduler(syn, [row for i, row in df.iterrows()])
+    get_transfer_pool(syn.max_threads).map(scheduler.store, scheduler.ready_rows(), max_workers=max_concurrent_uploads)
+    if scheduler.failures:
+        for path, ex in scheduler.failures:
+            stderr.write('Failed to store %s: %s\n' % (path, ex))
+        raise SynapseError('%i of %i files in the manifest could not be stored: %s'
+                           % (len(scheduler.failures), scheduler.total, ', '.join(path for path, ex in scheduler.failures)))
+    return True
+
+
+class _ManifestUploadScheduler(object):
+    """
+    Hands out the rows of a manifest in upload order as soon as all of the files of the manifest that
+    they used or executed have been stored, and keeps track of the rows that failed.
+    """
+
+    def __init__(self, syn, rows):
+        self.syn = syn
+        self.total = len(rows)
+        paths = set(row['path'] for row in rows)
+        self.rows = collections.OrderedDict((row['path'], row) for row in rows)
+        self.dependents = collections.defaultdict(list)
+        self.unstored_references = {}
+        for path, row in self.rows.items():
+            references = set(_manifest_references(row, paths))
+            self.unstored_references[path] = len(references)
+            for reference in references:
+                self.dependents[reference].append(path)
+        self.ready = collections.deque(path for path, count in self.unstored_references.items() if count == 0)
+        self.unscheduled = self.total - len(self.ready)
+        self.failures = []
+        self.condition = threading.Condition()
+
+    def ready_rows(self):
+        while True:
+            with self.condition:
+                while not self.ready and self.unscheduled > 0:
+                    self.condition.wait()
+                if not self.ready:
+                    return
+                row = self.rows.pop(self.ready.popleft())
+            yield row
+
+    def store(self, row):
+        path = row['path']
+        try:
+            _store_manifest_row(self.syn, row)
+        except Exception as ex:
+            self.syn.logger.debug('Failed to store %s' % path, exc_info=True)
+            with self.condition:
+                self._fail(path, ex)
+                self.condition.notify_all()
+            return
+        with self.condition:
+            for dependent in self.dependents.pop(path, []):
+                self.unstored_references[dependent] -= 1
+                if self.unstored_references[dependent] == 0:
+                    self.ready.append(dependent)
+                    self.unscheduled -= 1
+            self.condition.notify_all()
+
+    def _fail(self, path, ex):
+        self.failures.append((path, ex))
+        ## nothing that references a file that was not stored can be stored either
+        for dependent in self.dependents.pop(path, []):
+            if dependent in self.rows and self.unstored_references[dependent] > 0:
+                self.unstored_references[dependent] = 0
+                self.unscheduled -= 1
+                del self.rows[dependent]
+                self._fail(dependent, SynapseProvenanceError('%s, which it references, could not be stored' % path))
+
+
+def _manifest_references(row, paths):
+    """Returns the paths of the files of the manifest that a row used or executed"""
+    references = []
+    for field in ('used', 'executed'):
+        if field in row:
+            references.extend(item for item in row[field]
+                              if isinstance(item, six.string_types) and item in paths)
+    return references
@@ -7,12 +7,15 @@ import six
 import re, os, tempfile, json
 import time, datetime, random
 from mock import MagicMock, patch
+from nose import SkipTest
 from nose.tools import assert_raises, assert_equal, assert_is_none, assert_is_not_none, assert_in, assert_false, assert_true
 from collections import OrderedDict
 from multiprocessing import Process
 
 import synapseclient
 import synapseclient.cache as cache
+import synapseclient.lock
+import synapseclient.cache_index as cache_index
 import synapseclient.utils as utils
 
 
@@ -298,4 +301,466 @@ def test_set_cache_root_dir():
 
     #test that manually assigning cache_root_dir expands the path
     my_cache.cache_root_dir = non_expanded_path + "2"
-    assert_equal(expanded_path + "2", my_cache.cache_root_dir)
\ No newline at end of file
+    assert_equal(expanded_path + "2", my_cache.cache_root_dir)
+
+def test_migrate_cache_maps():
+    tmp_dir = tempfile.mkdtemp()
+    path1 = utils.touch(os.path.join(tmp_dir, "file1.ext"))
+    cache_dir = os.path.join(tmp_dir, "201", "101201")
+    os.makedirs(cache_dir)
+    with open(os.path.join(cache_dir, ".cacheMap"), 'w') as f:
+        json.dump({utils.normalize_path(path1): cache.epoch_time_to_iso(cache._get_modified_time(path1))}, f)
+
+    my_cache = cache.Cache(cache_root_dir=tmp_dir)
+    assert_true(utils.equal_paths(my_cache.get(101201), path1))
+
+    ## the .cacheMap files are only imported once
+    my_cache.remove(101201)
+    assert_is_none(cache.Cache(cache_root_dir=tmp_dir).get(101201))
+
+
+def test_import_cache_maps_written_after_migration():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, write_cache_maps=False)
+    assert_is_none(my_cache.get(101201))
+
+    ## a client that doesn't use the index, such as the R client, caches a file
+    path1 = utils.touch(os.path.join(tmp_dir, "file1.ext"))
+    cache_dir = my_cache.get_cache_dir(101201)
+    os.makedirs(cache_dir)
+    cache_map_file = os.path.join(cache_dir, ".cacheMap")
+    with open(cache_map_file, 'w') as f:
+        json.dump({utils.normalize_path(path1): cache.epoch_time_to_iso(cache._get_modified_time(path1))}, f)
+    os.utime(cache_map_file, (time.time() + 10, time.time() + 10))
+    assert_true(utils.equal_paths(my_cache.get(101201), path1))
+
+    ## a .cacheMap that was already imported isn't imported again once its entries are removed
+    my_cache.remove(101201)
+    assert_is_none(my_cache.get(101201))
+
+
+def test_cache_index_journal_mode():
+    tmp_dir = tempfile.mkdtemp()
+    index = cache_index.CacheIndex(os.path.join(tmp_dir, cache_index.INDEX_FILENAME))
+    assert_equal('wal', index._connection().execute('PRAGMA journal_mode').fetchone()[0])
+    index.close()
+
+    ## write-ahead logging doesn't work on network file systems
+    with patch.object(cache_index, '_file_system_type', return_value='nfs4'):
+        index = cache_index.CacheIndex(os.path.join(tmp_dir, cache_index.INDEX_FILENAME))
+        assert_equal('delete', index._connection().execute('PRAGMA journal_mode').fetchone()[0])
+        index.close()
+
+
+def test_export_cache_maps():
+    tmp_dir = tempfile.mkdtemp()
+    ## by default the .cacheMap files are not written on every change
+    my_cache = cache.Cache(cache_root_dir=tmp_dir)
+    path1 = utils.touch(os.path.join(tmp_dir, "file1.ext"))
+    my_cache.add(101201, path1)
+    cache_map_file = os.path.join(my_cache.get_cache_dir(101201), ".cacheMap")
+    assert_false(os.path.exists(cache_map_file))
+
+    assert_equal(1, my_cache.export_cache_maps())
+    with open(cache_map_file) as f:
+        assert_equal(my_cache._read_cache_map(my_cache.get_cache_dir(101201)), json.load(f))
+
+    ## with write_cache_maps the .cacheMap files are kept up to date
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, write_cache_maps=True)
+    my_cache.remove(101201)
+    with open(cache_map_file) as f:
+        assert_equal({}, json.load(f))
+
+
+def test_cache_index_get_many():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir)
+    path1 = utils.touch(os.path.join(tmp_dir, "file1.ext"))
+    path2 = utils.touch(os.path.join(tmp_dir, "file2.ext"))
+    my_cache.add(101201, path1)
+    my_cache.add(101202, path2)
+
+    entries = my_cache._get_index().get_many([101201, 101202, 101203])
+    assert_equal([utils.normalize_path(path1)], list(entries[101201]))
+    assert_equal([utils.normalize_path(path2)], list(entries[101202]))
+    assert_equal({}, entries[101203])
+
+
+def test_cache_index_lookups_are_written_in_batches():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir)
+    path1 = utils.touch(os.path.join(tmp_dir, "file1.ext"))
+    my_cache.add(101201, path1)
+
+    index = my_cache._get_index()
+    with patch.object(index, '_transaction', wraps=index._transaction) as mock_transaction:
+        for i in range(10):
+            my_cache.get(101201)
+            my_cache.get(101202)
+        mock_transaction.assert_not_called()
+        stats = my_cache.stats()
+        mock_transaction.assert_called_once()
+    assert_equal((10, 10), (stats['hits'], stats['misses']))
+
+    with patch.object(cache_index, 'LOOKUP_BATCH_SIZE', 3):
+        my_cache.get(101201)
+        my_cache.get(101201)
+        assert_equal(10, index._connection().execute("SELECT value FROM counters WHERE key='hits'").fetchone()[0])
+        my_cache.get(101201)
+        assert_equal(13, index._connection().execute("SELECT value FROM counters WHERE key='hits'").fetchone()[0])
+
+
+def test_cache_index_keeps_sizes():
+    tmp_dir = tempfile.mkdtemp()
+    index = cache_index.CacheIndex(os.path.join(tmp_dir, cache_index.INDEX_FILENAME))
+
+    def sizes():
+        connection = index._connection()
+        return (index.cached_size(),
+                connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries').fetchone()[0],
+                dict(connection.execute('SELECT file_handle_id, size FROM file_handle_usage WHERE size > 0')))
+
+    index.add_many([(1, '/cache/1/a', 'T', 100), (1, '/elsewhere/a', 'T', None), (2, '/cache/2/b', 'T', 10)])
+    assert_equal((110, 110, {1: 100, 2: 10}), sizes())
+    ## replacing an entry counts its new size only
+    index.add(2, '/cache/2/b', 'T', 20)
+    index.replace(3, {'/cache/3/c': 'T'}, {'/cache/3/c': 5})
+    assert_equal((125, 125, {1: 100, 2: 20, 3: 5}), sizes())
+    index.remove(1, ['/cache/1/a'])
+    index.remove(2)
+    assert_equal((5, 5, {3: 5}), sizes())
+
+    ## an index written before the sizes were kept is counted once when it's opened
+    connection = index._connection()
+    connection.execute("DELETE FROM metadata WHERE key='sizes_counted'")
+    connection.execute("DELETE FROM counters")
+    connection.execute("UPDATE file_handle_usage SET size=NULL")
+    index.close()
+    index = cache_index.CacheIndex(os.path.join(tmp_dir, cache_index.INDEX_FILENAME))
+    assert_equal((5, 5, {3: 5}), sizes())
+    index.close()
+
+
+def test_cache_index_eviction_candidates_in_batches():
+    tmp_dir = tempfile.mkdtemp()
+    index = cache_index.CacheIndex(os.path.join(tmp_dir, cache_index.INDEX_FILENAME))
+    for i in range(7):
+        index.add(i, '/cache/%d' % i, 'T', 10 + i)
+    index.add(7, '/elsewhere/7', 'T')
+    ## file handles added in the same transaction were last used at the same time
+    index.add_many([(8, '/cache/8', 'T', 1), (9, '/cache/9', 'T', 1)])
+    index.record_lookups([3, 3, 5])
+
+    for row_values in (True, False):
+        with patch.object(cache_index, '_ROW_VALUES', row_values):
+            for policy in ('lru', 'lfu'):
+                expected = list(index.eviction_candidates(policy, batch_size=100))
+                assert_equal(expected, list(index.eviction_candidates(policy, batch_size=2)))
+            assert_equal([0, 1, 2, 4, 6, 8, 9, 5, 3], [c[0] for c in index.eviction_candidates('lfu', batch_size=2)])
+            assert_equal([0, 1, 2, 4, 6, 8, 9, 3, 5], [c[0] for c in index.eviction_candidates('lru', batch_size=2)])
+
+    ## file handles removed while the candidates are read are left out of the batches read after
+    candidates = index.eviction_candidates('lru', batch_size=2)
+    assert_equal((0, 10), next(candidates))
+    index.remove(2)
+    index.remove(4, ['/cache/4'])
+    assert_equal([1, 6, 8, 9, 3, 5], [c[0] for c in candidates])
+    index.close()
+
+
+def _write_file(path, size):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_parse_size():
+    assert_equal(100, cache.parse_size('100'))
+    assert_equal(500 * 2**30, cache.parse_size('500GB'))
+    assert_equal(int(1.5 * 2**40), cache.parse_size('1.5 tb'))
+    assert_raises(ValueError, cache.parse_size, '12 parsecs')
+    assert_raises(ValueError, cache.Cache, tempfile.mkdtemp(), eviction_policy='fifo')
+
+
+def test_evict__lru():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, max_size=250)
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    path2 = _write_file(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"), 100)
+    ## a copy outside of the cache root is never evicted and doesn't count towards max_size
+    outside = _write_file(os.path.join(tempfile.mkdtemp(), "file1.ext"), 1000)
+    my_cache.add(101201, path1)
+    my_cache.add(101201, outside)
+    my_cache.add(101202, path2)
+
+    ## file 1 was used more recently than file 2
+    assert_true(utils.equal_paths(path1, my_cache.get(101201, path1)))
+    path3 = _write_file(os.path.join(my_cache.get_cache_dir(101203), "file3.ext"), 100)
+    my_cache.add(101203, path3)
+
+    assert_false(os.path.exists(path2))
+    assert_is_none(my_cache.get(101202))
+    assert_true(os.path.exists(path1))
+    assert_true(os.path.exists(outside))
+    assert_true(os.path.exists(path3))
+    assert_equal(200, my_cache.stats()['size'])
+
+    ## only the copy in the cache root is evicted
+    assert_equal([101201], my_cache.evict(max_size=100))
+    assert_false(os.path.exists(path1))
+    assert_true(utils.equal_paths(outside, my_cache.get(101201)))
+
+
+def test_evict__lfu():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, max_size=250, eviction_policy='lfu')
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    path2 = _write_file(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"), 100)
+    my_cache.add(101201, path1)
+    my_cache.add(101202, path2)
+    my_cache.get(101201)
+    my_cache.get(101201)
+    my_cache.get(101202)
+
+    path3 = _write_file(os.path.join(my_cache.get_cache_dir(101203), "file3.ext"), 100)
+    my_cache.add(101203, path3)
+    assert_true(os.path.exists(path1))
+    assert_false(os.path.exists(path2))
+
+
+def test_evict__skips_pinned_file_handles():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, max_size=150)
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    my_cache.add(101201, path1)
+
+    with my_cache.pin(101201):
+        path2 = _write_file(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"), 100)
+        my_cache.add(101202, path2)
+        assert_true(os.path.exists(path1))
+
+    assert_equal([101201], my_cache.evict())
+    assert_false(os.path.exists(path1))
+    assert_true(os.path.exists(path2))
+
+
+def test_evict_and_purge__skip_file_handles_linked_from_outside():
+    if not hasattr(os, 'symlink'):
+        raise SkipTest("symbolic links are not supported on this platform")
+    tmp_dir = tempfile.mkdtemp()
+    download_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, write_cache_maps=False)
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    path2 = _write_file(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"), 100)
+    my_cache.add(101201, path1)
+    my_cache.add(101202, path2)
+    ## a download of the first file elsewhere with link_mode = symlink
+    link = os.path.join(download_dir, "file1.ext")
+    os.symlink(path1, link)
+    my_cache.add(101201, link)
+
+    assert_equal([101202], my_cache.evict(max_size=0))
+    assert_true(os.path.exists(link))
+    ## only the emptied cache directory of the evicted file handle is purged
+    assert_equal((1, 0, 1), _purge_counts(my_cache.purge(time.time() + 1)))
+    assert_true(os.path.exists(link))
+
+    ## once the link is gone the file handle can be evicted
+    os.remove(link)
+    assert_equal([101201], my_cache.evict(max_size=0))
+    assert_false(os.path.exists(path1))
+
+
+def test_pin():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, max_size=150)
+    ## pinning a file handle that has nothing in the cache root directory doesn't create its cache directory
+    with my_cache.pin(101201):
+        assert_false(os.path.exists(my_cache.get_cache_dir(101201)))
+
+    ## without flock a pin only keeps this process from evicting the files
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    my_cache.add(101201, path1)
+    with patch.object(synapseclient.lock, 'fcntl', None):
+        with my_cache.pin(101201):
+            with my_cache.pin(101201):
+                pass
+            path2 = _write_file(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"), 100)
+            my_cache.add(101202, path2)
+            assert_true(os.path.exists(path1))
+        assert_equal([101201], my_cache.evict())
+    assert_false(os.path.exists(path1))
+
+
+def test_stats():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir)
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 10)
+    my_cache.add(101201, path1)
+    my_cache.get(101201)
+    my_cache.get(101202)
+    my_cache.get(101203)
+
+    assert_equal({'file_handles': 1, 'files': 1, 'size': 10, 'hits': 1, 'misses': 2}, my_cache.stats())
+
+
+def test_get_many_add_many():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir)
+    path1 = utils.touch(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"))
+    path2 = utils.touch(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"))
+    download_dir = tempfile.mkdtemp()
+    path3 = utils.touch(os.path.join(download_dir, "file1.ext"))
+
+    cache_maps = my_cache.add_many([(101201, path1), ('101202', path2), (101201, path3)])
+    assert_equal(set(['101201', '101202']), set(cache_maps))
+    assert_equal(2, len(cache_maps['101201']))
+
+    cached = my_cache.get_many([101201, '101202', 101203])
+    assert_equal(set([101201, '101202', 101203]), set(cached))
+    assert_in(cached[101201], [utils.normalize_path(path1), utils.normalize_path(path3)])
+    assert_true(utils.equal_paths(path2, cached['101202']))
+    assert_is_none(cached[101203])
+
+    ## looking in a directory works as it does for get
+    cached = my_cache.get_many([101201, 101202], download_dir)
+    assert_true(utils.equal_paths(path3, cached[101201]))
+    assert_true(utils.equal_paths(path2, cached[101202]))
+    stats = my_cache.stats()
+    assert_equal((4, 1), (stats['hits'], stats['misses']))
+
+
+def _purge_counts(result):
+    ## a purge returns the number of file handles it purged, with the details as attributes
+    assert_true(isinstance(result, int))
+    return result, result.bytes, result.skipped
+
+
+def test_purge():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, write_cache_maps=False)
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    path2 = _write_file(os.path.join(my_cache.get_cache_dir(102202), "file2.ext"), 10)
+    my_cache.add(101201, path1)
+    my_cache.add(102202, path2)
+    ## a cache directory that isn't in the index
+    orphan = _write_file(os.path.join(my_cache.get_cache_dir(103203), "file3.ext"), 1)
+    before_date = time.time()
+    time.sleep(0.01)
+    path4 = _write_file(os.path.join(my_cache.get_cache_dir(104201), "file4.ext"), 1000)
+    my_cache.add(104201, path4)
+
+    with my_cache.pin(102202):
+        assert_equal((2, 101, 1), _purge_counts(my_cache.purge(before_date, dry_run=True)))
+        assert_true(os.path.exists(path1))
+        assert_equal((2, 101, 1), _purge_counts(my_cache.purge(before_date)))
+
+    assert_false(os.path.exists(my_cache.get_cache_dir(101201)))
+    assert_false(os.path.exists(os.path.dirname(orphan)))
+    assert_is_none(my_cache.get(101201))
+    assert_true(utils.equal_paths(path2, my_cache.get(102202)))
+    assert_true(utils.equal_paths(path4, my_cache.get(104201)))
+    assert_raises(ValueError, my_cache.purge)
+
+
+def test_purge__resumes():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, write_cache_maps=False)
+    path1 = _write_file(os.path.join(my_cache.get_cache_dir(101201), "file1.ext"), 100)
+    path2 = _write_file(os.path.join(my_cache.get_cache_dir(101202), "file2.ext"), 10)
+    my_cache.add(101201, path1)
+    my_cache.add(101202, path2)
+    before_date = time.time() + 1
+
+    ## an earlier purge with the same date was interrupted after it finished bucket 201
+    my_cache._get_index().mark_purged('before %r' % before_date, 201)
+    assert_equal((1, 10, 0), _purge_counts(my_cache.purge(before_date)))
+    assert_true(os.path.exists(path1))
+    assert_false(os.path.exists(path2))
+
+    ## a completed purge doesn't leave any progress behind
+    assert_equal((1, 100, 0), _purge_counts(my_cache.purge(before_date)))
+    assert_false(os.path.exists(path1))
+
+
+def test_purge__target_size():
+    tmp_dir = tempfile.mkdtemp()
+    my_cache = cache.Cache(cache_root_dir=tmp_dir, write_cache_maps=False)
+    paths = []
+    for i in range(5):
+        paths.append(_write_file(os.path.join(my_cache.get_cache_dir(101200 + i), "file.ext"), 100))
+        my_cache.add(101200 + i, paths[i])
+    ## the first file is the most recently used
+    my_cache.get(101200)
+
+    assert_equal((3, 300, 0), _purge_counts(my_cache.purge(target_size=250, dry_run=True)))
+    assert_equal((3, 300, 0), _purge_counts(my_cache.purge(target_size=250, max_threads=2)))
+    assert_equal([True, False, False, False, True], [os.path.exists(path) for path in paths])
+    assert_equal(200, my_cache.stats()['size'])
+
+
+def test_read_only_tiers():
+    ## a shared cache populated by another client
+    shared_dir = tempfile.mkdtemp()
+    shared_cache = cache.Cache(cache_root_dir=shared_dir)
+    shared_path = utils.touch(os.path.join(shared_cache.get_cache_dir(101201), "file1.ext"))
+    shared_cache.add(101201, shared_path)
+    ## and one that only has .cacheMap files
+    old_shared_dir = tempfile.mkdtemp()
+    old_shared_path = utils.touch(os.path.join(old_shared_dir, "202", "101202", "file2.ext"))
+    with open(os.path.join(old_shared_dir, "202", "101202", ".cacheMap"), 'w') as f:
+        json.dump({utils.normalize_path(old_shared_path):
+                   cache.epoch_time_to_iso(cache._get_modified_time(old_shared_path))}, f)
+
+    my_cache = cache.Cache(cache_root_dir=tempfile.mkdtemp(), read_only_cache_root_dirs=[shared_dir, old_shared_dir])
+    assert_true(utils.equal_paths(shared_path, my_cache.get(101201)))
+    assert_true(utils.equal_paths(old_shared_path, my_cache.get(101202)))
+    assert_true(my_cache.contains(101201, shared_path))
+    cached = my_cache.get_many([101201, 101202, 101203])
+    assert_true(utils.equal_paths(shared_path, cached[101201]))
+    assert_true(utils.equal_paths(old_shared_path, cached[101202]))
+    assert_is_none(cached[101203])
+
+    ## a copy in the download location is preferred over one in an earlier tier
+    download_dir = tempfile.mkdtemp()
+    local_path = utils.touch(os.path.join(download_dir, "file1.ext"))
+    my_cache.add(101201, local_path)
+    assert_true(utils.equal_paths(local_path, my_cache.get(101201, download_dir)))
+    assert_true(utils.equal_paths(shared_path, my_cache.get(101201)))
+
+    ## files are only added to and removed from the writable tier
+    assert_equal([utils.normalize_path(local_path)], my_cache.remove(101201))
+    assert_true(utils.equal_paths(shared_path, shared_cache.get(101201)))
+    new_time_stamp = cache._get_modified_time(shared_path) + 1
+    utils.touch(shared_path, (new_time_stamp, new_time_stamp))
+    assert_is_none(my_cache.get(101201, os.path.dirname(shared_path)))
+    assert_equal(1, len(shared_cache._read_cache_map(shared_cache.get_cache_dir(101201))))
+
+
+def test_without_sqlite3():
+    ## the cached paths are kept only in the .cacheMap files
+    tmp_dir = tempfile.mkdtemp()
+    with patch.object(cache, 'sqlite3', None):
+        my_cache = cache.Cache(cache_root_dir=tmp_dir, max_size=250)
+        paths = []
+        for i in range(3):
+            paths.append(_write_file(os.path.join(my_cache.get_cache_dir(101201 + i), "file.ext"), 100))
+            my_cache.add(101201 + i, paths[i])
+            time.sleep(0.01)
+        assert_false(os.path.exists(os.path.join(tmp_dir, cache_index.INDEX_FILENAME)))
+        with open(os.path.join(my_cache.get_cache_dir(101202), ".cacheMap")) as f:
+            assert_equal([utils.normalize_path(paths[1])], list(json.load(f)))
+
+        ## the file handle cached first was evicted
+        assert_is_none(my_cache.get(101201))
+        assert_true(utils.equal_paths(paths[1], my_cache.get(101202)))
+        assert_equal(200, my_cache.stats()['size'])
+
+        assert_equal([utils.normalize_path(paths[1])], my_cache.remove(101202))
+        assert_is_none(my_cache.get(101202))
+        ## the emptied cache directories are purged as well
+        assert_equal(3, my_cache.purge(time.time() + 1).file_handles)
+        assert_equal([], list(my_cache._cache_dirs()))
+        assert_is_none(my_cache.get(101203))
@@ -0,0 +1,157 @@
+import json
+
+import unit
+from mock import patch, call, MagicMock
+from nose import SkipTest
+from nose.tools import assert_equals, assert_raises
+
+try:
+    import asyncio
+    from synapseclient.aio import AsyncSynapse
+    from synapseclient.aio import multipart_upload as aio_multipart_upload
+    from synapseclient.aio.client import _Response
+except (ImportError, SyntaxError):
+    asyncio = None
+
+from synapseclient.exceptions import SynapseHTTPError
+from synapseclient.utils import MB
+
+
+def setup(module):
+    if asyncio is None:
+        raise SkipTest("The asyncio client requires Python 3.5 or newer")
+    module.syn = unit.syn
+
+
+def _json_response(body, status_code=200):
+    return _Response(status_code, 'OK' if status_code == 200 else 'Error',
+                     {'content-type': 'application/json'}, json.dumps(body).encode('utf-8'))
+
+
+def _completed(loop, result):
+    future = loop.create_future()
+    future.set_result(result)
+    return future
+
+
+class TestAsyncSynapse:
+
+    def setup(self):
+        self.loop = asyncio.new_event_loop()
+        self.asyn = AsyncSynapse(syn)
+        self.signing = patch.object(syn, '_generateSignedHeaders', return_value={'signed': 'yes'})
+        self.signing.start()
+
+    def teardown(self):
+        self.signing.stop()
+        self.loop.close()
+
+    def _mock_send(self, *responses):
+        return patch.object(self.asyn, '_send',
+                            new=MagicMock(side_effect=[_completed(self.loop, response) for response in responses]))
+
+    def test_restGET(self):
+        with self._mock_send(_json_response({'id': 'syn123'})) as mock_send:
+            result = self.loop.run_until_complete(self.asyn.restGET('/entity/syn123'))
+        assert_equals({'id': 'syn123'}, result)
+        mock_send.assert_called_once_with('GET', syn.repoEndpoint + '/entity/syn123',
+                                          headers={'signed': 'yes'}, data=None)
+
+    def test_restPOST__retries(self):
+        responses = (_json_response({'reason': 'busy'}, 503), _json_response({'id': 'syn123'}))
+        with self._mock_send(*responses) as mock_send, \
+                patch('synapseclient.aio.retry.asyncio.sleep', new=MagicMock(side_effect=lambda s: _completed(self.loop, None))):
+            result = self.loop.run_until_complete(self.asyn.restPOST('/entity', body='{}'))
+        assert_equals({'id': 'syn123'}, result)
+        assert_equals(2, mock_send.call_count)
+
+    def test_restGET__error(self):
+        with self._mock_send(_json_response({'reason': 'not found'}, 404)):
+            assert_raises(SynapseHTTPError, self.loop.run_until_complete, self.asyn.restGET('/entity/syn0'))
+
+    def test_getChildren(self):
+        pages = (_json_response({'page': [{'id': 'syn1'}], 'nextPageToken': 'abc'}),
+                 _json_response({'page': [{'id': 'syn2'}]}))
+        with self._mock_send(*pages) as mock_send:
+            children = self.loop.run_until_complete(self.asyn.getChildren('syn123'))
+        assert_equals([{'id': 'syn1'}, {'id': 'syn2'}], children)
+        assert_equals('abc', json.loads(mock_send.call_args[1]['data'])['nextPageToken'])
+
+    def test_tableQuery__rowset(self):
+        headers = [{'name': 'x', 'columnType': 'INTEGER'}]
+        first_page = {'queryResult': {'queryResults': {'tableId': 'syn5', 'headers': headers,
+                                                       'rows': [{'rowId': 1, 'versionNumber': 1, 'values': ['1']}]},
+                                      'nextPageToken': {'token': 'next'}}}
+        second_page = {'queryResults': {'tableId': 'syn5', 'headers': headers,
+                                        'rows': [{'rowId': 2, 'versionNumber': 1, 'values': ['2']}]}}
+        mock_wait = MagicMock(side_effect=[_completed(self.loop, first_page), _completed(self.loop, second_page)])
+        with patch.object(self.asyn, '_waitForAsync', new=mock_wait):
+            rowset = self.loop.run_until_complete(self.asyn.tableQuery('select x from syn5', resultsAs='rowset'))
+        assert_equals([[1], [2]], [row['values'] for row in rowset.rows])
+        mock_wait.assert_called_with(uri='/entity/syn5/table/query/nextPage/async', request={'token': 'next'})
+
+    def test_multipart_upload(self):
+        fileSize = 20*MB
+        chunks = {1: b'a' * 8*MB, 2: b'b' * 8*MB, 3: b'c' * 4*MB}
+        statuses = [{'uploadId': '7', 'partsState': '000', 'state': 'UPLOADING'},
+                    {'uploadId': '7', 'partsState': '111', 'state': 'UPLOADING'}]
+        presigned_urls = {'partPresignedUrls': [{'partNumber': n, 'uploadPresignedUrl': 'https://s3/%d' % n}
+                                                for n in (1, 2, 3)]}
+
+        def restPOST(uri, body, endpoint=None):
+            return _completed(self.loop, statuses.pop(0) if uri.startswith('/file/multipart?') else presigned_urls)
+
+        def restPUT(uri, body=None, endpoint=None):
+            if uri.endswith('/complete'):
+                return _completed(self.loop, {'uploadId': '7', 'state': 'COMPLETED', 'resultFileHandleId': '42'})
+            return _completed(self.loop, {'addPartState': 'ADD_SUCCESS'})
+
+        mock_put = MagicMock(side_effect=restPUT)
+        mock_put_part = MagicMock(side_effect=lambda url, chunk: _completed(self.loop, None))
+        with patch.object(self.asyn, 'restPOST', new=MagicMock(side_effect=restPOST)), \
+                patch.object(self.asyn, 'restPUT', new=mock_put), \
+                patch.object(self.asyn, '_put_part', new=mock_put_part), \
+                patch('synapseclient.multipart_upload.printTransferProgress'):
+            status = self.loop.run_until_complete(aio_multipart_upload._multipart_upload(
+                self.asyn, 'data.bin', 'application/octet-stream', get_chunk_function=lambda n, partSize: chunks[n],
+                md5='abc', fileSize=fileSize))
+
+        assert_equals('42', status['resultFileHandleId'])
+        assert_equals(sorted(call('https://s3/%d' % n, chunks[n]) for n in (1, 2, 3)),
+                      sorted(mock_put_part.call_args_list))
+        mock_put.assert_called_with('/file/multipart/7/complete', endpoint=syn.fileHandleEndpoint)
+
+    def test_multipart_upload__adaptive_part_size(self):
+        chunks = {1: b'a' * 10*MB, 2: b'b' * 10*MB}
+        statuses = [{'uploadId': '7', 'partsState': '00', 'state': 'UPLOADING'},
+                    {'uploadId': '7', 'partsState': '11', 'state': 'UPLOADING'}]
+        bodies = []
+
+        def restPOST(uri, body, endpoint=None):
+            if uri.startswith('/file/multipart?'):
+                bodies.append(json.loads(body))
+                return _completed(self.loop, statuses.pop(0))
+            return _completed(self.loop, {'partPresignedUrls': [{'partNumber': n, 'uploadPresignedUrl': 'https://s3/%d' % n}
+                                                                for n in json.loads(body)['partNumbers']]})
+
+        def restPUT(uri, body=None, endpoint=None):
+            if uri.endswith('/complete'):
+                return _completed(self.loop, {'uploadId': '7', 'state': 'COMPLETED', 'resultFileHandleId': '42'})
+            return _completed(self.loop, {'addPartState': 'ADD_SUCCESS'})
+
+        monitor = MagicMock(rtt=0.3, throughput=10*MB, failure_rate=0.0)
+        monitor.recommend.return_value = (10*MB, 2)
+        with patch.object(syn, 'adaptive_part_size', True), \
+                patch.object(syn, '_throughput_monitor', monitor), \
+                patch.object(self.asyn, 'restPOST', new=MagicMock(side_effect=restPOST)), \
+                patch.object(self.asyn, 'restPUT', new=MagicMock(side_effect=restPUT)), \
+                patch.object(self.asyn, '_put_part', new=MagicMock(side_effect=lambda url, chunk: _completed(self.loop, None))), \
+                patch('synapseclient.multipart_upload.printTransferProgress'):
+            status = self.loop.run_until_complete(aio_multipart_upload._multipart_upload(
+                self.asyn, 'data.bin', 'application/octet-stream', get_chunk_function=lambda n, partSize: chunks[n],
+                md5='abc', fileSize=20*MB))
+
+        assert_equals('42', status['resultFileHandleId'])
+        assert_equals([10*MB, 10*MB], [body['partSizeBytes'] for body in bodies])
+        assert_equals(2, monitor.record_transfer.call_count)
+        assert_equals(2, monitor.record_request.call_count)
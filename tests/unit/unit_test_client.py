@@ -112,13 +112,10 @@ def test_getWithEntityBundle(download_file_mock, get_file_URL_and_metadata_mock)
         'annotations': {}}
 
     fileHandle = bundle['fileHandles'][0]['id']
-    cacheDir = syn.cache.get_cache_dir(fileHandle)
-    # Make sure the .cacheMap file does not already exist
-    cacheMap = os.path.join(cacheDir, '.cacheMap')
-    if os.path.exists(cacheMap):
-        os.remove(cacheMap)
+    # Make sure the file handle is not already cached
+    syn.cache.remove(fileHandle)
 
-    def _downloadFileHandle(fileHandleId,  objectId, objectType, path, retries=5):
+    def _downloadFileHandle(fileHandleId,  objectId, objectType, path, retries=5, fileResult=None):
         ## touch file at path
         with open(path, 'a'):
             os.utime(path, None)
@@ -271,6 +268,51 @@ def test__uploadExternallyStoringProjects_external_user(mock_upload_destination)
         #test
 
 
+@patch("synapseclient.Synapse._getDefaultUploadDestination")
+def test_upload_file_handle__dedupe(mock_upload_destination):
+    mock_upload_destination.return_value = {'storageLocationId': 1,
+                                            'concreteType': concrete_types.SYNAPSE_S3_UPLOAD_DESTINATION}
+    copied_file_handle = {'id': '99'}
+    with patch.object(upload_functions, "copy_matching_file_handle", return_value=copied_file_handle) as mocked_copy, \
+         patch.object(upload_functions, "multipart_upload") as mocked_multipart_upload:
+        assert_equal(copied_file_handle, upload_functions.upload_file_handle(syn, 'syn12345', '/data/file.txt',
+                                                                             md5='abc', dedupe=True))
+        mocked_copy.assert_called_once_with(syn, '/data/file.txt', 1, md5='abc', mimetype=None)
+        assert not mocked_multipart_upload.called
+
+
+def test_copy_matching_file_handle():
+    fd, path = tempfile.mkstemp()
+    os.write(fd, b'some content')
+    os.close(fd)
+
+    def file_handle(id, size=12, storageLocationId=1):
+        return {'id': id, 'contentMd5': 'abc', 'contentSize': size, 'storageLocationId': storageLocationId,
+                'contentType': 'text/plain'}
+    bundles = {'syn1': {'entity': {'id': 'syn1', 'dataFileHandleId': '1'}, 'fileHandles': [file_handle('1', size=5)]},
+               'syn2': {'entity': {'id': 'syn2', 'dataFileHandleId': '2'},
+                        'fileHandles': [file_handle('2', storageLocationId=7)]},
+               'syn3': {'entity': {'id': 'syn3', 'dataFileHandleId': '3'}, 'fileHandles': [file_handle('3')]},
+               'syn4': {'entity': {'id': 'syn4', 'dataFileHandleId': '4'}, 'fileHandles': [file_handle('4')]}}
+    copy_results = [{'copyResults': [{'originalFileHandleId': '3', 'failureCode': 'UNAUTHORIZED'}]},
+                    {'copyResults': [{'originalFileHandleId': '4', 'newFileHandle': {'id': '44'}}]}]
+    try:
+        with patch.object(syn, "md5Query", return_value=[{'id': id, 'versionNumber': 1} for id in sorted(bundles)]), \
+             patch.object(syn, "_getEntityBundle", side_effect=lambda id, version, bitFlags: bundles[id]), \
+             patch.object(syn, "restPOST", side_effect=copy_results) as mocked_post, \
+             patch.object(syn.cache, "add") as mocked_cache_add:
+            new_file_handle = upload_functions.copy_matching_file_handle(syn, path, 1, md5='abc')
+
+        # the files of another size or storage location are skipped, the copy that isn't allowed is passed over
+        assert_equal({'id': '44'}, new_file_handle)
+        copied = [json.loads(c[1]['body'])['copyRequests'][0]['originalFile'] for c in mocked_post.call_args_list]
+        assert_equal([{'fileHandleId': '3', 'associateObjectId': 'syn3', 'associateObjectType': 'FileEntity'},
+                      {'fileHandleId': '4', 'associateObjectId': 'syn4', 'associateObjectType': 'FileEntity'}], copied)
+        mocked_cache_add.assert_called_once_with('44', path)
+    finally:
+        os.remove(path)
+
+
 def test_findEntityIdByNameAndParent__None_parent():
     entity_name = "Kappa 123"
     expected_uri = "/entity/child"
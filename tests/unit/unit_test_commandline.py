@@ -18,11 +18,11 @@ import uuid
 import json
 import time
 from nose.plugins.attrib import attr
-from nose.tools import assert_raises, assert_equals, assert_less
+from nose.tools import assert_raises, assert_equals, assert_less, assert_in
 import tempfile
 import shutil
 import unit
-from mock import patch
+from mock import patch, MagicMock
 
 try:
     import ConfigParser
@@ -71,3 +71,78 @@ def test_command_sync():
                                                     dryRun=args.dryRun,
                                                     sendMessages=args.sendMessages,
                                                     retries=args.retries)
+
+
+def test_command_cat():
+    parser = cmdline.build_parser()
+    args = parser.parse_args(['cat', 'syn123', '-v', '2'])
+    stdout = MagicMock(buffer=six.BytesIO())
+
+    with patch.object(syn, "open", return_value=six.BytesIO(b'line 1\nline 2\n')) as mock_open,\
+         patch.object(sys, "stdout", stdout):
+        cmdline.cat(args, syn)
+    mock_open.assert_called_once_with('syn123', version=2)
+    assert_equals(b'line 1\nline 2\n', stdout.buffer.getvalue())
+
+
+def test_command_cat__falls_back_to_download():
+    parser = cmdline.build_parser()
+    args = parser.parse_args(['cat', 'syn123'])
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'file.txt')
+    with open(path, 'wb') as f:
+        f.write(b'line 1\nline 2\n')
+    entity = synapseclient.File(path, parent='syn456')
+
+    for error in (synapseclient.remote_file.RemoteReadNotSupportedError("sftp"),
+                  synapseclient.multipart_download.RangeNotSupportedError("200")):
+        stdout = MagicMock(buffer=six.BytesIO())
+        with patch.object(syn, "open", side_effect=error),\
+             patch.object(syn, "get", return_value=entity) as mock_get,\
+             patch.object(sys, "stdout", stdout):
+            cmdline.cat(args, syn)
+        mock_get.assert_called_once_with('syn123', version=None)
+        assert_equals(b'line 1\nline 2\n', stdout.buffer.getvalue())
+    shutil.rmtree(tmp_dir)
+
+
+def test_command_store__stdin():
+    parser = cmdline.build_parser()
+    args = parser.parse_args(['store', '-', '--parentid', 'syn123', '--name', 'out.txt'])
+    stdin = MagicMock(buffer=six.BytesIO(b'some data'))
+    location = {'concreteType': synapseclient.constants.concrete_types.SYNAPSE_S3_UPLOAD_DESTINATION,
+                'storageLocationId': 1}
+
+    with patch.object(sys, "stdin", stdin), \
+         patch.object(syn, "_getDefaultUploadDestination", return_value=location), \
+         patch.object(cmdline, "multipart_upload_stream", return_value='42') as mock_upload, \
+         patch.object(syn, "store", return_value={'id': 'syn456', 'name': 'out.txt'}) as mock_store:
+        cmdline.store(args, syn)
+
+    mock_upload.assert_called_once_with(syn, stdin.buffer if six.PY3 else stdin, 'out.txt', storageLocationId=1)
+    entity = mock_store.call_args[0][0]
+    assert_equals('42', entity['dataFileHandleId'])
+    assert_equals(None, entity['path'])
+    assert_equals('syn123', entity['parentId'])
+
+
+def test_command_store__stdin_requires_name():
+    parser = cmdline.build_parser()
+    args = parser.parse_args(['store', '-', '--parentid', 'syn123'])
+    assert_raises(ValueError, cmdline.store, args, syn)
+
+
+def test_command_cache():
+    parser = cmdline.build_parser()
+    args = parser.parse_args(['cache'])
+    stats = {'file_handles': 2, 'files': 3, 'size': 2048, 'hits': 3, 'misses': 1}
+
+    with patch.object(syn.cache, "stats", return_value=stats), \
+         patch.object(sys, "stdout", new_callable=StringIO) as stdout:
+        cmdline.cache(args, syn)
+    assert_in("Size:           2.0kB", stdout.getvalue())
+    assert_in("Hit rate:       75.0%", stdout.getvalue())
+
+    args = parser.parse_args(['cache', '--evict'])
+    with patch.object(syn.cache, "max_size", None):
+        assert_raises(ValueError, cmdline.cache, args, syn)
@@ -4,12 +4,13 @@ from builtins import str
 
 import requests
 import synapseclient
-import tempfile, os, hashlib
+import tempfile, os, hashlib, json, shutil
 import unit
 from mock import MagicMock, patch, mock_open, call
 from nose.tools import assert_raises, assert_equals, assert_false
 from synapseclient.exceptions import SynapseHTTPError, SynapseMd5MismatchError, SynapseError, SynapseFileNotFoundError
 import synapseclient.constants.concrete_types as concrete_types
+import synapseclient.utils as utils
 
 
 
@@ -361,6 +362,30 @@ def test_download_file_entity__correct_local_state():
         assert_equals(os.path.basename(mock_cache_path), file_entity.files[0])
 
 
+def test_download_file_entity__links_cached_file():
+    cache_dir = tempfile.mkdtemp()
+    download_dir = tempfile.mkdtemp()
+    try:
+        cached_file_path = os.path.join(cache_dir, 'file.txt')
+        with open(cached_file_path, 'w') as f:
+            f.write('cached content')
+        file_entity = synapseclient.File(parentId="syn123")
+        file_entity.dataFileHandleId = 123
+        with patch.object(syn.cache, 'get', return_value=cached_file_path),\
+             patch.object(syn.cache, 'add') as mocked_cache_add,\
+             patch.object(syn, 'link_mode', 'hardlink'),\
+             patch.object(utils, 'link_or_copy_file', wraps=utils.link_or_copy_file) as mocked_link:
+            syn._download_file_entity(downloadLocation=download_dir, entity=file_entity,
+                                      ifcollision="overwrite.local", submission=None)
+        download_path = utils.normalize_path(os.path.join(download_dir, 'file.txt'))
+        mocked_link.assert_called_once_with(cached_file_path, download_path, 'hardlink')
+        mocked_cache_add.assert_called_once_with(123, download_path)
+        assert_equals(download_path, file_entity.path)
+    finally:
+        shutil.rmtree(cache_dir)
+        shutil.rmtree(download_dir)
+
+
 def test_getFileHandleDownload__error_UNAUTHORIZED():
     ret_val = {'requestedFiles': [{'failureCode': 'UNAUTHORIZED',}]}
     with patch.object(syn, "restPOST", return_value=ret_val):
@@ -369,4 +394,56 @@ def test_getFileHandleDownload__error_UNAUTHORIZED():
 def test_getFileHandleDownload__error_NOT_FOUND():
     ret_val = {'requestedFiles': [{'failureCode': 'NOT_FOUND',}]}
     with patch.object(syn, "restPOST", return_value=ret_val):
-        assert_raises(SynapseFileNotFoundError, syn._getFileHandleDownload, '123', 'syn456')
\ No newline at end of file
+        assert_raises(SynapseFileNotFoundError, syn._getFileHandleDownload, '123', 'syn456')
+
+def test_getFileHandleDownloads__batches_requests():
+    associations = [{'fileHandleId': str(i), 'associateObjectId': 'syn456', 'associateObjectType': 'FileEntity'}
+                    for i in range(250)]
+
+    def mock_restPOST(uri, body, endpoint=None):
+        requested = json.loads(body)['requestedFiles']
+        return {'requestedFiles': [{'fileHandleId': r['fileHandleId'], 'preSignedURL': 'https://fake.url/' + r['fileHandleId']}
+                                   for r in requested]}
+
+    with patch.object(syn, "restPOST", side_effect=mock_restPOST) as mocked_restPOST:
+        results = syn.getFileHandleDownloads(associations)
+
+    assert_equals(3, mocked_restPOST.call_count)
+    assert_equals([str(i) for i in range(250)], [result['fileHandleId'] for result in results])
+
+
+def test_getFileHandleDownloads__reuses_unexpired_urls():
+    url = 'https://bucket.s3.amazonaws.com/key?X-Amz-Date=20180102T030405Z&X-Amz-Expires=900'
+    associations = [{'fileHandleId': str(i), 'associateObjectId': 'syn%d' % i, 'associateObjectType': 'FileEntity'}
+                    for i in range(3)]
+
+    def mock_restPOST(uri, body, endpoint=None):
+        return {'requestedFiles': [{'fileHandleId': f['fileHandleId'], 'preSignedURL': url}
+                                   for f in json.loads(body)['requestedFiles']]}
+
+    syn._presigned_url_cache.clear()
+    signed_at = utils.to_unix_epoch_time_secs(utils.iso_to_datetime('2018-01-02T03:04:05.000Z'))
+    with patch.object(syn, 'restPOST', side_effect=mock_restPOST) as mocked_POST,\
+         patch('time.time', return_value=signed_at):
+        syn.getFileHandleDownloads(associations[:2])
+        results = syn.getFileHandleDownloads(associations)
+        syn._getFileHandleDownload('0', 'syn0', refresh=True)
+    syn._presigned_url_cache.clear()
+
+    assert_equals(['0', '1', '2'], [r['fileHandleId'] for r in results])
+    requested = [[f['fileHandleId'] for f in json.loads(c[1]['body'])['requestedFiles']]
+                 for c in mocked_POST.call_args_list]
+    assert_equals([['0', '1'], ['2'], ['0']], requested)
+
+
+def test_downloadFileHandle__reuses_fileResult():
+    fileResult = {'fileHandleId': '42', 'preSignedURL': 'https://fake.url/42',
+                  'fileHandle': {'id': '42', 'contentMd5': 'abc', 'concreteType': concrete_types.S3_FILE_HANDLE}}
+    destination = os.path.join(tempfile.mkdtemp(), 'fname.ext')
+    with patch.object(syn, "_getFileHandleDownload") as mocked_getFileHandleDownload, \
+         patch.object(syn, "_download_from_URL", return_value=destination) as mocked_download_from_URL, \
+         patch.object(syn.cache, "add"):
+        assert_equals(destination, syn._downloadFileHandle('42', 'syn789', 'FileEntity', destination, fileResult=fileResult))
+
+    assert_false(mocked_getFileHandleDownload.called)
+    mocked_download_from_URL.assert_called_once_with('https://fake.url/42', destination, '42', expected_md5='abc')
@@ -1,12 +1,21 @@
+import errno
 import os
 import random
 import time
 from threading import Thread
 from datetime import timedelta
+from mock import patch
+from nose.tools import assert_raises
 import synapseclient.utils as utils
+from synapseclient.exceptions import SynapseFileCacheError
 from synapseclient.lock import Lock
 
 
+def teardown_module():
+    ## flock lock files are left in place when a lock is released
+    if os.path.exists("foo.flock"):
+        os.remove("foo.flock")
+
 
 def test_lock():
     user1_lock = Lock("foo", max_age=timedelta(seconds=5))
@@ -38,8 +47,9 @@ def test_with_lock():
 
 
 def test_lock_timeout():
-    user1_lock = Lock("foo", max_age=timedelta(seconds=1))
-    user2_lock = Lock("foo", max_age=timedelta(seconds=1))
+    ## only lock directories are broken when they get old
+    user1_lock = Lock("foo", max_age=timedelta(seconds=1), use_flock=False)
+    user2_lock = Lock("foo", max_age=timedelta(seconds=1), use_flock=False)
 
     with user1_lock:
         assert user1_lock.held == True
@@ -50,6 +60,80 @@ def test_lock_timeout():
         assert user2_lock.acquire(break_old_locks=True)
 
 
+def test_flock_is_not_broken():
+    user1_lock = Lock("foo", max_age=timedelta(seconds=1))
+    user2_lock = Lock("foo", max_age=timedelta(seconds=1))
+
+    with user1_lock:
+        time.sleep(1.1)
+        assert not user2_lock.acquire(break_old_locks=True)
+        assert_raises(SynapseFileCacheError, user2_lock.blocking_acquire, timeout=timedelta(seconds=0.2))
+    assert user2_lock.acquire()
+    user2_lock.release()
+
+
+def test_shared_locks():
+    reader1 = Lock("foo", shared=True)
+    reader2 = Lock("foo", shared=True)
+    writer = Lock("foo")
+
+    assert reader1.acquire()
+    assert reader2.acquire()
+    assert not writer.acquire()
+    reader1.release()
+    reader2.release()
+
+    assert writer.acquire()
+    assert not reader1.acquire()
+    writer.release()
+
+
+def test_shared_lock_without_flock():
+    ## a lock directory can't be shared, so nothing is locked
+    reader = Lock("foo", shared=True, use_flock=False)
+    assert reader.acquire()
+    assert not os.path.exists(reader.lock_dir_path)
+    writer = Lock("foo", use_flock=False)
+    assert writer.acquire()
+    writer.release()
+    reader.release()
+    assert not reader.held
+
+
+def test_blocking_acquire__waits_for_release():
+    user1_lock = Lock("foo")
+    user2_lock = Lock("foo")
+    user1_lock.acquire()
+
+    releaser = Thread(target=lambda: (time.sleep(0.2), user1_lock.release()))
+    releaser.start()
+    user2_lock.blocking_acquire(timeout=timedelta(seconds=5))
+    assert user2_lock.held
+    releaser.join()
+    user2_lock.release()
+
+
+def test_blocking_acquire__free_lock_without_waiter_thread():
+    lock = Lock("foo")
+    with patch.object(Lock, '_blocking_flock') as mocked_blocking_flock:
+        lock.blocking_acquire(timeout=timedelta(seconds=5))
+        assert lock.held
+        lock.release()
+        with lock:
+            assert lock.held
+    mocked_blocking_flock.assert_not_called()
+
+
+def test_flock_unsupported__falls_back_to_lock_directory():
+    lock = Lock("foo")
+    with patch("fcntl.flock", side_effect=IOError(errno.ENOLCK, "No locks available")):
+        assert lock.acquire()
+    assert not lock.use_flock
+    assert os.path.isdir(lock.lock_dir_path)
+    lock.release()
+    assert not os.path.exists(lock.lock_dir_path)
+
+
 ## Try to hammer away at the locking mechanism from multiple threads
 NUMBER_OF_TIMES_PER_THREAD = 3
 
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from mock import patch
+from nose.tools import assert_equals
+
+from synapseclient import md5_cache, utils
+from synapseclient.md5_cache import Md5Cache
+
+
+class TestMd5Cache(object):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file.txt')
+        with open(self.path, 'wb') as f:
+            f.write(b'first version')
+        self.cache = Md5Cache(os.path.join(self.dir, md5_cache.MD5_CACHE_FILENAME))
+
+    def teardown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def test_md5_for_file(self):
+        with patch.object(utils, "md5_for_file", wraps=utils.md5_for_file) as mocked_md5:
+            assert_equals(hashlib.md5(b'first version').hexdigest(), self.cache.md5_for_file(self.path))
+            assert_equals(hashlib.md5(b'first version').hexdigest(), self.cache.md5_for_file(self.path))
+            assert_equals(1, mocked_md5.call_count)
+
+            ## another client using the same cache root doesn't read the file either
+            other = Md5Cache(self.cache.db_path)
+            assert_equals(hashlib.md5(b'first version').hexdigest(), other.md5_for_file(self.path))
+            other.close()
+            assert_equals(1, mocked_md5.call_count)
+
+            ## a modified file is hashed again
+            with open(self.path, 'wb') as f:
+                f.write(b'second version, longer')
+            assert_equals(hashlib.md5(b'second version, longer').hexdigest(), self.cache.md5_for_file(self.path))
+            assert_equals(2, mocked_md5.call_count)
+
+    def test_md5_for_file__modified_time_or_inode_changed(self):
+        md5 = self.cache.md5_for_file(self.path)
+        with patch.object(md5_cache, "_file_key", return_value=(13, 1, 2)), \
+             patch.object(utils, "md5_for_file", wraps=utils.md5_for_file) as mocked_md5:
+            assert_equals(md5, self.cache.md5_for_file(self.path))
+            assert_equals(1, mocked_md5.call_count)
+
+    def test_md5s_for_file_parts(self):
+        def compute(filepath, partSize):
+            return 'md5', ['part md5 %d' % partSize]
+
+        with patch.object(utils, "md5_for_file", wraps=utils.md5_for_file) as mocked_md5:
+            assert_equals(('md5', ['part md5 5']), self.cache.md5s_for_file_parts(self.path, 5, compute))
+            ## the MD5 of the whole file is known now
+            assert_equals('md5', self.cache.md5_for_file(self.path))
+            assert not mocked_md5.called
+        assert_equals(('md5', ['part md5 5']), self.cache.md5s_for_file_parts(self.path, 5, lambda f, p: None))
+        ## a different part size is computed again
+        assert_equals(('md5', ['part md5 8']), self.cache.md5s_for_file_parts(self.path, 8, compute))
+
+    def test_md5_for_file__missing_database_directory(self):
+        cache = Md5Cache(os.path.join(self.dir, 'no', 'such', 'dir', md5_cache.MD5_CACHE_FILENAME))
+        assert_equals(hashlib.md5(b'first version').hexdigest(), cache.md5_for_file(self.path))
+        assert_equals(hashlib.md5(b'first version').hexdigest(), cache.md5_for_file(self.path))
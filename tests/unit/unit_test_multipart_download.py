@@ -0,0 +1,102 @@
+import unit
+import hashlib, json, os, re, shutil, tempfile
+from mock import patch, MagicMock
+from nose.tools import assert_equals, assert_raises, assert_false, assert_true
+
+import synapseclient
+from synapseclient import multipart_download
+from synapseclient.multipart_download import get_byte_ranges, download_file_in_parts, RangeNotSupportedError
+from synapseclient.exceptions import SynapseMd5MismatchError
+from synapseclient.utils import temp_download_filename
+
+
+def setup(module):
+    module.syn = unit.syn
+
+
+class MockRangedGet(object):
+    """a callable that mocks requests.get, serving the byte range in the Range header"""
+    def __init__(self, contents, status_code=206):
+        self.contents = contents
+        self.status_code = status_code
+        self.requested_ranges = []
+
+    def __call__(self, url, headers=None, **kwargs):
+        start, end = [int(x) for x in re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()]
+        self.requested_ranges.append((start, end))
+        data = self.contents[start:end+1]
+        response = MagicMock()
+        response.status_code = self.status_code
+        response.headers = {'content-length': len(data)}
+        response.iter_content = lambda buffer_size: (data[i:i+buffer_size] for i in range(0, len(data), buffer_size))
+        return response
+
+
+def mock_generateSignedHeaders(url, headers=None):
+    return headers
+
+
+def test_get_byte_ranges():
+    assert_equals([(1, 0, 9)], get_byte_ranges(10, 10))
+    assert_equals([(1, 0, 3), (2, 4, 7), (3, 8, 9)], get_byte_ranges(10, 4))
+    assert_equals([], get_byte_ranges(0, 4))
+
+
+class TestDownloadFileInParts:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.destination = os.path.join(self.tmp_dir, "fname.ext")
+        self.contents = os.urandom(1000)
+        self.md5 = hashlib.md5(self.contents).hexdigest()
+        self.url = "https://fakeurl.com/fname.ext"
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _download(self, mock_get, **kwargs):
+        with patch.object(syn._requests_session, 'get', side_effect=mock_get), \
+             patch.object(synapseclient.client.Synapse, '_generateSignedHeaders', side_effect=mock_generateSignedHeaders):
+            return download_file_in_parts(syn, self.url, self.destination, len(self.contents), fileHandleId=123,
+                                          expected_md5=self.md5, partSize=100, max_threads=4, **kwargs)
+
+    def test_download(self):
+        mock_get = MockRangedGet(self.contents)
+        path = self._download(mock_get)
+
+        assert_equals(self.destination, path)
+        with open(path, 'rb') as f:
+            assert_equals(self.contents, f.read())
+        assert_equals(10, len(mock_get.requested_ranges))
+        temp_destination = temp_download_filename(self.destination, 123)
+        assert_false(os.path.exists(temp_destination))
+        assert_false(os.path.exists(temp_destination + multipart_download.PART_STATUS_SUFFIX))
+
+    def test_resume_fetches_only_missing_parts(self):
+        temp_destination = temp_download_filename(self.destination, 123)
+        with open(temp_destination, 'wb') as f:
+            f.write(self.contents[:300])
+            f.truncate(len(self.contents))
+        with open(temp_destination + multipart_download.PART_STATUS_SUFFIX, 'w') as f:
+            json.dump({'fileSize': len(self.contents), 'partSize': 100, 'completedParts': [1, 2, 3]}, f)
+
+        mock_get = MockRangedGet(self.contents)
+        path = self._download(mock_get)
+
+        with open(path, 'rb') as f:
+            assert_equals(self.contents, f.read())
+        assert_equals(set((i*100, i*100+99) for i in range(3, 10)), set(mock_get.requested_ranges))
+
+    def test_md5_mismatch(self):
+        self.md5 = "fake md5 is fake"
+        assert_raises(SynapseMd5MismatchError, self._download, MockRangedGet(self.contents))
+        assert_false(os.path.exists(self.destination))
+        assert_false(os.path.exists(temp_download_filename(self.destination, 123)))
+
+    def test_range_not_supported(self):
+        assert_raises(RangeNotSupportedError, self._download, MockRangedGet(self.contents, status_code=200))
+
+    def test_no_progress_raises_for_caller_to_retry(self):
+        mock_get = MagicMock(side_effect=Exception("URL expired"))
+        with patch.object(syn, '_build_retry_policy', return_value={'retries': 0}):
+            assert_raises(Exception, self._download, mock_get)
+        assert_true(os.path.exists(temp_download_filename(self.destination, 123)))
@@ -1,13 +1,12 @@
 import unit
-import filecmp, math, os, tempfile
-from nose.tools import assert_raises, assert_true, assert_greater_equal
-from synapseclient.multipart_upload import find_parts_to_upload, count_completed_parts, calculate_part_size, get_file_chunk, _upload_chunk
+import filecmp, hashlib, math, os, tempfile
+from nose.tools import assert_raises, assert_true, assert_greater_equal, assert_equals
+from synapseclient.multipart_upload import find_parts_to_upload, count_completed_parts, calculate_part_size, get_file_chunk, _upload_chunk, md5s_for_file_parts, MemoryMappedFile, multipart_upload_stream
 from synapseclient.utils import MB, GB, make_bogus_binary_file
-from synapseclient.exceptions import  SynapseHTTPError
+from synapseclient.exceptions import  SynapseHTTPError, SynapseError
 from synapseclient import multipart_upload
-from multiprocessing import Value
+from synapseclient.dict_object import DictObject
 from multiprocessing.dummy import Pool
-from ctypes import c_bool
 from mock import patch, MagicMock
 import warnings
 
@@ -15,6 +14,11 @@ def setup(module):
     module.syn = unit.syn
 
 
+def _upload_state(fileSize, partSize, partsState):
+    return multipart_upload._UploadState(syn, 'foo.txt', fileSize, partSize,
+                                         DictObject(uploadId='7', partsState=partsState, state='UPLOADING'))
+
+
 def test_find_parts_to_upload():
     assert find_parts_to_upload("") == []
     assert find_parts_to_upload("111111111111111111") == []
@@ -68,6 +72,54 @@ def test_chunks():
             os.remove(out.name)
 
 
+def test_memory_mapped_file():
+    filepath = make_bogus_binary_file(n=100*1024)
+    try:
+        with MemoryMappedFile(filepath) as mapped_file:
+            for n in range(1, 5):
+                chunk = mapped_file.get_chunk(n, 30*1024)
+                assert_equals(get_file_chunk(filepath, n, 30*1024), bytes(chunk))
+                assert_equals(hashlib.md5(get_file_chunk(filepath, n, 30*1024)).hexdigest(), hashlib.md5(chunk).hexdigest())
+    finally:
+        os.remove(filepath)
+
+    ## empty files can't be mapped
+    with tempfile.NamedTemporaryFile(delete=False) as empty:
+        pass
+    try:
+        with MemoryMappedFile(empty.name) as mapped_file:
+            assert_equals(b'', mapped_file.get_chunk(1, 1024))
+    finally:
+        os.remove(empty.name)
+
+
+def test_md5s_for_file_parts():
+    for file_size in (0, 3000, 4096, 10000):
+        filepath = make_bogus_binary_file(n=file_size)
+        try:
+            with open(filepath, 'rb') as f:
+                content = f.read()
+            md5, part_md5s = md5s_for_file_parts(filepath, partSize=1024, block_size=300)
+            assert_equals(hashlib.md5(content).hexdigest(), md5)
+            expected_parts = [hashlib.md5(content[i:i+1024]).hexdigest() for i in range(0, file_size, 1024)] or \
+                             [hashlib.md5(b'').hexdigest()]
+            assert_equals(expected_parts, part_md5s)
+        finally:
+            os.remove(filepath)
+
+
+def test_upload_chunk__uses_known_part_md5():
+    state = _upload_state(10, 5, '00')
+    part = {'uploadPresignedUrl': 'https://www.fake.url/part2', 'partNumber': 2}
+    with patch.object(multipart_upload, "_put_chunk"), \
+         patch.object(multipart_upload, "_add_part", return_value={'addPartState': 'ADD_SUCCESS'}) as mocked_add_part, \
+         patch.object(multipart_upload, "printTransferProgress"):
+        _upload_chunk(part, state=state, syn=syn, get_chunk_function=lambda n, partSize: b'chunk', partSize=5,
+                      part_md5s=['md5 of part 1', 'md5 of part 2'])
+    mocked_add_part.assert_called_once_with(syn, uploadId='7', partNumber=2, partMD5Hex='md5 of part 2')
+    assert_equals(5, state.completed)
+
+
 def test_upload_chunk__expired_url():
     upload_parts = [{'uploadPresignedUrl': 'https://www.fake.url/fake/news',
                      'partNumber': 420},
@@ -79,24 +131,142 @@ def test_upload_chunk__expired_url():
                      'partNumber': 423}
                     ]
 
-    value_doesnt_matter = None
-    expired = Value(c_bool, False)
-    mocked_get_chunk_function = MagicMock(side_effect=[1,2,3,4])
+    state = _upload_state(4, 1, '0000')
+    mocked_get_chunk_function = MagicMock(side_effect=[b'1', b'2', b'3', b'4'])
 
-    with patch.object(multipart_upload, "_put_chunk", side_effect=SynapseHTTPError("useless message", response=MagicMock(status_code=403))) as mocked_put_chunk, \
+    def put_chunk(url, chunk, verbose, rate_limiter, session=None):
+        if not url.startswith('https://refreshed/'):
+            raise SynapseHTTPError("useless message", response=MagicMock(status_code=403))
+
+    def refresh(syn, uploadId, partNumbers):
+        return [{'partNumber': n, 'uploadPresignedUrl': 'https://refreshed/%d' % n} for n in partNumbers]
+
+    with patch.object(multipart_upload, "_put_chunk", side_effect=put_chunk) as mocked_put_chunk, \
+         patch.object(multipart_upload, "_get_presigned_url_batch", side_effect=refresh) as mocked_refresh, \
+         patch.object(multipart_upload, "_add_part", return_value={'addPartState': 'ADD_SUCCESS'}), \
+         patch.object(multipart_upload, "printTransferProgress"), \
          patch.object(warnings, "warn") as mocked_warn:
-        chunk_upload = lambda part: _upload_chunk(part, completed=value_doesnt_matter, status=value_doesnt_matter,
-                                                  syn=syn, filename=value_doesnt_matter,
-                                                  get_chunk_function=mocked_get_chunk_function,
-                                                  fileSize=value_doesnt_matter, partSize=value_doesnt_matter, t0=value_doesnt_matter,
-                                                  expired=expired, bytes_already_uploaded=value_doesnt_matter)
+        chunk_upload = lambda part: _upload_chunk(part, state=state, syn=syn,
+                                                  get_chunk_function=mocked_get_chunk_function, partSize=1)
         # 2 threads both with urls that have expired
         mp = Pool(4)
         mp.map(chunk_upload, upload_parts)
-        assert_true(expired.value)
+        assert not mocked_warn.called
+
+        # only the URL of each part that was rejected was replaced and every part was uploaded
+        assert_equals(sorted([syn, '7', [n]] for n in range(420, 424)),
+                      sorted(list(c[0]) for c in mocked_refresh.call_args_list))
+        assert_equals(8, len(mocked_put_chunk.call_args_list))
+        assert_equals(4, state.completed)
+
+
+def test_upload_chunk__refreshes_url_that_expired_before_use():
+    expired_url = 'https://bucket.s3.amazonaws.com/key?X-Amz-Date=20170101T000000Z&X-Amz-Expires=900'
+    part = {'uploadPresignedUrl': expired_url, 'partNumber': 1}
+    new_urls = [{'partNumber': 1, 'uploadPresignedUrl': 'https://refreshed/1'}]
+    with patch.object(multipart_upload, "_put_chunk") as mocked_put_chunk, \
+         patch.object(multipart_upload, "_get_presigned_url_batch", return_value=new_urls) as mocked_refresh, \
+         patch.object(multipart_upload, "_add_part", return_value={'addPartState': 'ADD_SUCCESS'}), \
+         patch.object(multipart_upload, "printTransferProgress"):
+        _upload_chunk(part, state=_upload_state(5, 5, '0'), syn=syn,
+                      get_chunk_function=lambda n, partSize: b'chunk', partSize=5)
+    mocked_refresh.assert_called_once_with(syn, '7', [1])
+    mocked_put_chunk.assert_called_once_with('https://refreshed/1', b'chunk', syn.debug, syn._rate_limiter, session=None)
+
+
+def test_upload_state__rounds():
+    state = _upload_state(10, 5, '00')
+    with patch.object(multipart_upload, "printTransferProgress"):
+        assert_equals([1, 2], state.start_round())
+        state.part_added(1, {'addPartState': 'ADD_SUCCESS'}, 5)
+        state.part_added(2, {'addPartState': 'ADD_FAILED'}, 5)
+        assert not state.end_round(DictObject(uploadId='7', partsState='10', state='UPLOADING'))
+        assert_equals(0, state.retries)
+
+        ## a round that adds no parts counts as a retry
+        assert_equals([2], state.start_round())
+        assert_equals(5, state.completed)
+        assert not state.end_round(DictObject(uploadId='7', partsState='10', state='UPLOADING'))
+        assert_equals(1, state.retries)
+
+        state.start_round()
+        state.part_added(2, {'addPartState': 'ADD_SUCCESS'}, 5)
+        assert state.end_round(DictObject(uploadId='7', partsState='11', state='UPLOADING'))
+    assert_raises(SynapseError, state.result)
+    assert state.completed_with(DictObject(uploadId='7', state='COMPLETED', resultFileHandleId='42'))
+    assert_equals('42', state.result()['resultFileHandleId'])
+
+
+def test_get_presigned_urls__fetches_batches_as_needed():
+    def batch(syn, uploadId, partNumbers):
+        return [{'partNumber': n, 'uploadPresignedUrl': 'https://url/%d' % n} for n in partNumbers]
+
+    with patch.object(multipart_upload, "_get_presigned_url_batch", side_effect=batch) as mocked_batch:
+        urls = multipart_upload._get_presigned_urls(syn, '7', [1, 2, 3, 5, 8], batch_size=2)
+        assert_equals(1, next(urls)['partNumber'])
+        mocked_batch.assert_called_once_with(syn, '7', [1, 2])
+        assert_equals([2, 3, 5, 8], [part['partNumber'] for part in urls])
+        assert_equals([[1, 2], [3, 5], [8]], [c[0][2] for c in mocked_batch.call_args_list])
+
+
+def test_multipart_upload_stream():
+    ## an odd-sized generator whose blocks don't line up with the parts
+    blocks = [b'x' * 3*MB for i in range(6)] + [b'tail']
+    data = b''.join(blocks)
+    partSize = 8*MB
+    uploaded = {}
+
+    def upload(syn, filename, contentType, get_chunk_function, md5, fileSize, partSize,
+                         part_md5s, storageLocationId, **kwargs):
+        for n in range(1, len(part_md5s) + 1):
+            uploaded[n] = get_chunk_function(n, partSize)
+        return {'resultFileHandleId': '42'}
+
+    with patch.object(multipart_upload, "_multipart_upload", side_effect=upload) as mocked_upload:
+        assert_equals('42', multipart_upload_stream(syn, iter(blocks), 'out.bin', partSize=partSize))
+
+    kwargs = mocked_upload.call_args[1]
+    assert_equals(hashlib.md5(data).hexdigest(), kwargs['md5'])
+    assert_equals(len(data), kwargs['fileSize'])
+    assert_equals(partSize, kwargs['partSize'])
+    assert_equals('application/octet-stream', mocked_upload.call_args[0][2])
+    chunks = [data[i:i+partSize] for i in range(0, len(data), partSize)]
+    assert_equals([hashlib.md5(chunk).hexdigest() for chunk in chunks], kwargs['part_md5s'])
+    assert_equals(chunks, [uploaded[n] for n in sorted(uploaded)])
+
+
+def test_choose_part_size():
+    monitor = MagicMock(rtt=0.3, throughput=10*MB, failure_rate=0.0)
+    monitor.recommend.return_value = (30*MB, 4)
+    with patch.object(syn, "adaptive_part_size", False), \
+         patch.object(syn, "_throughput_monitor", monitor):
+        assert_equals((8*MB, None), multipart_upload._choose_part_size(syn, GB))
+        with patch.object(syn, "adaptive_part_size", True):
+            assert_equals((30*MB, 4), multipart_upload._choose_part_size(syn, GB))
+            ## a part size that is asked for is kept
+            assert_equals((16*MB, None), multipart_upload._choose_part_size(syn, GB, 16*MB))
+            ## nothing measured yet
+            monitor.recommend.return_value = None
+            assert_equals((8*MB, None), multipart_upload._choose_part_size(syn, GB))
+
+
+def test_get_part_upload_session():
+    original = syn._part_upload_session
+    try:
+        syn._part_upload_session = None
+        with patch.object(syn, "max_threads", 3):
+            session = multipart_upload._get_part_upload_session(syn)
+            assert_equals(4, session.get_adapter('https://s3.amazonaws.com')._pool_maxsize)
+            assert session is multipart_upload._get_part_upload_session(syn)
+            assert_equals((0, 0), multipart_upload._connection_stats(session))
+        with patch.object(syn, "max_threads", 7):
+            assert session is not multipart_upload._get_part_upload_session(syn)
+    finally:
+        syn._part_upload_session = original
 
-        # assert warnings.warn was only called once
-        mocked_warn.assert_called_once_with("The presigned upload URL has expired. Restarting upload...\n")
 
-        # assert _put_chunk was called at least once
-        assert_greater_equal(len(mocked_put_chunk.call_args_list), 1)
+def test_put_chunk__session():
+    session = MagicMock()
+    session.put.return_value = MagicMock(status_code=200, content=b'')
+    multipart_upload._put_chunk('https://s3/part', b'chunk', session=session)
+    session.put.assert_called_once_with('https://s3/part', data=b'chunk')
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from nose.tools import assert_equals, assert_raises, assert_is, assert_is_not, assert_less_equal
+
+from synapseclient import pool_provider
+from synapseclient.pool_provider import TransferPool, get_transfer_pool
+
+
+def test_map():
+    pool = TransferPool(4)
+    assert_equals([x * x for x in range(50)], pool.map(lambda x: x * x, range(50)))
+    assert_equals([], pool.map(lambda x: x, []))
+
+
+def test_map__raises_exceptions():
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("three")
+        return x
+    assert_raises(ValueError, TransferPool(2).map, fail_on_three, range(10))
+
+
+def test_map__max_workers():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def work(x):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    TransferPool(8).map(work, range(20), max_workers=3)
+    assert_less_equal(running[1], 3)
+
+
+def test_map__nested_maps_do_not_deadlock():
+    ## every thread of the pool is busy with an outer item that maps inner items
+    pool = TransferPool(2)
+    result = pool.map(lambda x: sum(pool.map(lambda y: x * y, range(5))), range(6))
+    assert_equals([x * 10 for x in range(6)], result)
+
+
+def test_get_transfer_pool():
+    original = pool_provider._pools
+    try:
+        pool_provider._pools = {}
+        pool = get_transfer_pool(3)
+        assert_is(pool, get_transfer_pool(3))
+        resized = get_transfer_pool(5)
+        assert_is_not(pool, resized)
+        assert_equals(5, resized.max_threads)
+        ## the pool of the other size is still usable
+        assert_equals([0, 2, 4], pool.map(lambda x: 2 * x, range(3)))
+        assert_is(pool, get_transfer_pool(3))
+    finally:
+        pool_provider._pools = original
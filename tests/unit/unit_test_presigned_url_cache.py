@@ -0,0 +1,42 @@
+from mock import patch
+from nose.tools import assert_equals, assert_is_none
+
+from synapseclient import utils
+from synapseclient.presigned_url_cache import get_expiration_time, PresignedUrlCache
+
+SIGNED_AT = utils.to_unix_epoch_time_secs(utils.iso_to_datetime('2018-01-02T03:04:05.000Z'))
+V4_URL = 'https://bucket.s3.amazonaws.com/key?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Date=20180102T030405Z' \
+         '&X-Amz-Expires=900&X-Amz-Signature=abc'
+
+
+def test_get_expiration_time():
+    assert_equals(SIGNED_AT + 900, get_expiration_time(V4_URL))
+    assert_equals(1514862245, get_expiration_time('https://bucket.s3.amazonaws.com/key?AWSAccessKeyId=A'
+                                                  '&Expires=1514862245&Signature=abc'))
+    assert_equals(SIGNED_AT + 60, get_expiration_time('https://storage.googleapis.com/key?X-Goog-Date=20180102T030405Z'
+                                                      '&X-Goog-Expires=60'))
+    assert_is_none(get_expiration_time('https://www.synapse.org/file.txt'))
+    assert_is_none(get_expiration_time('https://bucket.s3.amazonaws.com/key?Expires=soon'))
+
+
+def test_cache_evicts_before_expiry():
+    cache = PresignedUrlCache(margin=60)
+    result = {'fileHandleId': '123', 'preSignedURL': V4_URL}
+    cache.put(123, 'syn456', 'FileEntity', result)
+    with patch('time.time', return_value=SIGNED_AT + 900 - 61):
+        assert_equals(result, cache.get('123', 'syn456', 'FileEntity'))
+        assert_is_none(cache.get('123', 'syn456', 'TableEntity'))
+    with patch('time.time', return_value=SIGNED_AT + 900 - 59):
+        assert_is_none(cache.get('123', 'syn456', 'FileEntity'))
+
+
+def test_cache_skips_urls_without_expiry_and_bounds_its_size():
+    cache = PresignedUrlCache(max_entries=2)
+    cache.put(1, 'syn1', 'FileEntity', {'preSignedURL': 'https://www.synapse.org/file.txt'})
+    for fileHandleId in [2, 3, 4]:
+        cache.put(fileHandleId, 'syn1', 'FileEntity', {'preSignedURL': V4_URL})
+    with patch('time.time', return_value=SIGNED_AT):
+        assert_equals([None, None, None, V4_URL, V4_URL],
+                      [(cache.get(i, 'syn1', 'FileEntity') or {}).get('preSignedURL') for i in range(5)])
+        cache.remove(3, 'syn1', 'FileEntity')
+        assert_is_none(cache.get(3, 'syn1', 'FileEntity'))
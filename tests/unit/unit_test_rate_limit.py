@@ -0,0 +1,32 @@
+from mock import patch, call
+from nose.tools import assert_equals, assert_false
+
+from synapseclient.rate_limit import TokenBucket, TransferRateLimiter
+
+
+def test_token_bucket():
+    with patch('time.time', return_value=100.0) as mock_time, patch('time.sleep') as mock_sleep:
+        bucket = TokenBucket(rate=10)
+        # a full second's worth of tokens is available without waiting
+        bucket.consume(10)
+        assert_false(mock_sleep.called)
+
+        # going into debt waits until it would have been paid off
+        bucket.consume(5)
+        mock_sleep.assert_called_once_with(0.5)
+
+        # tokens are refilled over time, up to the capacity
+        mock_time.return_value = 110.0
+        bucket.consume(10)
+        bucket.consume(20)
+        assert_equals([call(0.5), call(2.0)], mock_sleep.call_args_list)
+
+
+def test_transfer_rate_limiter__unset_limits_are_not_enforced():
+    limiter = TransferRateLimiter(max_download_rate=100)
+    with patch('time.sleep') as mock_sleep:
+        limiter.limit_upload(10**9)
+        limiter.limit_request()
+        assert_false(mock_sleep.called)
+        limiter.limit_download(10**9)
+        assert mock_sleep.called
@@ -0,0 +1,147 @@
+import unit
+import io, os, re, shutil, tempfile
+from mock import patch, MagicMock
+from nose.tools import assert_equals, assert_raises, assert_true
+
+import synapseclient
+from synapseclient import File, Folder
+from synapseclient.exceptions import SynapseHTTPError
+from synapseclient.remote_file import RemoteFile
+
+
+def setup(module):
+    module.syn = unit.syn
+
+
+class MockRangedGet(object):
+    """a callable that mocks requests.get, serving the byte range in the Range header of unexpired URLs"""
+    def __init__(self, contents, expired_urls=()):
+        self.contents = contents
+        self.expired_urls = expired_urls
+        self.requested_ranges = []
+
+    def __call__(self, url, headers=None, **kwargs):
+        response = MagicMock()
+        response.headers = {}
+        if url in self.expired_urls:
+            response.status_code = 403
+            response.reason = 'Forbidden'
+            response.text = 'Request has expired'
+            return response
+        start, end = [int(x) for x in re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()]
+        self.requested_ranges.append((start, end))
+        response.status_code = 206
+        response.content = self.contents[start:end+1]
+        return response
+
+
+def mock_generateSignedHeaders(url, headers=None):
+    return headers
+
+
+class TestRemoteFile:
+    def setup(self):
+        self.contents = os.urandom(1000)
+        self.urls = ['https://fakeurl.com/expired', 'https://fakeurl.com/fresh']
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _open(self, mock_get, **kwargs):
+        remote = io.BufferedReader(RemoteFile(syn, 123, 'syn456', 'FileEntity', len(self.contents),
+                                              name='fname.ext', blockSize=100, **kwargs))
+        self.patches = [patch.object(syn._requests_session, 'get', side_effect=mock_get),
+                        patch.object(synapseclient.client.Synapse, '_generateSignedHeaders',
+                                     side_effect=mock_generateSignedHeaders),
+                        patch.object(synapseclient.client.Synapse, '_getFileHandleDownload',
+                                     side_effect=[{'preSignedURL': url} for url in self.urls])]
+        for p in self.patches:
+            p.start()
+        return remote
+
+    def _close(self, remote):
+        remote.close()
+        for p in self.patches:
+            p.stop()
+
+    def test_seek_and_read(self):
+        mock_get = MockRangedGet(self.contents)
+        remote = self._open(mock_get)
+        try:
+            remote.seek(250)
+            assert_equals(self.contents[250:420], remote.read(170))
+            remote.seek(-10, io.SEEK_END)
+            assert_equals(self.contents[-10:], remote.read())
+            assert_equals(b'', remote.read(10))
+            remote.seek(0)
+            assert_equals(self.contents, remote.read())
+        finally:
+            self._close(remote)
+        assert_equals((200, 299), mock_get.requested_ranges[0])
+        # blocks that are cached in memory are not fetched again
+        assert_equals(len(set(mock_get.requested_ranges)), len(mock_get.requested_ranges))
+
+    def test_least_recently_used_blocks_are_evicted(self):
+        mock_get = MockRangedGet(self.contents)
+        remote = self._open(mock_get, maxCachedBlocks=2)
+        try:
+            for offset in [0, 500, 0, 900, 500]:
+                remote.seek(offset)
+                remote.read(1)
+        finally:
+            self._close(remote)
+        assert_equals([(0, 99), (500, 599), (900, 999), (500, 599)], mock_get.requested_ranges)
+
+    def test_disk_cache(self):
+        mock_get = MockRangedGet(self.contents)
+        remote = self._open(mock_get, cacheDir=self.tmp_dir)
+        try:
+            assert_equals(self.contents[:150], remote.read(150))
+        finally:
+            self._close(remote)
+
+        mock_get = MockRangedGet(self.contents)
+        remote = self._open(mock_get, cacheDir=self.tmp_dir)
+        try:
+            assert_equals(self.contents[:300], remote.read(300))
+        finally:
+            self._close(remote)
+        assert_equals([(200, 299)], mock_get.requested_ranges)
+
+    def test_expired_url_is_refreshed(self):
+        mock_get = MockRangedGet(self.contents, expired_urls=[self.urls[0]])
+        remote = self._open(mock_get)
+        try:
+            assert_equals(self.contents[:10], remote.read(10))
+        finally:
+            self._close(remote)
+        assert_equals([(0, 99)], mock_get.requested_ranges)
+
+    def test_expired_url_twice(self):
+        mock_get = MockRangedGet(self.contents, expired_urls=self.urls)
+        remote = self._open(mock_get)
+        try:
+            assert_raises(SynapseHTTPError, remote.read, 10)
+        finally:
+            self._close(remote)
+
+
+def test_open__not_a_file():
+    bundle = {'entity': {'id': 'syn123', 'concreteType': Folder._synapse_entity_type},
+              'restrictionInformation': {'hasUnmetAccessRequirement': False}, 'fileHandles': []}
+    with patch.object(syn, '_getEntityBundle', return_value=bundle):
+        assert_raises(ValueError, syn.open, 'syn123')
+
+
+def test_open():
+    bundle = {'entity': {'id': 'syn123', 'concreteType': File._synapse_entity_type, 'dataFileHandleId': '42'},
+              'restrictionInformation': {'hasUnmetAccessRequirement': False},
+              'fileHandles': [{'id': '42', 'fileName': 'fname.ext', 'contentSize': 1000,
+                               'concreteType': 'org.sagebionetworks.repo.model.file.S3FileHandle'}]}
+    with patch.object(syn, '_getEntityBundle', return_value=bundle) as mock_getEntityBundle:
+        remote = syn.open('syn123', version=2)
+    mock_getEntityBundle.assert_called_once_with('syn123', 2)
+    assert_true(remote.seekable())
+    assert_equals('fname.ext', remote.name)
+    assert_equals(('42', 'syn123', 1000), (remote.raw.fileHandleId, remote.raw.objectId, remote.raw.size))
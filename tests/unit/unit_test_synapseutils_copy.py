@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from mock import MagicMock, patch
+from nose.tools import assert_equals, assert_raises
+
+import unit
+from synapseclient import Wiki
+from synapseclient.exceptions import SynapseFileNotFoundError, SynapseError
+from synapseutils.copy import _copy_cached_file_handles, copyWiki
+
+
+def setup(module):
+    module.syn = unit.syn
+
+
+def test_copy_cached_file_handles():
+    copied = {'copyResults': [{'originalFileHandleId': '1', 'newFileHandle': {'id': '11'}},
+                              {'originalFileHandleId': '2', 'newFileHandle': {'id': '12'}},
+                              {'originalFileHandleId': '3', 'failureCode': 'UNAUTHORIZED'}]}
+    looked_up = []
+    added = []
+
+    def get_many(file_handle_ids):
+        looked_up.extend(file_handle_ids)
+        return dict((id, '/cached/1' if id == '1' else None) for id in looked_up)
+
+    cache = MagicMock()
+    cache.get_many.side_effect = get_many
+    cache.add_many.side_effect = added.extend
+
+    _copy_cached_file_handles(cache, copied)
+
+    ## only the successful copies are looked up, and only those of cached files are added
+    assert_equals(['1', '2'], looked_up)
+    assert_equals([('11', '/cached/1')], added)
+
+
+def test_copyWiki__attachment_failures():
+    wiki = Wiki(id='1', owner='syn123', markdown='', attachmentFileHandleIds=['2'])
+    for failure, error in (('NOT_FOUND', SynapseFileNotFoundError), ('UNAUTHORIZED', SynapseError)):
+        with patch.object(syn, 'get', return_value={'id': 'syn123'}), \
+             patch.object(syn, 'getWikiHeaders', return_value=[MagicMock(id='1')]), \
+             patch.object(syn, 'getWiki', return_value=wiki), \
+             patch.object(syn, 'getFileHandleDownloads',
+                          return_value=[{'fileHandleId': '2', 'failureCode': failure}]):
+            assert_raises(error, copyWiki, syn, 'syn123', 'syn456')
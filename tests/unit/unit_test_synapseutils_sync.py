@@ -10,12 +10,12 @@ import tempfile
 import unit
 from mock import patch, create_autospec, Mock
 from nose import SkipTest
-from nose.tools import assert_dict_equal, assert_raises, assert_equals
+from nose.tools import assert_dict_equal, assert_raises, assert_equals, assert_greater, assert_in
 from builtins import str
 
 import synapseutils
 from synapseclient import Project, Schema, File
-from synapseclient.exceptions import SynapseHTTPError
+from synapseclient.exceptions import SynapseHTTPError, SynapseError
 
 try:
     from StringIO import StringIO
@@ -125,6 +125,77 @@ def test_syncFromSynapse__non_file_Entity():
         assert_raises(ValueError, synapseutils.syncFromSynapse, syn, table_schema)
 
 
+def test_syncFromSynapse__concurrent_downloads():
+    def _file(synapse_id, file_name):
+        ent = File(id=synapse_id, name=file_name, parentId='syn1', dataFileHandleId=synapse_id[3:])
+        ent._update_file_handle({'id': synapse_id[3:], 'fileName': file_name})
+        return ent
+    children = {'syn1': [{'id': 'syn2', 'name': 'f1.txt', 'type': 'org.sagebionetworks.repo.model.FileEntity'},
+                         {'id': 'syn3', 'name': 'folder', 'type': 'org.sagebionetworks.repo.model.Folder'},
+                         {'id': 'syn5', 'name': 'f2.txt', 'type': 'org.sagebionetworks.repo.model.FileEntity'}],
+                'syn3': [{'id': 'syn4', 'name': 'f3.txt', 'type': 'org.sagebionetworks.repo.model.FileEntity'}]}
+    entities = {'syn2': _file('syn2', 'same.txt'), 'syn4': _file('syn4', 'f3.txt'), 'syn5': _file('syn5', 'same.txt')}
+    downloaded = []
+
+    def _download_file_entity(location, ent, ifcollision, submission, fileResult=None):
+        downloaded.append((location, ent.id, fileResult['fileHandleId']))
+        ent.path = os.path.join(location, ent.name)
+
+    path = tempfile.mkdtemp()
+    with patch.object(syn, "getChildren", side_effect=lambda id: children[id]),\
+         patch.object(synapseutils.sync, "_get_entity_for_download", side_effect=lambda syn, id, link: entities[id]),\
+         patch.object(syn.cache, "get_many", side_effect=lambda ids, path=None: dict.fromkeys(ids)),\
+         patch.object(syn, "getFileHandleDownloads",
+                      side_effect=lambda associations: [{'fileHandleId': a['fileHandleId']} for a in associations])\
+                 as mock_getFileHandleDownloads,\
+         patch.object(syn, "_download_file_entity", side_effect=_download_file_entity),\
+         patch.object(synapseutils.sync, "generateManifest") as mock_generateManifest:
+        files = synapseutils.syncFromSynapse(syn, 'syn1', path=path, max_concurrent_downloads=4)
+
+    assert_equals(['syn2', 'syn4', 'syn5'], [f.id for f in files])
+    assert_equals(1, mock_getFileHandleDownloads.call_count)
+    # files written to the same path are downloaded in crawl order
+    same_path = [entity_id for location, entity_id, file_handle_id in downloaded if location == path]
+    assert_equals(['syn2', 'syn5'], same_path)
+    assert_equals(set([(path, 'syn2', '2'), (os.path.join(path, 'folder'), 'syn4', '4'), (path, 'syn5', '5')]),
+                  set(downloaded))
+    # the manifests list the same files as they would in a serial sync
+    manifests = [([f.id for f in call[0][1]], call[0][2]) for call in mock_generateManifest.call_args_list]
+    assert_equals([(['syn2', 'syn4'], os.path.join(path, 'folder', synapseutils.sync.MANIFEST_FILENAME)),
+                   (['syn2', 'syn4', 'syn5'], os.path.join(path, synapseutils.sync.MANIFEST_FILENAME))],
+                  manifests)
+
+
+def test_manifest_upload__concurrent_uploads():
+    ## c.txt used a.txt and b.txt, e.txt executed d.txt, which fails, and f.txt used e.txt
+    rows = [{'path': '/a.txt', 'used': [], 'executed': []},
+            {'path': '/b.txt', 'used': ['syn9'], 'executed': ['https://github.com']},
+            {'path': '/d.txt', 'used': [], 'executed': []},
+            {'path': '/c.txt', 'used': ['/a.txt', '/b.txt'], 'executed': []},
+            {'path': '/e.txt', 'used': [], 'executed': ['/d.txt']},
+            {'path': '/f.txt', 'used': ['/e.txt'], 'executed': []},
+            {'path': '/g.txt', 'used': [{'entity': {'id': 'syn8'}}], 'executed': []}]
+    df = Mock(iterrows=lambda: iter(enumerate(rows)))
+    stored = []
+
+    def store_row(syn, row):
+        if row['path'] == '/d.txt':
+            raise SynapseHTTPError('500 Server Error')
+        stored.append(row['path'])
+
+    with patch.object(synapseutils.sync, "_store_manifest_row", side_effect=store_row), \
+         patch.object(synapseutils.sync, "stderr") as mock_stderr:
+        assert_raises(SynapseError, synapseutils.sync._manifest_upload, syn, df, max_concurrent_uploads=3)
+
+    # the other files are stored, each after the files it references
+    assert_equals(set(['/a.txt', '/b.txt', '/c.txt', '/g.txt']), set(stored))
+    assert_greater(stored.index('/c.txt'), max(stored.index('/a.txt'), stored.index('/b.txt')))
+    # the file that failed and those that depend on it are reported
+    reported = ''.join(c[0][0] for c in mock_stderr.write.call_args_list)
+    for path in ('/d.txt', '/e.txt', '/f.txt'):
+        assert_in('Failed to store %s' % path, reported)
+
+
 def test_extract_file_entity_metadata__ensure_correct_row_metadata():
     #Test for SYNPY-692, where 'contentType' was incorrectly set on all rows except for the very first row.
 
@@ -0,0 +1,49 @@
+from nose.tools import assert_equals, assert_is_none, assert_less, assert_almost_equal
+
+from synapseclient.throughput import ThroughputMonitor, MAX_PART_SIZE
+from synapseclient.utils import MB, GB
+
+
+def test_recommend__nothing_measured():
+    monitor = ThroughputMonitor()
+    assert_is_none(monitor.recommend(GB, 8, 8*MB, 10000))
+    monitor.record_request(0.1)
+    assert_is_none(monitor.recommend(GB, 8, 8*MB, 10000))
+
+
+def test_recommend__fills_bandwidth_delay_product():
+    ## 10 MB/s per connection with a 300 ms round trip takes 30 MB parts to spend 10 round trips on each
+    monitor = ThroughputMonitor()
+    monitor.record_request(0.3)
+    monitor.record_transfer(20*MB, 2)
+    assert_equals((30*MB, 8), monitor.recommend(10*GB, 8, 8*MB, 10000))
+    ## a small file is not split into more parts than it needs threads
+    assert_equals((30*MB, 2), monitor.recommend(50*MB, 8, 8*MB, 10000))
+
+
+def test_recommend__bounds():
+    monitor = ThroughputMonitor()
+    ## a fast link close by still needs the smallest part size
+    monitor.record_request(0.001)
+    monitor.record_transfer(10*MB, 1)
+    assert_equals(8*MB, monitor.recommend(GB, 8, 8*MB, 10000)[0])
+    ## or one large enough to keep under the largest number of parts
+    assert_equals(10*MB, monitor.recommend(100000*MB, 8, 8*MB, 10000)[0])
+
+    monitor = ThroughputMonitor()
+    monitor.record_request(60)
+    monitor.record_transfer(GB, 1)
+    assert_equals(MAX_PART_SIZE, monitor.recommend(GB, 8, 8*MB, 10000)[0])
+
+
+def test_recommend__failures_shrink_parts():
+    ## parts are kept to a minute's worth at 1 MB/s, less the more of them fail
+    monitor = ThroughputMonitor(smoothing=0.5)
+    monitor.record_request(30)
+    monitor.record_transfer(MB, 1)
+    assert_equals(60*MB, monitor.recommend(GB, 8, 8*MB, 10000)[0])
+    monitor.record_failure()
+    assert_almost_equal(0.5, monitor.failure_rate)
+    assert_equals(30*MB, monitor.recommend(GB, 8, 8*MB, 10000)[0])
+    monitor.record_transfer(MB, 1)
+    assert_less(monitor.failure_rate, 0.5)
@@ -427,4 +427,30 @@ def test_calling_module():
     # 'unit_test' is the name of the module in which this test resides
     # we made a helper so that the call order is: case.some_function_for_running_tests() -> unit_test.test_calling_module() -> unit_test._calling_module_test_helper()
     # since both _calling_module_test_helper and test_calling_module are a part of the unit_test module, we can test that callers of the same module do indeed are skipped
-    assert_equal("case", _calling_module_test_helper())
\ No newline at end of file
+    assert_equal("case", _calling_module_test_helper())
+
+def test_link_or_copy_file():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp_dir, 'source.txt')
+        with open(source, 'w') as f:
+            f.write('some content')
+
+        for link_mode in utils.LINK_MODES:
+            destination = os.path.join(tmp_dir, link_mode + '.txt')
+            used = utils.link_or_copy_file(source, destination, link_mode)
+            with open(destination) as f:
+                assert_equal('some content', f.read())
+            if used == 'hardlink':
+                assert os.path.samefile(source, destination)
+            if used == 'symlink':
+                assert os.path.islink(destination)
+            # replaces an existing file
+            utils.link_or_copy_file(source, destination, 'copy')
+            assert not os.path.islink(destination)
+
+        with patch('os.link', side_effect=OSError(18, 'Invalid cross-device link')):
+            assert_equal('copy', utils.link_or_copy_file(source, os.path.join(tmp_dir, 'other.txt'), 'hardlink'))
+        assert_raises(ValueError, utils.link_or_copy_file, source, os.path.join(tmp_dir, 'x.txt'), 'teleport')
+    finally:
+        rmtree(tmp_dir)